@@ -0,0 +1,82 @@
+import tensorflow as tf
+from absl import app, flags, logging
+from absl.flags import FLAGS
+import numpy as np
+from tools import generate_detections as gdet
+
+flags.DEFINE_string('model', 'model_data/mars-small128.pb', 'path to the frozen ReID graph')
+flags.DEFINE_string('output', 'model_data/mars-small128-fp16.tflite', 'path to output')
+flags.DEFINE_string('input_name', 'images', 'name of the input tensor of the graph')
+flags.DEFINE_string('output_name', 'features', 'name of the output tensor of the graph')
+flags.DEFINE_string('quantize_mode', 'float16', 'quantize mode (float32, float16, int8), int8 quantizes the weights only (dynamic range)')
+flags.DEFINE_integer('num_samples', 256, 'number of random patches to compare the converted encoder with the frozen graph on')
+flags.DEFINE_float('max_distance', 0.01, 'fail if the features of an encoder backend are further than this cosine distance from those of the frozen graph')
+
+# output of the tf.map_fn that flips the channels of every image in the MARS
+# graph (tools/freeze_model.py). TFLite can not convert its TensorArray ops
+MAP_OUTPUT = 'map/TensorArrayStack/TensorArrayGatherV3'
+
+def save_tflite():
+  graph_def = gdet.load_graph_def(FLAGS.model)
+  input_node = next(node for node in graph_def.node if node.name == FLAGS.input_name)
+  input_shape = [d.size if d.size > 0 else None for d in input_node.attr['shape'].shape.dim]
+
+  with tf.compat.v1.Session(graph=tf.Graph()) as session:
+    images = tf.compat.v1.placeholder(tf.uint8, input_shape, name=FLAGS.input_name)
+    if any(node.name == MAP_OUTPUT for node in graph_def.node):
+      # the same flip as one tf.reverse over the whole batch
+      input_map = {MAP_OUTPUT + ':0': tf.reverse(tf.cast(images, tf.float32), axis=[-1])}
+    else:
+      input_map = {FLAGS.input_name + ':0': images}
+    features, = tf.compat.v1.import_graph_def(
+      graph_def, input_map=input_map, return_elements=[FLAGS.output_name + ':0'], name='net')
+    converter = tf.compat.v1.lite.TFLiteConverter.from_session(session, [images], [features])
+
+    if FLAGS.quantize_mode == 'float16':
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+      converter.target_spec.supported_types = [tf.float16]
+    elif FLAGS.quantize_mode == 'int8':
+      # weights to int8, activations stay float, so no calibration data is needed
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif FLAGS.quantize_mode != 'float32':
+      raise ValueError('unknown quantize mode {}'.format(FLAGS.quantize_mode))
+
+    tflite_model = converter.convert()
+  open(FLAGS.output, 'wb').write(tflite_model)
+
+  logging.info("model saved to: {}".format(FLAGS.output))
+
+def compare():
+  """Report how far the features of the converted encoder and of the TF2
+  function backend are from those of the frozen graph, and fail if one of
+  them is further than --max_distance."""
+  reference = gdet.ImageEncoder(FLAGS.model, FLAGS.input_name, FLAGS.output_name)
+  encoders = [
+    ('function', gdet.ImageEncoder(FLAGS.model, FLAGS.input_name, FLAGS.output_name, backend='function')),
+    ('tflite', gdet.ImageEncoder(FLAGS.output, backend='tflite'))]
+  patches = np.random.RandomState(0).randint(
+    0, 256, [FLAGS.num_samples] + list(reference.image_shape)).astype(np.uint8)
+  a = reference(patches)
+  a_unit = a / np.linalg.norm(a, axis=1, keepdims=True)
+  failed = []
+  for name, encoder in encoders:
+    b = encoder(patches)
+    b_unit = b / np.linalg.norm(b, axis=1, keepdims=True)
+    distance = 1. - np.sum(a_unit * b_unit, axis=1)
+    print('{} backend: cosine distance to the frozen graph: mean {:.6f}, max {:.6f}, max feature difference {:.6f}'.format(
+      name, distance.mean(), distance.max(), np.abs(a - b).max()))
+    if not distance.max() <= FLAGS.max_distance:
+      failed.append(name)
+  if failed:
+    raise ValueError('the features of the {} backend differ from the frozen graph by more than --max_distance {}'.format(
+      ', '.join(failed), FLAGS.max_distance))
+
+def main(_argv):
+  save_tflite()
+  compare()
+
+if __name__ == '__main__':
+    try:
+        app.run(main)
+    except SystemExit:
+        pass
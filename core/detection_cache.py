@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+# name, dtype and number of columns of every array in a cache directory, the
+# rows of all arrays are detections of consecutive frames
+_FIELDS = [
+    ('boxes', np.float32, 4),
+    ('scores', np.float32, None),
+    ('classes', np.int32, None),
+    ('features', np.float32, 'feature_dim'),
+    ('color_fractions', np.float64, 'num_colors'),
+]
+
+
+def file_hash(path, chunk_size=1 << 22):
+    """Returns the sha1 hex digest of the content of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def path_fingerprint(path):
+    """Returns a cheap fingerprint (name, size and modification time of every
+    file) of a model file or SavedModel directory."""
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(root, name)
+                       for root, _, names in os.walk(path) for name in names)
+    return [(os.path.relpath(f, path) if f != path else os.path.basename(f),
+             os.path.getsize(f), int(os.path.getmtime(f))) for f in files]
+
+
+def cache_key(video_path, **params):
+    """Returns the key that identifies the detections of one video.
+
+    The key covers the content of the video and all `params` that influence
+    the detector and encoder output (weights, input size, thresholds, ...).
+    Parameters of the tracker itself must not be part of it.
+    """
+    digest = hashlib.sha1()
+    digest.update(file_hash(video_path).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class DetectionCacheWriter(object):
+    """
+    Appends the detections of consecutive frames to a cache directory.
+
+    The arrays are streamed to raw binary files in `<path>.partial` and the
+    directory is renamed to `path` by `close`, so an interrupted run never
+    leaves a cache behind that looks complete.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory.
+    feature_dim : int
+        Dimensionality of the ReID features.
+    num_colors : int
+        Number of jersey colors that color fractions are stored for.
+
+    """
+
+    def __init__(self, path, feature_dim, num_colors):
+        self.path = path
+        self._partial = path + '.partial'
+        if os.path.exists(self._partial):
+            shutil.rmtree(self._partial)
+        os.makedirs(self._partial)
+        self._dims = {'feature_dim': feature_dim, 'num_colors': num_colors}
+        self._files = {name: open(os.path.join(self._partial, name + '.bin'), 'wb')
+                       for name, _, _ in _FIELDS}
+        self._offsets = [0]
+
+    def append(self, boxes, scores, classes, features, color_fractions):
+        """Add the detections of the next frame."""
+        arrays = {'boxes': boxes, 'scores': scores, 'classes': classes,
+                  'features': features, 'color_fractions': color_fractions}
+        for name, dtype, cols in _FIELDS:
+            shape = (-1, ) if cols is None else (-1, self._dims.get(cols, cols))
+            array = np.ascontiguousarray(arrays[name], dtype=dtype).reshape(shape)
+            self._files[name].write(array.tobytes())
+        self._offsets.append(self._offsets[-1] + len(boxes))
+
+    def discard(self):
+        """Drop everything written so far, e.g. when the run was aborted."""
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self._partial)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        np.save(os.path.join(self._partial, 'offsets.npy'),
+                np.asarray(self._offsets, dtype=np.int64))
+        with open(os.path.join(self._partial, 'meta.json'), 'w') as f:
+            json.dump(dict(self._dims, num_frames=len(self._offsets) - 1,
+                           num_detections=self._offsets[-1]), f)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self._partial, self.path)
+
+
+class DetectionCache(object):
+    """
+    Read-only, memory-mapped view on a cache directory written by
+    `DetectionCacheWriter`.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory.
+
+    Attributes
+    ----------
+    offsets : ndarray
+        Frame i holds the detections `offsets[i]:offsets[i + 1]` of each array.
+    boxes, scores, classes, features, color_fractions : ndarray
+        Memory-mapped arrays with the detections of all frames.
+
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.feature_dim = meta['feature_dim']
+        self.num_colors = meta['num_colors']
+        for name, dtype, cols in _FIELDS:
+            cols = meta.get(cols, cols)
+            shape = (meta['num_detections'], ) if cols is None else (meta['num_detections'], cols)
+            if np.prod(shape) == 0:
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype,
+                                  mode='r', shape=shape)
+            setattr(self, name, array)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, i):
+        """Returns `(boxes, scores, classes, features, color_fractions)` of the
+        i-th frame (counting from 0)."""
+        s, e = self.offsets[i], self.offsets[i + 1]
+        return (self.boxes[s:e], self.scores[s:e], self.classes[s:e],
+                self.features[s:e], self.color_fractions[s:e])
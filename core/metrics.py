@@ -0,0 +1,176 @@
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5)
+
+
+class Histogram(object):
+    """Counts observations in fixed buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                lower = min(lower, upper)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max}
+
+
+class Metrics(object):
+    """
+    Collects per-stage latencies and gauges (queue depths, track counts, ...)
+    of a tracking run. All methods can be called from any thread.
+
+    Latencies are recorded with `time`:
+
+        with metrics.time('inference'):
+            boxes, pred_conf = detector(image_data)
+
+    Gauges hold the last value set for a name and a set of labels.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        """Returns the current state as a JSON serializable dict."""
+        with self._lock:
+            latencies = {stage: h.summary() for stage, h in self._histograms.items()}
+            gauges = [dict(labels, name=name, value=value)
+                      for (name, labels), value in sorted(self._gauges.items(), key=str)]
+        return {'time': time.time(), 'uptime': time.time() - self._start_time,
+                'latency_seconds': latencies, 'gauges': gauges}
+
+    def to_prometheus(self, prefix='tracker'):
+        """Returns all metrics in the Prometheus text exposition format."""
+        def format_labels(labels):
+            return ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels)
+
+        lines = []
+        with self._lock:
+            name = prefix + '_stage_latency_seconds'
+            lines.append('# HELP {} Latency of the processing stages.'.format(name))
+            lines.append('# TYPE {} histogram'.format(name))
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, bound, cumulative))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, h.sum))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, h.count))
+
+            typed = set()
+            for (gauge, labels), value in sorted(self._gauges.items(), key=str):
+                name = '{}_{}'.format(prefix, gauge)
+                if name not in typed:
+                    lines.append('# TYPE {} gauge'.format(name))
+                    typed.add(name)
+                lines.append('{}{{{}}} {}'.format(name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+class JsonMetricsWriter(object):
+    """Appends a snapshot of the metrics as one JSON line to a file, at most
+    once every `interval` seconds."""
+
+    def __init__(self, metrics, path, interval=10.):
+        self.metrics = metrics
+        self.interval = interval
+        self._file = open(path, 'w')
+        self._last_write = time.time()
+
+    def maybe_write(self):
+        if time.time() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        self._file.write(json.dumps(self.metrics.snapshot()) + '\n')
+        self._file.flush()
+        self._last_write = time.time()
+
+    def close(self):
+        self.write()
+        self._file.close()
+
+
+def serve_prometheus(metrics, port, host=''):
+    """Serve the metrics on http://<host>:<port>/metrics from a daemon thread.
+    Returns the server, call `shutdown()` on it to stop serving."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,131 @@
+import sys
+import queue
+import threading
+
+
+# marks the end of the stream in the queues between stages
+_END = object()
+
+
+class _Failure(object):
+    """Wraps an exception raised inside a stage so it can be re-raised by the
+    consumer of the pipeline."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class StagedPipeline(object):
+    """
+    Runs a chain of processing stages on separate threads, connected by bounded
+    queues.
+
+    The source iterable is consumed on its own thread and every stage runs on
+    exactly one thread, so items leave the pipeline in the order the source
+    produced them. Because the queues are bounded, a slow stage blocks the
+    stages in front of it (backpressure) instead of letting frames pile up in
+    memory. The results of the last stage are handed to the caller by iterating
+    over the pipeline, which keeps the consumer (e.g. HighGUI) on the calling
+    thread.
+
+    Parameters
+    ----------
+    source : Iterable
+        Produces the items that are fed into the first stage.
+    stages : List[(str, Callable)]
+        Named stages. Each callable takes the item produced by the previous
+        stage and returns the item for the next one.
+    queue_size : int
+        Maximum number of items buffered between two consecutive stages.
+
+    """
+
+    def __init__(self, source, stages, queue_size=8):
+        self.source = source
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self._queues = [queue.Queue(maxsize=queue_size)
+                        for _ in range(len(self.stages) + 1)]
+        self._stop = threading.Event()
+        self._threads = []
+
+    def queue_depths(self):
+        """Returns the number of items waiting in front of every stage and in
+        front of the consumer, keyed by the name of the receiving end."""
+        names = [name for name, _ in self.stages] + ['output']
+        return {name: q.qsize() for name, q in zip(names, self._queues)}
+
+    def start(self):
+        if self._threads:
+            return
+        self._threads.append(threading.Thread(
+            target=self._run_source, name='decode', daemon=True))
+        for i, (name, fn) in enumerate(self.stages):
+            self._threads.append(threading.Thread(
+                target=self._run_stage, args=(fn, self._queues[i], self._queues[i + 1]),
+                name=name, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Stops all stages. Items still in flight are dropped."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def __iter__(self):
+        self.start()
+        output = self._queues[-1]
+        try:
+            while True:
+                item = output.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    exc_type, exc, tb = item.exc_info
+                    raise exc.with_traceback(tb)
+                yield item
+        finally:
+            self.close()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _run_source(self):
+        out = self._queues[0]
+        try:
+            for item in self.source:
+                if not self._put(out, item):
+                    return
+        except BaseException:
+            self._put(out, _Failure(sys.exc_info()))
+            return
+        self._put(out, _END)
+
+    def _run_stage(self, fn, inq, out):
+        while True:
+            item = self._get(inq)
+            if item is _END or isinstance(item, _Failure):
+                self._put(out, item)
+                return
+            try:
+                result = fn(item)
+            except BaseException:
+                self._put(out, _Failure(sys.exc_info()))
+                return
+            if not self._put(out, result):
+                return
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+def yxyx_to_tlwh(boxes, image_height, image_width):
+    """Convert boxes in format (ymin, xmin, ymax, xmax), normalized to the
+    image, to integer pixel boxes (xmin, ymin, width, height).
+
+    The corners are truncated to whole pixels before the size is computed, as
+    `utils.format_boxes` always did.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    corners = np.trunc(boxes * [image_height, image_width, image_height, image_width])
+    tlwh = np.empty_like(corners)
+    tlwh[:, 0], tlwh[:, 1] = corners[:, 1], corners[:, 0]
+    tlwh[:, 2] = corners[:, 3] - corners[:, 1]
+    tlwh[:, 3] = corners[:, 2] - corners[:, 0]
+    return tlwh
+
+
+class DetectionFilter(object):
+    """
+    Converts the output of the YOLO non-maximum suppression to pixel boxes and
+    drops unwanted detections in one pass over the arrays.
+
+    Parameters
+    ----------
+    class_names : Dict[int, str]
+        Maps class indices to names, as read by `utils.read_class_names`.
+    allowed_classes : Collection[str]
+        The names of the classes to keep.
+    min_height, max_height : Optional[float]
+        Boxes lower than `min_height` or higher than `max_height` pixels are
+        dropped. Very small boxes tend to implode and very large boxes jump to
+        random locations once they are tracked.
+    min_top : Optional[float]
+        Boxes whose top edge lies above this row are dropped, e.g. players in
+        the stands.
+    min_right : Optional[float]
+        Boxes whose right edge lies left of this column are dropped.
+    roi : Optional[deep_sort.roi.RegionOfInterest]
+        If given, boxes outside this region are dropped.
+
+    """
+
+    def __init__(self, class_names, allowed_classes, min_height=None, max_height=None,
+                 min_top=None, min_right=None, roi=None):
+        num_classes = max(class_names) + 1 if class_names else 0
+        allowed = set(allowed_classes)
+        self.class_mask = np.array(
+            [class_names.get(i) in allowed for i in range(num_classes)], dtype=bool)
+        self.min_height = min_height
+        self.max_height = max_height
+        self.min_top = min_top
+        self.min_right = min_right
+        self.roi = roi
+
+    def keep(self, tlwh, classes):
+        """Returns a boolean array that is True for the detections to keep.
+
+        Parameters
+        ----------
+        tlwh : ndarray
+            The Nx4 boxes in pixels (xmin, ymin, width, height).
+        classes : ndarray
+            The N class indices.
+
+        """
+        classes = np.asarray(classes).astype(np.int64)
+        keep = (classes >= 0) & (classes < len(self.class_mask))
+        keep[keep] = self.class_mask[classes[keep]]
+        if self.min_height is not None:
+            keep &= tlwh[:, 3] >= self.min_height
+        if self.max_height is not None:
+            keep &= tlwh[:, 3] <= self.max_height
+        if self.min_top is not None:
+            keep &= tlwh[:, 1] >= self.min_top
+        if self.min_right is not None:
+            keep &= tlwh[:, 0] + tlwh[:, 2] >= self.min_right
+        if self.roi is not None and keep.any():
+            keep[keep] = self.roi.contains(tlwh[keep])
+        return keep
+
+    def __call__(self, boxes, scores, classes, image_shape):
+        """Filter the detections of one image.
+
+        Parameters
+        ----------
+        boxes : ndarray
+            The Nx4 boxes in format (ymin, xmin, ymax, xmax), normalized to
+            the image.
+        scores : ndarray
+            The N detection scores.
+        classes : ndarray
+            The N class indices.
+        image_shape : Tuple[int, ...]
+            The shape of the image, height and width first.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray)
+            The boxes in pixels (xmin, ymin, width, height), scores and class
+            indices of the detections that are kept.
+
+        """
+        tlwh = yxyx_to_tlwh(boxes, image_shape[0], image_shape[1])
+        keep = self.keep(tlwh, classes)
+        return (tlwh[keep], np.asarray(scores).reshape(-1)[keep],
+                np.asarray(classes).reshape(-1)[keep].astype(np.int32))
@@ -0,0 +1,206 @@
+import numpy as np
+from deep_sort import iou_matching
+
+
+def parse_tiles(tiles):
+    """Parse a tile layout given as '<cols>x<rows>', e.g. '5x3', or 'auto'.
+    Returns `(cols, rows)`, or None for 'auto'."""
+    if tiles.lower() == 'auto':
+        return None
+    cols, rows = tiles.lower().split('x')
+    return int(cols), int(rows)
+
+
+def _tile_starts(lo, hi, limit, size, n):
+    """Start coordinates of `n` windows of `size` pixels spread evenly over
+    [lo, hi), moved into [0, limit) where possible."""
+    extent = hi - lo
+    if n == 1:
+        starts = np.array([lo])
+    else:
+        starts = lo + np.round(np.arange(n) * max(extent - size, 0) / float(n - 1)).astype(int)
+    return np.clip(starts, 0, max(limit - size, 0))
+
+
+def _min_tiles(extent, size, overlap):
+    return max(1, int(np.ceil((extent - overlap) / float(size - overlap))))
+
+
+def tile_layout(bounds, frame_shape, size, overlap, grid=None, skip=()):
+    """Cover an area of a frame with overlapping tiles at native scale.
+
+    Every tile is a window of `size` x `size` frame pixels, the detector
+    input, so objects keep their resolution. Tiles never reach past the frame
+    unless the frame itself is smaller than a tile; that part is padded by
+    `crop_tiles`.
+
+    Parameters
+    ----------
+    bounds : (int, int, int, int)
+        The area `(xmin, ymin, xmax, ymax)` to cover, e.g. the whole frame.
+    frame_shape : (int, int)
+        Height and width of the frame.
+    size : int
+        The tile size, i.e. the detector input size.
+    overlap : int
+        Minimum number of pixels that neighbouring tiles share.
+    grid : Optional[(int, int)]
+        Number of tiles along the width and the height of the area. The tiles
+        are spread evenly, so more tiles overlap more. If None, the smallest
+        grid that covers the area is used.
+    skip : Collection[int]
+        Indices (row-major) of tiles that are never looked at, e.g. tiles that
+        only show stands or sky.
+
+    Returns
+    -------
+    ndarray
+        An Nx4 integer array of tiles in format (xmin, ymin, xmax, ymax).
+
+    Raises
+    ------
+    ValueError
+        If the tiles of `grid` cannot cover the area.
+
+    """
+    if not 0 <= overlap < size:
+        raise ValueError('the tile overlap must be smaller than the tile size %d' % size)
+    x0, y0, x1, y1 = bounds
+    frame_h, frame_w = frame_shape[:2]
+    min_cols, min_rows = _min_tiles(x1 - x0, size, overlap), _min_tiles(y1 - y0, size, overlap)
+    cols, rows = grid if grid is not None else (min_cols, min_rows)
+    if cols < min_cols or rows < min_rows:
+        raise ValueError('%dx%d tiles of %d pixels overlapping by %d do not cover %dx%d pixels, '
+                         'use at least %dx%d tiles' % (cols, rows, size, overlap, x1 - x0, y1 - y0,
+                                                       min_cols, min_rows))
+    xs = _tile_starts(x0, x1, frame_w, size, cols)
+    ys = _tile_starts(y0, y1, frame_h, size, rows)
+    tiles = [(x, y, x + size, y + size) for y in ys for x in xs]
+    return np.array([tile for i, tile in enumerate(tiles) if i not in skip], dtype=np.int32).reshape(-1, 4)
+
+
+def crop_tiles(frame, tiles, input_size):
+    """Cut the tiles out of a frame. Tiles have the size of the detector
+    input, the part of a tile outside the frame is black.
+
+    Returns an array of shape (N, input_size, input_size, 3) in [0, 1].
+    """
+    image_data = np.zeros((len(tiles), input_size, input_size, 3), dtype=np.float32)
+    for i, (x0, y0, x1, y1) in enumerate(tiles):
+        window = frame[y0:y1, x0:x1]
+        image_data[i, :window.shape[0], :window.shape[1]] = window
+    image_data /= 255.
+    return image_data
+
+
+def _area(boxes):
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def merge_tile_detections(tiles, boxes, scores, classes, frame_shape,
+                          iou_threshold, ios_threshold=0.5, border=2):
+    """Map detections of all tiles back to the frame and merge duplicates.
+
+    Objects in the overlap of two tiles are detected twice. Boxes of the same
+    class from different tiles with an IoU above `iou_threshold` are treated
+    as duplicates and only the highest scoring one is kept. An object that is
+    cut by a tile border inside the frame is only partially visible in each
+    tile; such a truncated box is joined with a box of a neighbouring tile if
+    the intersection covers more than `ios_threshold` of the smaller box.
+
+    Parameters
+    ----------
+    tiles : ndarray
+        The Nx4 tiles (xmin, ymin, xmax, ymax) the detections come from.
+    boxes : List[ndarray]
+        For every tile the boxes in format (ymin, xmin, ymax, xmax),
+        normalized to the tile.
+    scores : List[ndarray]
+        For every tile the detection scores.
+    classes : List[ndarray]
+        For every tile the detection classes.
+    frame_shape : (int, int)
+        Height and width of the frame.
+    iou_threshold : float
+        Overlap above which two boxes are duplicates.
+    ios_threshold : float
+        Minimum intersection over the smaller box to join a truncated box.
+    border : int
+        Boxes within this many pixels of an inner tile border are truncated.
+
+    Returns
+    -------
+    (ndarray, ndarray, ndarray)
+        Boxes in format (ymin, xmin, ymax, xmax) normalized to the frame,
+        scores and classes, sorted by decreasing score.
+
+    """
+    frame_h, frame_w = frame_shape[:2]
+    all_boxes, all_scores, all_classes, all_tiles, truncated = [], [], [], [], []
+    for i, (x0, y0, x1, y1) in enumerate(tiles):
+        if len(boxes[i]) == 0:
+            continue
+        b = np.asarray(boxes[i], dtype=np.float64)
+        # to frame pixels as (xmin, ymin, xmax, ymax)
+        xyxy = np.stack([x0 + b[:, 1] * (x1 - x0), y0 + b[:, 0] * (y1 - y0),
+                         x0 + b[:, 3] * (x1 - x0), y0 + b[:, 2] * (y1 - y0)], axis=1)
+        # a box touching a tile border that is not a frame border is cut off
+        cut = np.zeros(len(b), dtype=bool)
+        if x0 > 0:
+            cut |= xyxy[:, 0] <= x0 + border
+        if y0 > 0:
+            cut |= xyxy[:, 1] <= y0 + border
+        if x1 < frame_w:
+            cut |= xyxy[:, 2] >= x1 - border
+        if y1 < frame_h:
+            cut |= xyxy[:, 3] >= y1 - border
+        all_boxes.append(xyxy)
+        all_scores.append(np.asarray(scores[i]))
+        all_classes.append(np.asarray(classes[i]))
+        all_tiles.append(np.full(len(b), i))
+        truncated.append(cut)
+
+    if not all_boxes:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+    xyxy = np.concatenate(all_boxes)
+    scores = np.concatenate(all_scores)
+    classes = np.concatenate(all_classes)
+    tile_ids = np.concatenate(all_tiles)
+    truncated = np.concatenate(truncated)
+
+    order = np.argsort(-scores, kind='stable')
+    xyxy, scores, classes = xyxy[order], scores[order], classes[order]
+    tile_ids, truncated = tile_ids[order], truncated[order]
+    area = _area(xyxy)
+
+    # every box is compared with all boxes kept so far at once; a truncated
+    # box grows when it is joined, so the comparison runs box by box
+    keep = np.zeros(len(xyxy), dtype=bool)
+    for i in range(len(xyxy)):
+        kept = np.flatnonzero(keep & (classes == classes[i]) & (tile_ids != tile_ids[i]))
+        if len(kept) == 0:
+            keep[i] = True
+            continue
+        boxes_tlwh = np.concatenate([xyxy[kept, :2], xyxy[kept, 2:] - xyxy[kept, :2]], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            iou = np.nan_to_num(iou_matching.iou_matrix(boxes_tlwh, [xyxy[i, :2], xyxy[i, 2:] - xyxy[i, :2]])[:, 0])
+        intersection = iou * (area[kept] + area[i]) / (1. + iou)
+        cut = truncated[kept] | truncated[i]
+        ios = intersection / np.maximum(np.minimum(area[kept], area[i]), 1e-6)
+        duplicate = np.flatnonzero(np.where(cut, ios > ios_threshold, iou > iou_threshold))
+        if len(duplicate) == 0:
+            keep[i] = True
+            continue
+        k = kept[duplicate[0]]
+        if cut[duplicate[0]]:
+            # join the halves of an object cut by a tile border
+            xyxy[k, :2] = np.minimum(xyxy[k, :2], xyxy[i, :2])
+            xyxy[k, 2:] = np.maximum(xyxy[k, 2:], xyxy[i, 2:])
+            area[k] = _area(xyxy[k])
+            truncated[k] = truncated[k] and truncated[i]
+
+    # tiles may reach into the padding of small frames
+    xyxy = np.clip(xyxy[keep], 0, [frame_w, frame_h, frame_w, frame_h])
+    yxyx = np.stack([xyxy[:, 1] / frame_h, xyxy[:, 0] / frame_w,
+                     xyxy[:, 3] / frame_h, xyxy[:, 2] / frame_w], axis=1)
+    return yxyx.astype(np.float32), scores[keep], classes[keep]
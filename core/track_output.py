@@ -0,0 +1,54 @@
+import json
+
+
+class MotTrackWriter(object):
+    """Writes tracks in MOTChallenge format, one line per track and frame:
+    `frame, id, bb_left, bb_top, bb_width, bb_height, conf, x, y, z`.
+
+    Like the MOTChallenge results of deep sort, only confirmed tracks that were
+    matched to a detection are written, tentative and predicted tracks are
+    skipped.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self._file = open(path, 'w', buffering=buffer_size)
+
+    def write(self, frame_num, tracks):
+        for track_id, tlbr, class_name, jersey_color, state in tracks:
+            if state != 'confirmed':
+                continue
+            self._file.write('%d,%d,%.2f,%.2f,%.2f,%.2f,-1,-1,-1,-1\n' % (
+                frame_num, track_id, tlbr[0], tlbr[1], tlbr[2] - tlbr[0], tlbr[3] - tlbr[1]))
+
+    def close(self):
+        self._file.close()
+
+
+class JsonTrackWriter(object):
+    """Writes one JSON object per track and frame with the keys `frame`,
+    `track_id`, `tlbr`, `class`, `team_color` and `state` (tentative, predicted
+    or confirmed)."""
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self._file = open(path, 'w', buffering=buffer_size)
+
+    def write(self, frame_num, tracks):
+        for track_id, tlbr, class_name, jersey_color, state in tracks:
+            self._file.write(json.dumps({
+                'frame': frame_num,
+                'track_id': int(track_id),
+                'tlbr': [round(float(x), 2) for x in tlbr],
+                'class': class_name,
+                'team_color': jersey_color,
+                'state': state}) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def open_track_writer(path, output_format):
+    if output_format == 'mot':
+        return MotTrackWriter(path)
+    elif output_format == 'jsonl':
+        return JsonTrackWriter(path)
+    raise ValueError("Invalid track output format; must be either 'mot' or 'jsonl'")
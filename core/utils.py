@@ -4,6 +4,7 @@ import colorsys
 import numpy as np
 import tensorflow as tf
 from core.config import cfg
+from core.postprocess import yxyx_to_tlwh
 
 def load_freeze_layer(model='yolov4', tiny=False):
     if tiny:
@@ -126,14 +127,7 @@ def image_preprocess(image, target_size, gt_boxes=None):
 
 # helper function to convert bounding boxes from normalized ymin, xmin, ymax, xmax ---> xmin, ymin, xmax, ymax
 def format_boxes(bboxes, image_height, image_width):
-    for box in bboxes:
-        ymin = int(box[0] * image_height)
-        xmin = int(box[1] * image_width)
-        ymax = int(box[2] * image_height)
-        xmax = int(box[3] * image_width)
-        width = xmax - xmin
-        height = ymax - ymin
-        box[0], box[1], box[2], box[3] = xmin, ymin, width, height
+    bboxes[...] = yxyx_to_tlwh(bboxes, image_height, image_width).reshape(np.shape(bboxes))
     return bboxes
 
 def draw_bbox(image, bboxes, info = False, show_label=True, classes=read_class_names(cfg.YOLO.CLASSES)):
@@ -10,6 +10,17 @@ def find_color(roi, colors, threshold=0.0):
   colors: list of colors as strings in order [Team1, Team2, ref or other]
   threshold: minimum fraction of image containing either of the colors necessary to be detected
   """
+  return pick_color(color_fractions(roi, colors), colors, threshold)
+
+
+def color_fractions(roi, colors):
+  """
+  Returns the fraction of pixels in the roi that fall in the range of each
+  jersey color, in the order of colors. Colors after the first one that is not
+  in the color dictionary are left at 0.
+  roi: image or region of interest within image
+  colors: list of colors as strings in order [Team1, Team2, ref or other]
+  """
 
   color_dict = {
               #'black': [[0, 0, 0],[180, 255, 30]],
@@ -42,9 +53,8 @@ def find_color(roi, colors, threshold=0.0):
 
   roi_hsv = cv2.cvtColor(roi, cv2.COLOR_RGB2HSV)
   total_pixels = roi.shape[0] * roi.shape[1]
-  highest_color = None
-  highest_perc = 0
-  for color in colors:
+  fractions = np.zeros(len(colors))
+  for i, color in enumerate(colors):
     if color in color_dict.keys():
       # red is on the edge of HSV range, so needs a combination of two masks
       if color == 'red':
@@ -57,15 +67,40 @@ def find_color(roi, colors, threshold=0.0):
         lower = np.array(color_dict[color][0])
         upper = np.array(color_dict[color][1])
         mask = cv2.inRange(roi_hsv, lower, upper)
-      color_perc = cv2.countNonZero(mask) / total_pixels
-      if color_perc > highest_perc and color_perc > threshold:
-        highest_perc = color_perc
-        highest_color = color
+      fractions[i] = cv2.countNonZero(mask) / total_pixels
     else:
       print(f'{color} not in color dictionary')
       break
+  return fractions
+
+
+def pick_color(fractions, colors, threshold=0.0):
+  """
+  Returns the color with the highest fraction from color_fractions if it is
+  above threshold, otherwise 'Unidentified'. Keeping the fractions around
+  allows the threshold to be changed without looking at the image again.
+  """
+  highest_color = None
+  highest_perc = 0
+  for color, color_perc in zip(colors, fractions):
+    if color_perc > highest_perc and color_perc > threshold:
+      highest_perc = color_perc
+      highest_color = color
   if highest_color:
     return highest_color
   else:
     #return 'green'
     return 'Unidentified'
+
+
+def pick_colors(fractions, colors, threshold=0.0):
+  """
+  Vectorized pick_color for the color fractions of many detections. Returns
+  for every row of fractions the index of the picked color in colors, or
+  len(colors) for 'Unidentified'.
+  """
+  fractions = np.asarray(fractions, dtype=np.float64).reshape(-1, len(colors))
+  valid = (fractions > threshold) & (fractions > 0)
+  ids = np.argmax(np.where(valid, fractions, -np.inf), axis=1)
+  ids[~valid.any(axis=1)] = len(colors)
+  return ids
@@ -32,7 +32,7 @@ class Detection(object):
         self.tlwh = np.asarray(tlwh, dtype=np.float)
         self.confidence = float(confidence)
         self.class_name = class_name
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = np.asarray(feature, dtype=np.float32) if feature is not None else None
         self.color = color
 
     def get_class(self):
@@ -57,3 +57,139 @@ class Detection(object):
         ret[:2] += ret[2:] / 2
         ret[2] /= ret[3]
         return ret
+
+
+class DetectionBatch(object):
+    """
+    All detections of a single image, stored column by column.
+
+    Indexing with an integer returns a `Detection` whose arrays are views into
+    the batch, indexing with an index array or slice returns a new batch, so a
+    `DetectionBatch` can be passed wherever a list of detections is expected.
+
+    Parameters
+    ----------
+    tlwh : array_like
+        An Nx4 array of bounding boxes in format `(x, y, w, h)`.
+    confidence : array_like
+        The N detector confidence scores.
+    class_ids : array_like
+        The N detector class indices.
+    features : Optional[array_like]
+        An NxL array of feature vectors that describe the detected objects.
+        If None, the features are computed later, see `set_features`.
+    color_ids : Optional[array_like]
+        The N jersey color indices, -1 for detections without a color.
+    class_names : Optional[Sequence[str] | Dict[int, str]]
+        Maps class indices to class names.
+    color_names : Optional[Sequence[str]]
+        Maps color indices to color names.
+
+    Attributes
+    ----------
+    tlwh : ndarray
+        The Nx4 bounding boxes in format `(top left x, top left y, width,
+        height)`.
+    confidence : ndarray
+        The N detector confidence scores.
+    class_ids : ndarray
+        The N detector class indices.
+    features : ndarray | NoneType
+        The NxL feature vectors, None if no feature has been set yet.
+    has_feature : ndarray
+        A boolean array that is True for the detections with a feature.
+    color_ids : ndarray
+        The N jersey color indices, -1 for detections without a color.
+
+    """
+
+    def __init__(self, tlwh, confidence, class_ids, features, color_ids=None,
+                 class_names=None, color_names=None):
+        self.tlwh = np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)
+        num_detections = len(self.tlwh)
+        self.confidence = np.asarray(confidence, dtype=np.float64).reshape(num_detections)
+        self.class_ids = np.asarray(class_ids, dtype=np.int32).reshape(num_detections)
+        if features is None:
+            self.features = None
+            self.has_feature = np.zeros(num_detections, dtype=bool)
+        else:
+            features = np.asarray(features, dtype=np.float32)
+            self.features = features.reshape(num_detections, features.shape[-1] if features.ndim > 1 else -1)
+            self.has_feature = np.ones(num_detections, dtype=bool)
+        if color_ids is None:
+            self.color_ids = np.full(num_detections, -1, dtype=np.int32)
+        else:
+            self.color_ids = np.asarray(color_ids, dtype=np.int32).reshape(num_detections)
+        self.class_names = class_names
+        self.color_names = color_names
+
+    @classmethod
+    def from_detections(cls, detections):
+        """Collect a list of `Detection` objects into a batch."""
+        class_names, color_names = [], []
+        class_ids, color_ids = [], []
+        for d in detections:
+            if d.class_name not in class_names:
+                class_names.append(d.class_name)
+            class_ids.append(class_names.index(d.class_name))
+            if d.color is None:
+                color_ids.append(-1)
+                continue
+            if d.color not in color_names:
+                color_names.append(d.color)
+            color_ids.append(color_names.index(d.color))
+        return cls(
+            [d.tlwh for d in detections], [d.confidence for d in detections], class_ids,
+            [d.feature for d in detections] if detections else np.zeros((0, 0)), color_ids,
+            class_names, color_names)
+
+    def __len__(self):
+        return len(self.tlwh)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            color_id = self.color_ids[index]
+            return Detection(
+                self.tlwh[index], self.confidence[index], self.class_name(index),
+                self.features[index] if self.has_feature[index] else None,
+                self.color_names[color_id] if color_id >= 0 else None)
+        batch = DetectionBatch(
+            self.tlwh[index], self.confidence[index], self.class_ids[index],
+            self.features[index] if self.features is not None else None,
+            self.color_ids[index], self.class_names, self.color_names)
+        batch.has_feature = self.has_feature[index]
+        return batch
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def set_features(self, indices, features):
+        """Set the features of the detections at `indices`, e.g. when they are
+        only computed for the detections that need them."""
+        features = np.asarray(features, dtype=np.float32).reshape(len(indices), -1)
+        if self.features is None:
+            self.features = np.zeros((len(self), features.shape[1]), dtype=np.float32)
+        self.features[indices] = features
+        self.has_feature[indices] = True
+
+    def class_name(self, index):
+        """Returns the class name of the detection at `index`."""
+        class_id = int(self.class_ids[index])
+        return self.class_names[class_id] if self.class_names is not None else class_id
+
+    def to_tlbr(self):
+        """Convert the bounding boxes to format `(min x, min y, max x, max y)`.
+        """
+        ret = self.tlwh.copy()
+        ret[:, 2:] += ret[:, :2]
+        return ret
+
+    def to_xyah(self):
+        """Convert the bounding boxes to format `(center x, center y, aspect
+        ratio, height)`, where the aspect ratio is `width / height`.
+        """
+        ret = self.tlwh.copy()
+        ret[:, :2] += ret[:, 2:] / 2
+        ret[:, 2] /= ret[:, 3]
+        return ret
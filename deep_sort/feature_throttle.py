@@ -0,0 +1,130 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+from . import iou_matching
+
+
+class FeatureThrottle(object):
+    """
+    Reuses the last computed appearance feature of a track instead of encoding
+    a detection again, while the track hardly moves.
+
+    A player standing still produces almost the same crop on every frame. The
+    throttle remembers the box and feature each track was last encoded with.
+    A detection that overlaps such a box by at least `min_iou` gets the cached
+    feature of that track, as long as the track was encoded at most `max_age`
+    updates ago. Players that cross each other are always encoded: a feature
+    is only reused if neither the detection nor the cached box overlaps any
+    other cached box or detection of the frame by more than `max_overlap`.
+
+    The tracker only offers detections that are matched to a known track in
+    any case, and only reuses the feature of that very track, see
+    `Tracker.feature_throttle`. Reused features are not added to the gallery
+    of the track again.
+
+    Parameters
+    ----------
+    min_iou : float
+        Minimum overlap of a detection and the last encoded box of a track.
+    max_age : int
+        Maximum number of tracker updates a cached feature is reused for.
+    max_overlap : float
+        Maximum overlap of a detection with the cached boxes of other tracks,
+        and of a cached box with other detections.
+
+    Attributes
+    ----------
+    hits : int
+        Number of detections that reused a cached feature.
+    misses : int
+        Number of detections that had to be encoded.
+
+    """
+
+    def __init__(self, min_iou=0.8, max_age=10, max_overlap=0.3):
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.max_overlap = max_overlap
+
+        self.hits = 0
+        self.misses = 0
+        self._track_ids = np.zeros(0, dtype=np.int64)
+        self._boxes = np.zeros((0, 4))
+        self._ages = np.zeros(0, dtype=np.int32)
+        self._features = None
+
+    def __len__(self):
+        return len(self._track_ids)
+
+    def lookup(self, tlwh, candidates):
+        """Find the cached features that detections of a frame may reuse.
+
+        Parameters
+        ----------
+        tlwh : ndarray
+            The Nx4 boxes `(top left x, top left y, width, height)` of all
+            detections of the frame, so crowded boxes are recognized as such.
+        candidates : ndarray
+            A boolean array that is True for the detections that may reuse a
+            cached feature.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray)
+            The indices of the candidate detections that overlap the cached
+            box of a track, the ids of these tracks and their cached
+            features. The caller decides which of them are reused and reports
+            it to `count`.
+
+        """
+        tlwh = np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)
+        if len(tlwh) == 0 or len(self) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=np.int64), np.zeros((0, 0), np.float32)
+        iou = iou_matching.iou_matrix(tlwh, self._boxes)
+        # a detection that overlaps the box of another track or another
+        # detection, or a box that overlaps another detection, may belong to
+        # a different player
+        overlaps = iou > self.max_overlap
+        crowded = iou_matching.iou_matrix(tlwh, tlwh) > self.max_overlap
+        np.fill_diagonal(crowded, False)
+        unique = ((overlaps.sum(axis=1) == 1) & ~crowded.any(axis=1))[:, np.newaxis] & \
+            (overlaps.sum(axis=0) == 1)[np.newaxis, :]
+        detections, records = np.nonzero((iou >= self.min_iou) & unique & np.asarray(candidates)[:, np.newaxis])
+        return detections, self._track_ids[records], self._features[records]
+
+    def count(self, hits, misses):
+        """Count the detections that reused a cached feature and those that
+        were encoded."""
+        self.hits += int(hits)
+        self.misses += int(misses)
+
+    def record(self, track_ids, tlwh, features):
+        """Remember the boxes and features the given tracks were just encoded
+        with, replacing what was cached for them."""
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if len(track_ids) == 0:
+            return
+        features = np.asarray(features, dtype=np.float32).reshape(len(track_ids), -1)
+        keep = ~np.isin(self._track_ids, track_ids)
+        self._track_ids = np.concatenate([self._track_ids[keep], track_ids])
+        self._boxes = np.concatenate([self._boxes[keep], np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)])
+        self._ages = np.concatenate([self._ages[keep], np.zeros(len(track_ids), dtype=np.int32)])
+        old = self._features[keep] if self._features is not None else np.zeros((0, features.shape[1]), np.float32)
+        self._features = np.concatenate([old, features])
+
+    def advance(self, active_targets):
+        """Age the cached features by one update and drop those that expired
+        or belong to tracks that no longer exist. Call once per update.
+
+        Parameters
+        ----------
+        active_targets : ndarray
+            The ids of the tracks that are still alive.
+
+        """
+        self._ages += 1
+        keep = (self._ages <= self.max_age) & np.isin(self._track_ids, active_targets)
+        self._track_ids = self._track_ids[keep]
+        self._boxes = self._boxes[keep]
+        self._ages = self._ages[keep]
+        if self._features is not None:
+            self._features = self._features[keep]
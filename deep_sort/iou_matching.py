@@ -39,16 +39,50 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def iou_matrix(boxes, candidates):
+    """Compute intersection over union of all pairs of two sets of boxes.
+
+    Parameters
+    ----------
+    boxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Mx4 matrix of bounding boxes in the same format.
+
+    Returns
+    -------
+    ndarray
+        The NxM matrix where element (i, j) is `iou(boxes[i], candidates)[j]`.
+
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 4)
+    boxes_tl, boxes_br = boxes[:, np.newaxis, :2], boxes[:, np.newaxis, :2] + boxes[:, np.newaxis, 2:]
+    candidates_tl = candidates[np.newaxis, :, :2]
+    candidates_br = candidates[np.newaxis, :, :2] + candidates[np.newaxis, :, 2:]
+
+    tl = np.maximum(boxes_tl, candidates_tl)
+    br = np.minimum(boxes_br, candidates_br)
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=2)
+    area_boxes = boxes[:, 2:].prod(axis=1)[:, np.newaxis]
+    area_candidates = candidates[:, 2:].prod(axis=1)[np.newaxis, :]
+    return area_intersection / (area_boxes + area_candidates - area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None,
              detection_indices=None):
     """An intersection over union distance metric.
 
     Parameters
     ----------
-    tracks : List[deep_sort.track.Track]
-        A list of tracks.
-    detections : List[deep_sort.detection.Detection]
-        A list of detections.
+    tracks : deep_sort.track.TrackStore | List[deep_sort.track.Track]
+        The tracks.
+    detections : deep_sort.detection.DetectionBatch | List[deep_sort.detection.Detection]
+        The detections, or any object with an Nx4 `tlwh` array of the boxes
+        of all detections.
     track_indices : Optional[List[int]]
         A list of indices to tracks that should be matched. Defaults to
         all `tracks`.
@@ -69,13 +103,18 @@ def iou_cost(tracks, detections, track_indices=None,
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
-
-        bbox = tracks[track_idx].to_tlwh()
+    if hasattr(detections, 'tlwh'):
+        candidates = np.asarray(detections.tlwh)[np.asarray(detection_indices, dtype=int)]
+    else:
         candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    if hasattr(tracks, 'to_tlwh'):
+        track_indices = np.asarray(track_indices, dtype=int)
+        bboxes = tracks.to_tlwh()[track_indices]
+        missed = tracks.time_since_update[track_indices] > 1
+    else:
+        bboxes = np.asarray([tracks[i].to_tlwh() for i in track_indices])
+        missed = np.array([tracks[i].time_since_update > 1 for i in track_indices], dtype=bool)
+
+    cost_matrix = 1. - iou_matrix(bboxes, candidates)
+    cost_matrix[missed, :] = linear_assignment.INFTY_COST
     return cost_matrix
@@ -20,6 +20,14 @@ chi2inv95 = {
     9: 16.919}
 
 
+def _batch_diag(values):
+    """Returns the NxMxM diagonal matrices of the rows of an NxM array."""
+    n, m = values.shape
+    diag = np.zeros((n, m, m), dtype=values.dtype)
+    diag[:, np.arange(m), np.arange(m)] = values
+    return diag
+
+
 class KalmanFilter(object):
     """
     A simple Kalman filter for tracking bounding boxes in image space.
@@ -185,6 +193,105 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def predict_batch(self, mean, covariance):
+        """Run Kalman filter prediction step for several tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of the object states at the
+            previous time step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states at
+            the previous time step.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean vectors and covariance matrices of the predicted
+            states, equal to calling `predict` on every state.
+
+        """
+        height = mean[:, 3]
+        std = np.stack([
+            self._std_weight_position * height,
+            self._std_weight_position * height,
+            np.full_like(height, 1e-2),
+            self._std_weight_position * height,
+            self._std_weight_velocity * height,
+            self._std_weight_velocity * height,
+            np.full_like(height, 1e-5),
+            self._std_weight_velocity * height], axis=1)
+        motion_cov = _batch_diag(np.square(std))
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._motion_mat, covariance), self._motion_mat.T) + motion_cov
+        return mean, covariance
+
+    def project_batch(self, mean, covariance):
+        """Project the state distributions of several tracks to measurement
+        space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 covariance matrices,
+            equal to calling `project` on every state.
+
+        """
+        height = mean[:, 3]
+        std = np.stack([
+            self._std_weight_position * height,
+            self._std_weight_position * height,
+            np.full_like(height, 1e-1),
+            self._std_weight_position * height], axis=1)
+        innovation_cov = _batch_diag(np.square(std))
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
+    def update_batch(self, mean, covariance, measurements):
+        """Run Kalman filter correction step for several tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional predicted mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+        measurements : ndarray
+            The Nx4 dimensional measurements (x, y, a, h), the i-th
+            measurement is associated with the i-th state.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions, equal to
+            calling `update` on every state.
+
+        """
+        projected_mean, projected_cov = self.project_batch(mean, covariance)
+
+        # K = P H^T S^-1, solved as S K^T = H P^T with S symmetric
+        kalman_gain = np.linalg.solve(
+            projected_cov, np.matmul(self._update_mat, covariance)).transpose(0, 2, 1)
+        innovation = measurements - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(np.matmul(
+            kalman_gain, projected_cov), kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
         """Compute gating distance between state distribution and measurements.
@@ -227,3 +334,43 @@ class KalmanFilter(object):
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+    def gating_distance_batch(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute the gating distance between several state distributions and
+        measurements at once.
+
+        Every state is projected and its Cholesky factor computed only once,
+        no matter how many measurements it is compared with.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of N state distributions.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between the i-th state distribution and
+            `measurements[j]`, equal to `gating_distance` for every state.
+
+        """
+        mean, covariance = self.project_batch(mean, covariance)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        squared_maha = np.sum(z * z, axis=1)
+        return squared_maha
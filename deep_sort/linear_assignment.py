@@ -8,6 +8,62 @@ from . import kalman_filter
 INFTY_COST = 1e+5
 
 
+def _sparse_linear_assignment(cost_matrix, feasible):
+    """Solve the linear assignment problem on the feasible entries only.
+
+    Assigning an infeasible pair costs the same for every pair, so the best
+    assignment of the feasible pairs decomposes into the connected components
+    of the bipartite graph of feasible pairs. Every component is solved on
+    its own, components with a single feasible pair are matched directly.
+
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix.
+    feasible : ndarray
+        An NxM boolean matrix of the pairs that may be matched.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The row and column indices of the feasible matches, sorted by row.
+
+    """
+    num_rows, num_cols = cost_matrix.shape
+    rows, cols = np.nonzero(feasible)
+    if len(rows) == 0:
+        return rows, cols
+
+    # label every row with the smallest row of its component by propagating
+    # labels between rows and columns, isolated columns get label num_rows
+    row_labels = np.arange(num_rows)
+    while True:
+        col_labels = np.where(feasible, row_labels[:, np.newaxis], num_rows).min(axis=0)
+        new_labels = np.minimum(
+            row_labels, np.where(feasible, col_labels[np.newaxis, :], num_rows).min(axis=1))
+        if np.array_equal(new_labels, row_labels):
+            break
+        row_labels = new_labels
+
+    # components with a single feasible pair
+    edge_labels = row_labels[rows]
+    edges_per_label = np.bincount(edge_labels, minlength=num_rows)
+    trivial = edges_per_label[edge_labels] == 1
+    matched_rows, matched_cols = [rows[trivial]], [cols[trivial]]
+
+    for label in np.unique(edge_labels[~trivial]):
+        component_rows = np.flatnonzero(row_labels == label)
+        component_cols = np.flatnonzero(col_labels == label)
+        r, c = linear_sum_assignment(cost_matrix[np.ix_(component_rows, component_cols)])
+        valid = feasible[component_rows[r], component_cols[c]]
+        matched_rows.append(component_rows[r[valid]])
+        matched_cols.append(component_cols[c[valid]])
+
+    matched_rows, matched_cols = np.concatenate(matched_rows), np.concatenate(matched_cols)
+    order = np.argsort(matched_rows)
+    return matched_rows[order], matched_cols[order]
+
+
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
         detection_indices=None):
@@ -24,10 +80,10 @@ def min_cost_matching(
     max_distance : float
         Gating threshold. Associations with cost larger than this value are
         disregarded.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track.TrackStore | List[track.Track]
+        The predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
@@ -55,30 +111,21 @@ def min_cost_matching(
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_sum_assignment(cost_matrix)
-    indices = np.asarray(indices)
-    indices = np.transpose(indices)
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
-    for row, col in indices:
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-
-        # Comment added by Bas
-        # The commented or-statement in the line below is another way (as opposed to the first if-block in the track.update function) of handling invalid jersey color.
-        # However, one color mismatch directly creates a new track using this way. See "alternative_methode_voor_jersey_color_result.avi"
-        if cost_matrix[row, col] > max_distance: # or (tracks[track_idx].is_confirmed() and tracks[track_idx].get_color() != detections[detection_idx].get_color()): 
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
 
-        else:
-            matches.append((track_idx, detection_idx))
+    # Comment added by Bas
+    # Adding "or (tracks[track_idx].is_confirmed() and tracks[track_idx].get_color() != detections[detection_idx].get_color())"
+    # to the infeasible pairs is another way (as opposed to the first if-block in the track.update function) of handling invalid jersey color.
+    # However, one color mismatch directly creates a new track using this way. See "alternative_methode_voor_jersey_color_result.avi"
+    feasible = cost_matrix <= max_distance
+    rows, cols = _sparse_linear_assignment(cost_matrix, feasible)
 
+    track_indices, detection_indices = list(track_indices), list(detection_indices)
+    matched_rows = np.zeros(len(track_indices), dtype=bool)
+    matched_cols = np.zeros(len(detection_indices), dtype=bool)
+    matched_rows[rows], matched_cols[cols] = True, True
+    matches = [(track_indices[row], detection_indices[col]) for row, col in zip(rows, cols)]
+    unmatched_tracks = [track_indices[row] for row in np.flatnonzero(~matched_rows)]
+    unmatched_detections = [detection_indices[col] for col in np.flatnonzero(~matched_cols)]
     return matches, unmatched_tracks, unmatched_detections
 
 
@@ -87,6 +134,10 @@ def matching_cascade(
         track_indices=None, detection_indices=None):
     """Run matching cascade.
 
+    The cost of all tracks and detections is computed with one call to
+    `distance_metric`, every level of the cascade is then solved on the rows
+    of the tracks of that age. Only ages that occur cost any work.
+
     Parameters
     ----------
     distance_metric : Callable[List[Track], List[Detection], List[int], List[int]) -> ndarray
@@ -100,10 +151,10 @@ def matching_cascade(
         disregarded.
     cascade_depth: int
         The cascade depth, should be se to the maximum track age.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track.TrackStore | List[track.Track]
+        The predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : Optional[List[int]]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above). Defaults to all tracks.
@@ -128,29 +179,40 @@ def matching_cascade(
 
     unmatched_detections = detection_indices
     matches = []
-    for level in range(cascade_depth):
-        if len(unmatched_detections) == 0:  # No detections left
-            break
+    if len(track_indices) > 0 and len(detection_indices) > 0:
+        cost_matrix = distance_metric(
+            tracks, detections, track_indices, detection_indices)
+        rows = {k: row for row, k in enumerate(track_indices)}
+        cols = {k: col for col, k in enumerate(detection_indices)}
+
+        def level_metric(tracks, detections, track_indices_l, detection_indices_l):
+            return cost_matrix[np.ix_([rows[k] for k in track_indices_l],
+                                      [cols[k] for k in detection_indices_l])]
+
+        if hasattr(tracks, 'time_since_update'):
+            ages = np.asarray(tracks.time_since_update)[np.asarray(track_indices, dtype=int)]
+        else:
+            ages = np.array([tracks[k].time_since_update for k in track_indices])
+        for age in np.unique(ages):
+            if len(unmatched_detections) == 0:  # No detections left
+                break
+            if not 1 <= age <= cascade_depth:
+                continue
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
-        if len(track_indices_l) == 0:  # Nothing to match at this level
-            continue
-
-        matches_l, _, unmatched_detections = \
-            min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
-                track_indices_l, unmatched_detections)
-        matches += matches_l
+            track_indices_l = [
+                k for k, track_age in zip(track_indices, ages) if track_age == age]
+            matches_l, _, unmatched_detections = \
+                min_cost_matching(
+                    level_metric, max_distance, tracks, detections,
+                    track_indices_l, unmatched_detections)
+            matches += matches_l
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
     return matches, unmatched_tracks, unmatched_detections
 
 
 def gate_cost_matrix(
         kf, cost_matrix, tracks, detections, track_indices, detection_indices,
-        gated_cost=INFTY_COST, only_position=False):
+        gated_cost=INFTY_COST, only_position=False, gating_matrix=None):
     """Invalidate infeasible entries in cost matrix based on the state
     distributions obtained by Kalman filtering.
 
@@ -162,10 +224,10 @@ def gate_cost_matrix(
         and M is the number of detection indices, such that entry (i, j) is the
         association cost between `tracks[track_indices[i]]` and
         `detections[detection_indices[j]]`.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track.TrackStore | List[track.Track]
+        The predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
@@ -178,6 +240,12 @@ def gate_cost_matrix(
     only_position : Optional[bool]
         If True, only the x, y position of the state distribution is considered
         during gating. Defaults to False.
+    gating_matrix : Optional[ndarray]
+        The squared Mahalanobis distances between all `tracks` and all
+        `detections`, as computed by `KalmanFilter.gating_distance_batch` with
+        the same `only_position`. Pass it to compute the distances only once
+        per frame for all cascade levels. If None, the distances of the given
+        tracks and detections are computed.
 
     Returns
     -------
@@ -187,12 +255,22 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    if gating_matrix is None:
+        if hasattr(detections, 'to_xyah'):
+            measurements = detections.to_xyah()[np.asarray(detection_indices, dtype=int)]
+        else:
+            measurements = np.asarray(
+                [detections[i].to_xyah() for i in detection_indices])
+        if hasattr(tracks, 'mean'):
+            track_indices = np.asarray(track_indices, dtype=int)
+            mean, covariance = tracks.mean[track_indices], tracks.covariance[track_indices]
+        else:
+            mean = np.asarray([tracks[i].mean for i in track_indices])
+            covariance = np.asarray([tracks[i].covariance for i in track_indices])
+        gating_distance = kf.gating_distance_batch(
+            mean, covariance, measurements, only_position)
+    else:
+        gating_distance = gating_matrix[np.ix_(track_indices, detection_indices)]
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
     return cost_matrix
 
@@ -54,53 +54,30 @@ def _cosine_distance(a, b, data_is_normalized=False):
     return 1. - np.dot(a, b.T)
 
 
-def _nn_euclidean_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (Euclidean).
-
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
-
-    """
-    distances = _pdist(x, y)
-    return np.maximum(0.0, distances.min(axis=0))
-
-
-def _nn_cosine_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (cosine).
-
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
-
-    """
-    distances = _cosine_distance(x, y)
-    return distances.min(axis=0)
-
-
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
 
+    The samples of all targets live in one preallocated array of shape
+    (rows, capacity, feature dimension), every target owns a row of slots.
+    Cosine features are normalized once when they are inserted.
+
+    When a target has no free slot left, the `policy` decides what happens to
+    a new sample:
+
+    * "fifo": it replaces the oldest sample.
+    * "reservoir": it replaces a random sample with probability
+      budget / samples seen (reservoir sampling), so the gallery is a uniform
+      sample of the whole track history.
+    * "ema": the target keeps a single prototype, the exponential moving
+      average of all its samples (the budget is ignored).
+    * "kcenter": of the samples plus the new one, the closest pair is found
+      and the older of the two is dropped, so the kept samples stay spread
+      out over the appearances of the target.
+    * "kmeans": it is merged into the closest sample, which is the running
+      mean of all samples assigned to it.
+
     Parameters
     ----------
     metric : str
@@ -109,30 +86,195 @@ class NearestNeighborDistanceMetric(object):
         The matching threshold. Samples with larger distance are considered an
         invalid match.
     budget : Optional[int]
-        If not None, fix samples per class to at most this number. Removes
-        the oldest samples when the budget is reached.
+        If not None, fix samples per class to at most this number. Required
+        by all policies but "fifo" and "ema".
+    policy : str
+        What to do with a new sample if the budget of its target is reached,
+        one of "fifo", "reservoir", "ema", "kcenter" or "kmeans".
+    max_samples : Optional[int]
+        If not None, the total number of samples of all targets is capped at
+        this number by lowering the budget of every target to
+        `max_samples // number of targets`. The oldest samples of targets
+        above that budget are evicted. Every target keeps at least its newest
+        sample, so with more targets than `max_samples` there is one sample
+        per target.
+    ema_momentum : float
+        Weight of the old prototype in the moving average of the "ema"
+        policy.
+    initial_capacity : int
+        Number of samples per target that space is allocated for when there is
+        no budget. The capacity doubles whenever a target runs out of space.
+    seed : Optional[int]
+        Seed of the random generator of the "reservoir" policy.
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the samples that are
+        kept, oldest first. Built on access, for inspection only.
+    stats : Dict[str -> int]
+        Counters of what the policy did with the samples: "inserted" into a
+        free slot, "replaced" an older sample, "merged" into a prototype,
+        "dropped" the new sample, or "evicted" to stay below `max_samples`.
 
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    policies = ("fifo", "reservoir", "ema", "kcenter", "kmeans")
 
+    def __init__(self, metric, matching_threshold, budget=None, policy="fifo",
+                 max_samples=None, ema_momentum=0.9, initial_capacity=32,
+                 seed=None):
 
-        if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
-        elif metric == "cosine":
-            self._metric = _nn_cosine_distance
-        else:
+
+        if metric not in ("euclidean", "cosine"):
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        if policy not in self.policies:
+            raise ValueError(
+                "Invalid policy; must be one of {}".format(", ".join(self.policies)))
+        if policy in ("reservoir", "kcenter", "kmeans") and budget is None:
+            raise ValueError("The {} policy needs a budget".format(policy))
+        self.metric = metric
         self.matching_threshold = matching_threshold
-        self.budget = budget
-        self.samples = {}
+        self.budget = 1 if policy == "ema" else budget
+        self.policy = policy
+        self.max_samples = max_samples
+        self.ema_momentum = ema_momentum
+        self.stats = dict.fromkeys(
+            ("inserted", "replaced", "merged", "dropped", "evicted"), 0)
+        self._rng = np.random.RandomState(seed)
+        self._capacity = self.budget if self.budget is not None else initial_capacity
+
+        self._gallery = None  # (rows, capacity, dim) samples
+        self._sq_norms = None  # (rows, capacity) squared sample norms
+        self._stamps = None  # (rows, capacity) insertion time, -1 if free
+        self._weights = None  # (rows, capacity) samples merged into a slot
+        self._seen = np.zeros(0, dtype=np.int64)  # samples offered per row
+        self._clock = 0
+        self._rows = {}  # target -> row
+        self._free_rows = []
+
+    @property
+    def samples(self):
+        samples = {}
+        for target, row in self._rows.items():
+            slots = np.flatnonzero(self._stamps[row] >= 0)
+            slots = slots[np.argsort(self._stamps[row, slots])]
+            samples[target] = self._gallery[row, slots]
+        return samples
+
+    def _allocate(self, num_rows, capacity, dim):
+        gallery = np.zeros((num_rows, capacity, dim), dtype=np.float32)
+        sq_norms = np.zeros((num_rows, capacity), dtype=np.float32)
+        stamps = np.full((num_rows, capacity), -1, dtype=np.int64)
+        weights = np.zeros((num_rows, capacity), dtype=np.int64)
+        seen = np.zeros(num_rows, dtype=np.int64)
+        if self._gallery is not None:
+            rows, cols = self._gallery.shape[:2]
+            gallery[:rows, :cols] = self._gallery
+            sq_norms[:rows, :cols] = self._sq_norms
+            stamps[:rows, :cols] = self._stamps
+            weights[:rows, :cols] = self._weights
+            seen[:rows] = self._seen
+        self._gallery, self._sq_norms, self._stamps = gallery, sq_norms, stamps
+        self._weights, self._seen = weights, seen
+        self._capacity = capacity
+
+    def _row(self, target, dim):
+        row = self._rows.get(target)
+        if row is None:
+            if not self._free_rows:
+                num_rows = 0 if self._gallery is None else len(self._gallery)
+                self._allocate(max(8, 2 * num_rows), self._capacity, dim)
+                self._free_rows = list(range(len(self._gallery) - 1, num_rows - 1, -1))
+            row = self._free_rows.pop()
+            self._stamps[row] = -1
+            self._seen[row] = 0
+            self._rows[target] = row
+        return row
+
+    def _limit(self, num_targets):
+        """The number of samples every target may keep, at least one."""
+        limit = self.budget
+        if self.max_samples is not None:
+            share = max(1, self.max_samples // max(1, num_targets))
+            limit = share if limit is None else min(limit, share)
+        return limit
+
+    def _distances(self, samples, feature):
+        if self.metric == "cosine":
+            return _cosine_distance(samples, feature[np.newaxis], data_is_normalized=True)[:, 0]
+        return _pdist(samples, feature[np.newaxis])[:, 0]
+
+    def _write(self, row, slot, feature, weight=1):
+        if self.metric == "cosine":
+            feature = feature / np.linalg.norm(feature)
+        self._gallery[row, slot] = feature
+        self._sq_norms[row, slot] = np.dot(feature, feature)
+        self._stamps[row, slot] = self._clock
+        self._weights[row, slot] = weight
+
+    def _insert(self, row, feature, limit):
+        self._clock += 1
+        self._seen[row] += 1
+        stamps = self._stamps[row]
+        valid = np.flatnonzero(stamps >= 0)
+        if limit is None or len(valid) < limit:
+            free = np.flatnonzero(stamps < 0)
+            if len(free) == 0:
+                self._allocate(len(self._gallery), 2 * self._capacity, len(feature))
+                free = [len(stamps)]
+            self._write(row, free[0], feature)
+            self.stats["inserted"] += 1
+            return
+
+        if self.policy == "fifo":
+            self._write(row, valid[np.argmin(stamps[valid])], feature)
+            self.stats["replaced"] += 1
+        elif self.policy == "reservoir":
+            j = self._rng.randint(self._seen[row])
+            if j < len(valid):
+                self._write(row, valid[j], feature)
+                self.stats["replaced"] += 1
+            else:
+                self.stats["dropped"] += 1
+        elif self.policy == "ema":
+            slot = valid[0]
+            prototype = self.ema_momentum * self._gallery[row, slot] + \
+                (1. - self.ema_momentum) * feature
+            self._write(row, slot, prototype, self._weights[row, slot] + 1)
+            self.stats["merged"] += 1
+        elif self.policy == "kcenter":
+            samples = self._gallery[row, valid]
+            to_new = self._distances(samples, feature)
+            if self.metric == "cosine":
+                pairwise = _cosine_distance(samples, samples, data_is_normalized=True)
+            else:
+                pairwise = _pdist(samples, samples)
+            pairwise[np.diag_indices_from(pairwise)] = np.inf
+            i, j = np.unravel_index(np.argmin(pairwise), pairwise.shape)
+            if to_new.min() <= pairwise[i, j]:
+                self.stats["dropped"] += 1
+            else:
+                older = valid[i] if stamps[valid[i]] < stamps[valid[j]] else valid[j]
+                self._write(row, older, feature)
+                self.stats["replaced"] += 1
+        elif self.policy == "kmeans":
+            slot = valid[np.argmin(self._distances(self._gallery[row, valid], feature))]
+            weight = self._weights[row, slot] + 1
+            centroid = self._gallery[row, slot] + (feature - self._gallery[row, slot]) / weight
+            self._write(row, slot, centroid, weight)
+            self.stats["merged"] += 1
+
+    def _evict(self, limit):
+        """Drop the oldest samples of every target above `limit`."""
+        for row in self._rows.values():
+            valid = np.flatnonzero(self._stamps[row] >= 0)
+            excess = len(valid) - limit
+            if excess > 0:
+                oldest = valid[np.argsort(self._stamps[row, valid])[:excess]]
+                self._stamps[row, oldest] = -1
+                self.stats["evicted"] += excess
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,11 +289,35 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        features = np.asarray(features, dtype=np.float32)
+        if self.metric == "cosine" and len(features):
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        limit = self._limit(len(set(self._rows) | set(targets)))
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            self._insert(self._row(target, len(feature)), feature, limit)
+
+        active_targets = set(active_targets)
+        for target in [t for t in self._rows if t not in active_targets]:
+            self._free_rows.append(self._rows.pop(target))
+        if self.max_samples is not None:
+            self._evict(self._limit(len(self._rows)))
+
+    def gallery_size(self):
+        """Returns the number of targets and the total number of samples in
+        the gallery."""
+        rows = list(self._rows.values())
+        if not rows:
+            return 0, 0
+        return len(rows), int((self._stamps[rows] >= 0).sum())
+
+    def gallery_stats(self):
+        """Returns the policy, its counters, the gallery size and the memory
+        allocated for the gallery in bytes."""
+        num_targets, num_samples = self.gallery_size()
+        memory = 0 if self._gallery is None else sum(
+            a.nbytes for a in (self._gallery, self._sq_norms, self._stamps, self._weights))
+        return dict(self.stats, policy=self.policy, targets=num_targets,
+                    samples=num_samples, memory_bytes=memory)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -171,7 +337,28 @@ class NearestNeighborDistanceMetric(object):
             `targets[i]` and `features[j]`.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.array([self._rows[target] for target in targets], dtype=np.int64)
+        valid = self._stamps[rows] >= 0
+        used = np.flatnonzero(valid.any(axis=0))
+        if len(used) == 0:
+            return np.full((len(targets), len(features)), np.inf)
+        num_slots = used[-1] + 1
+        valid = valid[:, :num_slots]
+
+        # (targets, slots, features)
+        samples = self._gallery[rows, :num_slots]
+        if self.metric == "cosine":
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+            distances = 1. - np.matmul(samples, features.T)
+        else:
+            distances = (
+                self._sq_norms[rows, :num_slots, np.newaxis] +
+                np.square(features).sum(axis=1)[np.newaxis, np.newaxis, :] -
+                2. * np.matmul(samples, features.T))
+            distances = np.maximum(distances, 0.)
+
+        distances = np.where(valid[:, :, np.newaxis], distances, np.inf)
+        return distances.min(axis=1).astype(np.float64)
@@ -20,10 +20,16 @@ def non_max_suppression(boxes, classes, max_bbox_overlap, scores=None):
         >>> indices = non_max_suppression(boxes, max_bbox_overlap, scores)
         >>> detections = [detections[i] for i in indices]
 
+    A `DetectionBatch` can be passed instead of the boxes:
+
+        >>> indices = non_max_suppression(batch, None, max_bbox_overlap)
+        >>> batch = batch[indices]
+
     Parameters
     ----------
-    boxes : ndarray
-        Array of ROIs (x, y, width, height).
+    boxes : ndarray | deep_sort.detection.DetectionBatch
+        Array of ROIs (x, y, width, height), or a batch of detections whose
+        boxes and (unless `scores` is given) confidences are used.
     max_bbox_overlap : float
         ROIs that overlap more than this values are suppressed.
     scores : Optional[array_like]
@@ -35,6 +41,10 @@ def non_max_suppression(boxes, classes, max_bbox_overlap, scores=None):
         Returns indices of detections that have survived non-maxima suppression.
 
     """
+    if hasattr(boxes, 'tlwh'):
+        if scores is None:
+            scores = boxes.confidence
+        boxes = boxes.tlwh
     if len(boxes) == 0:
         return []
 
@@ -0,0 +1,92 @@
+# vim: expandtab:ts=4:sw=4
+import json
+import cv2
+import numpy as np
+
+
+class RegionOfInterest(object):
+    """
+    A static region of interest (e.g. the playing field) in frame pixels.
+
+    Objects are inside the region if the bottom center of their bounding box,
+    where a player touches the ground, lies on the mask.
+
+    Parameters
+    ----------
+    mask : ndarray
+        A boolean mask, the pixel (x, y) is inside the region if `mask[y, x]`.
+        Pixels beyond the mask are outside the region, so the mask of a
+        polygon only needs to extend to its bottom right corner.
+
+    """
+
+    def __init__(self, mask):
+        self.mask = np.asarray(mask, dtype=bool)
+        ys, xs = np.nonzero(self.mask)
+        if len(xs) == 0:
+            raise ValueError('the region of interest is empty')
+        self._bounds = (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+
+    @classmethod
+    def from_polygon(cls, points):
+        """Create a region from a list of `(x, y)` polygon corners."""
+        points = np.round(np.asarray(points, dtype=np.float64)).astype(np.int32)
+        if points.ndim != 2 or points.shape[0] < 3 or points.shape[1] != 2:
+            raise ValueError('a region of interest polygon needs at least 3 (x, y) points')
+        mask = np.zeros((points[:, 1].max() + 1, points[:, 0].max() + 1), dtype=np.uint8)
+        cv2.fillPoly(mask, [points], 1)
+        return cls(mask)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a region from a JSON file with a list of `[x, y]` polygon
+        corners, or from a mask image of the frame size where every non-zero
+        pixel is inside the region."""
+        if path.lower().endswith('.json'):
+            with open(path) as f:
+                return cls.from_polygon(json.load(f))
+        mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            raise ValueError('could not read region of interest mask {}'.format(path))
+        return cls(mask > 0)
+
+    def bounds(self, height, width):
+        """Returns the bounding box `(xmin, ymin, xmax, ymax)` of the region,
+        clipped to a frame of the given size."""
+        x0, y0, x1, y1 = self._bounds
+        x1, y1 = min(x1, width), min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError('the region of interest lies outside the {}x{} frame'.format(width, height))
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def intersects(self, boxes):
+        """Returns a boolean array that is True for every box `(xmin, ymin,
+        xmax, ymax)` that contains at least one pixel of the region."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        return np.array([self.mask[y0:y1, x0:x1].any() for x0, y0, x1, y1 in boxes], dtype=bool)
+
+    def contains(self, tlwh):
+        """Check which bounding boxes are inside the region.
+
+        Parameters
+        ----------
+        tlwh : ndarray
+            An Nx4 array of bounding boxes in format `(top left x, top left y,
+            width, height)`.
+
+        Returns
+        -------
+        ndarray
+            A boolean array of length N that is True for every box whose bottom
+            center lies inside the region.
+
+        """
+        tlwh = np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)
+        xs = np.floor(tlwh[:, 0] + tlwh[:, 2] / 2.).astype(np.int64)
+        # the last pixel row of the box
+        ys = np.ceil(tlwh[:, 1] + tlwh[:, 3]).astype(np.int64) - 1
+        height, width = self.mask.shape
+        valid = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        inside = np.zeros(len(tlwh), dtype=bool)
+        inside[valid] = self.mask[ys[valid], xs[valid]]
+        return inside
@@ -0,0 +1,120 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+class DetectionScheduler(object):
+    """
+    Decides on which frames the detector has to run. On the other frames the
+    tracks are only propagated by the Kalman filter (`Tracker.predict` with
+    `detect=False`).
+
+    The detection interval grows by one frame after every detection frame on
+    which the confirmed tracks were matched well, and is halved when the match
+    rate drops. Independent of the interval, the detector runs as soon as a
+    confirmed track becomes too uncertain or too many tracks are tentative.
+
+    Parameters
+    ----------
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter of the tracker.
+    min_interval : int
+        Minimum number of frames between two detection frames.
+    max_interval : int
+        Maximum number of frames between two detection frames.
+    max_uncertainty : float
+        Maximum positional standard deviation of a confirmed track, relative to
+        its height, in the projected Kalman covariance.
+    max_tentative : int
+        Maximum number of tentative tracks before detecting.
+    min_match_rate : float
+        The fraction of confirmed tracks that must be matched on a detection
+        frame to increase the interval.
+
+    Attributes
+    ----------
+    interval : int
+        The current detection interval.
+    num_detected : int
+        Number of frames the detector was run on.
+    num_skipped : int
+        Number of frames the detector was skipped on.
+
+    """
+
+    def __init__(self, kf, min_interval=1, max_interval=5, max_uncertainty=0.15,
+                 max_tentative=2, min_match_rate=0.8):
+        self.kf = kf
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.max_uncertainty = max_uncertainty
+        self.max_tentative = max_tentative
+        self.min_match_rate = min_match_rate
+
+        self.interval = min_interval
+        self.num_detected = 0
+        self.num_skipped = 0
+        self._frames_since_detection = None
+
+    def uncertainty(self, tracks):
+        """Returns the largest positional standard deviation of a confirmed
+        track relative to its height, or 0 if there are no confirmed tracks."""
+        confirmed = [t for t in tracks if t.is_confirmed()]
+        if not confirmed:
+            return 0.
+        mean, covariance = self.kf.project_batch(
+            np.asarray([t.mean for t in confirmed]),
+            np.asarray([t.covariance for t in confirmed]))
+        std = np.sqrt(np.maximum(covariance[:, 0, 0], covariance[:, 1, 1]))
+        return float(np.max(std / mean[:, 3]))
+
+    def should_detect(self, tracks):
+        """Decide whether the detector runs on the next frame. Call once per
+        frame, before `Tracker.predict`.
+
+        Parameters
+        ----------
+        tracks : List[track.Track]
+            The tracks after the last update.
+
+        Returns
+        -------
+        bool
+            True if the detector has to run on this frame.
+
+        """
+        since = self._frames_since_detection
+        detect = (
+            since is None or since + 1 >= self.interval or
+            sum(1 for t in tracks if t.is_tentative()) > self.max_tentative or
+            self.uncertainty(tracks) > self.max_uncertainty)
+        if since is not None and since + 1 < self.min_interval:
+            detect = False
+
+        if detect:
+            self._frames_since_detection = 0
+            self.num_detected += 1
+        else:
+            self._frames_since_detection += 1
+            self.num_skipped += 1
+        return detect
+
+    def observe(self, tracks):
+        """Adapt the interval to the result of a detection frame. Call after
+        `Tracker.update`.
+
+        Parameters
+        ----------
+        tracks : List[track.Track]
+            The tracks after the update.
+
+        """
+        confirmed = [t for t in tracks if t.is_confirmed()]
+        tentative = sum(1 for t in tracks if t.is_tentative())
+        if confirmed:
+            match_rate = sum(1 for t in confirmed if t.time_since_update == 0) / float(len(confirmed))
+        else:
+            match_rate = 0.
+        if match_rate >= self.min_match_rate and tentative <= self.max_tentative:
+            self.interval = min(self.interval + 1, self.max_interval)
+        else:
+            self.interval = max(self.interval // 2, self.min_interval)
@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import numpy as np
 
 
 class TrackState:
@@ -137,7 +138,7 @@ class Track:
    
         
     
-    def predict(self, kf):
+    def predict(self, kf, detect=True, check_position=True):
         """Propagate the state distribution to the current time step using a
         Kalman filter prediction step.
 
@@ -145,13 +146,26 @@ class Track:
         ----------
         kf : kalman_filter.KalmanFilter
             The Kalman filter.
+        detect : bool
+            If False, no detections are available at this time step, so
+            `time_since_update` is not increased.
+        check_position : bool
+            If False, tracks at the top and right border of the screen are not
+            deleted, e.g. because the tracker checks a region of interest.
 
         """
+        mean, covariance = kf.predict(self.mean, self.covariance)
+        self.apply_prediction(mean, covariance, detect, check_position)
 
-
-        self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+    def apply_prediction(self, mean, covariance, detect=True, check_position=True):
+        """Set the predicted state distribution, e.g. as computed for all
+        tracks at once by `KalmanFilter.predict_batch`, and advance the track
+        to the current time step. See `predict` for the parameters.
+        """
+        self.mean, self.covariance = mean, covariance
         self.age += 1
-        self.time_since_update += 1
+        if detect:
+            self.time_since_update += 1
         
         self.last_mean = self.mean
         self.last_covariance = self.covariance
@@ -163,7 +177,7 @@ class Track:
 
         # self.to_tlbr in bbox format `(min x, min y, max x, max y)`
         # if min y is kleiner dan 40.0:
-        if self.to_tlbr()[1] < 40.0 or self.to_tlbr()[0] > 1918: 
+        if check_position and (self.to_tlbr()[1] < 40.0 or self.to_tlbr()[0] > 1918):
 
             self.state = TrackState.Deleted
             return
@@ -188,10 +202,16 @@ class Track:
             The associated detection.
 
         """
-        
-        self.mean, self.covariance = kf.update(
-                self.mean, self.covariance, detection.to_xyah())   
-
+        mean, covariance = kf.update(
+                self.mean, self.covariance, detection.to_xyah())
+        self.apply_update(mean, covariance, detection)
+
+    def apply_update(self, mean, covariance, detection):
+        """Set the measurement-corrected state distribution, e.g. as computed
+        for all matched tracks at once by `KalmanFilter.update_batch`, and
+        update the feature cache. See `update` for the parameters.
+        """
+        self.mean, self.covariance = mean, covariance
 
         self.features.append(detection.feature)
         
@@ -248,3 +268,389 @@ class Track:
     def is_deleted(self):
         """Returns True if this track is dead and should be deleted."""
         return self.state == TrackState.Deleted
+
+
+class TrackStore(object):
+    """
+    The tracks of a tracker, stored column by column in preallocated arrays
+    that grow on demand.
+
+    Row `i` of every array belongs to the `i`-th active track. Rows keep the
+    order in which the tracks were created, deleted tracks are removed by
+    `remove_deleted`. Indexing the store returns a `TrackView` of a row that
+    offers the interface of `Track`, so the store can be used wherever a list
+    of tracks is expected. A view refers to a row, it is only valid until the
+    next call of `remove_deleted`.
+
+    Parameters
+    ----------
+    n_init : int
+        Number of consecutive detections before a track is confirmed.
+    max_age : int
+        The maximum number of consecutive misses before a track is deleted.
+    capacity : int
+        The number of tracks to allocate space for initially.
+
+    Attributes
+    ----------
+    track_id, state, hits, age, time_since_update : ndarray
+        The per track counters, see `Track`.
+    mean : ndarray
+        The Nx8 state means.
+    covariance : ndarray
+        The Nx8x8 state covariances.
+    class_name : ndarray
+        The class names (an object array).
+    color_names : List[str]
+        Maps the color indices of the team votes to jersey colors.
+
+    """
+
+    # votes needed before the jersey color of a track is fixed
+    color_votes = 17
+
+    def __init__(self, n_init, max_age, capacity=32):
+        self.n_init = n_init
+        self.max_age = max_age
+        self.color_names = []
+        self._color_index = {}
+        self._count = 0
+        self._pending_ids = []
+        self._pending_features = []
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity):
+        def grow(name, shape, dtype, fill=0):
+            array = np.full((capacity,) + shape, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                array[:self._count] = old[:self._count]
+            setattr(self, name, array)
+
+        grow('_track_id', (), np.int64)
+        grow('_state', (), np.int8)
+        grow('_hits', (), np.int32)
+        grow('_age', (), np.int32)
+        grow('_time_since_update', (), np.int32)
+        grow('_mean', (8,), np.float64)
+        grow('_covariance', (8, 8), np.float64)
+        grow('_last_mean', (8,), np.float64)
+        grow('_last_covariance', (8, 8), np.float64)
+        grow('_class_name', (), object, None)
+        grow('_color_confirmed', (), bool, False)
+        grow('_confirmed_color', (), np.int32, -1)
+        grow('_num_votes', (), np.int32)
+        # the votes in order until the color is fixed, and how many of the
+        # last ones are for another color than the fixed one
+        grow('_vote_history', (self.color_votes,), np.int32, -1)
+        grow('_off_color_votes', (), np.int32)
+        # one column per jersey color, widened by `color_id`
+        grow('_votes', (getattr(self, '_votes', np.zeros((0, 4))).shape[1],), np.int32)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not -self._count <= index < self._count:
+            raise IndexError('track index out of range')
+        return TrackView(self, index % self._count)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield TrackView(self, i)
+
+    track_id = property(lambda self: self._track_id[:self._count])
+    state = property(lambda self: self._state[:self._count])
+    hits = property(lambda self: self._hits[:self._count])
+    age = property(lambda self: self._age[:self._count])
+    time_since_update = property(lambda self: self._time_since_update[:self._count])
+    mean = property(lambda self: self._mean[:self._count])
+    covariance = property(lambda self: self._covariance[:self._count])
+    class_name = property(lambda self: self._class_name[:self._count])
+
+    def to_tlwh(self):
+        """Returns the Nx4 bounding boxes `(top left x, top left y, width,
+        height)` of all tracks."""
+        ret = self.mean[:, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def to_tlbr(self):
+        """Returns the Nx4 bounding boxes `(min x, min y, max x, max y)` of
+        all tracks."""
+        ret = self.to_tlwh()
+        ret[:, 2:] += ret[:, :2]
+        return ret
+
+    def color_id(self, color):
+        """Returns the index of a jersey color in `color_names`, -1 for None."""
+        if color is None:
+            return -1
+        index = self._color_index.get(color)
+        if index is None:
+            index = self._color_index[color] = len(self.color_names)
+            self.color_names.append(color)
+            if index >= self._votes.shape[1]:
+                votes = np.zeros((len(self._votes), 2 * self._votes.shape[1]), dtype=np.int32)
+                votes[:, :self._votes.shape[1]] = self._votes
+                self._votes = votes
+        return index
+
+    def get_color(self, index):
+        """Returns the jersey color that has been detected most often for the
+        track in row `index`, or None."""
+        if self._color_confirmed[index]:
+            return self.color_names[self._confirmed_color[index]]
+        if self._num_votes[index] == 0:
+            return None
+        return self.color_names[int(np.argmax(self._votes[index]))]
+
+    def add(self, mean, covariance, track_id, feature=None, class_name=None, color=None):
+        """Append a new tentative track and return its row."""
+        if self._count == len(self._track_id):
+            self._allocate(2 * len(self._track_id))
+        color_id = self.color_id(color)
+        i = self._count
+        self._count += 1
+        self._track_id[i] = track_id
+        self._state[i] = TrackState.Tentative
+        self._hits[i] = 1
+        self._age[i] = 1
+        self._time_since_update[i] = 0
+        self._mean[i] = mean
+        self._covariance[i] = covariance
+        self._last_mean[i] = mean
+        self._last_covariance[i] = covariance
+        self._class_name[i] = class_name
+        self._color_confirmed[i] = False
+        self._confirmed_color[i] = -1
+        self._votes[i] = 0
+        self._num_votes[i] = 0
+        self._vote_history[i] = -1
+        self._off_color_votes[i] = 0
+        if color_id >= 0:
+            self._votes[i, color_id] = 1
+            self._num_votes[i] = 1
+            self._vote_history[i, 0] = color_id
+        if feature is not None:
+            self._pending_ids.append(track_id)
+            self._pending_features.append(feature)
+        return i
+
+    def apply_prediction(self, mean, covariance, detect=True, check_position=True):
+        """Set the predicted state distributions of all tracks, as computed by
+        `KalmanFilter.predict_batch`, and advance them to the current time
+        step. See `Track.predict` for the parameters.
+        """
+        n = self._count
+        self._mean[:n] = self._last_mean[:n] = mean
+        self._covariance[:n] = self._last_covariance[:n] = covariance
+        self._age[:n] += 1
+        if detect:
+            self._time_since_update[:n] += 1
+
+        # the screen border and bounding box size rules of Track.predict
+        tlbr = self.to_tlbr()
+        delete = (tlbr[:, 3] - tlbr[:, 1]) > 170
+        if check_position:
+            delete |= (tlbr[:, 1] < 40.0) | (tlbr[:, 0] > 1918)
+        self.state[delete] = TrackState.Deleted
+
+    def apply_update(self, rows, mean, covariance, features=None, color_ids=None, color_names=None):
+        """Set the measurement-corrected state distributions of the tracks in
+        `rows`, as computed by `KalmanFilter.update_batch`, and count their
+        team votes. See `Track.update`.
+
+        Parameters
+        ----------
+        rows : ndarray
+            The rows of the matched tracks, every row at most once.
+        mean, covariance : ndarray
+            The corrected state distributions of these tracks.
+        features : Optional[ndarray]
+            The features of the associated detections.
+        color_ids : Optional[ndarray]
+            The jersey colors of the associated detections as indices into
+            `color_names`, -1 for none.
+        color_names : Optional[Sequence[str]]
+            Maps `color_ids` to jersey colors.
+
+        """
+        rows = np.asarray(rows, dtype=int)
+        if features is not None:
+            self.add_features(rows, features)
+
+        colors = np.full(len(rows), -1, dtype=np.int32)
+        if color_ids is not None and len(rows):
+            lookup = np.array([self.color_id(name) for name in color_names or []] + [-1], dtype=np.int32)
+            colors = lookup[np.asarray(color_ids, dtype=int)]
+
+        # count votes until the color of a track is fixed
+        voting = (colors >= 0) & ~self._color_confirmed[rows]
+        self._votes[rows[voting], colors[voting]] += 1
+        self._vote_history[rows[voting], self._num_votes[rows[voting]]] = colors[voting]
+        self._num_votes[rows[voting]] += 1
+        fixed = voting & (self._num_votes[rows] >= self.color_votes)
+        fixed_rows = rows[fixed]
+        self._confirmed_color[fixed_rows] = np.argmax(self._votes[fixed_rows], axis=1)
+        self._color_confirmed[fixed_rows] = True
+        # the trailing votes for other colors, except the one just cast,
+        # which is rejected below
+        off_color = (self._vote_history[fixed_rows] != self._confirmed_color[fixed_rows, np.newaxis])[:, ::-1]
+        trailing = np.where(off_color.all(axis=1), self.color_votes, np.argmin(off_color, axis=1))
+        self._off_color_votes[fixed_rows] = np.maximum(trailing - 1, 0)
+
+        # a detection with a different jersey color than the one fixed for the
+        # track does not count, the track keeps its predicted state. Neither
+        # does a detection without a color while the last vote of the track
+        # was for another color, which uses up that vote (see Track.update)
+        confirmed = self._color_confirmed[rows]
+        rejected = (colors >= 0) & confirmed & (colors != self._confirmed_color[rows])
+        uncolored = (colors < 0) & confirmed & (self._off_color_votes[rows] > 0)
+        self._off_color_votes[rows[uncolored]] -= 1
+        self._off_color_votes[rows[(colors >= 0) & confirmed & ~rejected]] = 0
+        rejected |= uncolored
+        accepted, rejected = rows[~rejected], rows[rejected]
+        keep = np.flatnonzero(np.isin(rows, accepted))
+        self._mean[accepted] = np.asarray(mean)[keep]
+        self._covariance[accepted] = np.asarray(covariance)[keep]
+        self._mean[rejected] = self._last_mean[rejected]
+        self._covariance[rejected] = self._last_covariance[rejected]
+        self._hits[rejected] -= 1
+
+        self._time_since_update[accepted] = 0
+        self._hits[accepted] += 1
+        confirm = accepted[(self._state[accepted] == TrackState.Tentative) &
+                           (self._hits[accepted] >= self.n_init)]
+        self._state[confirm] = TrackState.Confirmed
+
+    def mark_missed(self, rows):
+        """Mark the tracks in `rows` as missed (no association at the current
+        time step)."""
+        rows = np.asarray(rows, dtype=int)
+        missed = (self._state[rows] == TrackState.Tentative) | (self._time_since_update[rows] > self.max_age)
+        self._state[rows[missed]] = TrackState.Deleted
+
+    def remove_deleted(self):
+        """Drop the deleted tracks, the remaining tracks keep their order."""
+        keep = np.flatnonzero(self.state != TrackState.Deleted)
+        if len(keep) == self._count:
+            return
+        for name in ('_track_id', '_state', '_hits', '_age', '_time_since_update', '_mean',
+                     '_covariance', '_last_mean', '_last_covariance', '_class_name',
+                     '_color_confirmed', '_confirmed_color', '_num_votes', '_votes', '_vote_history',
+                     '_off_color_votes'):
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self._count = len(keep)
+
+    def add_features(self, rows, features):
+        """Add the features of the detections associated with the tracks in
+        `rows` to their feature caches."""
+        self._pending_ids.extend(self._track_id[np.asarray(rows, dtype=int)])
+        self._pending_features.extend(features)
+
+    def features(self, index):
+        """Returns the features of the track in row `index` that have not been
+        passed on by `pop_features` yet."""
+        track_id = self._track_id[index]
+        return [f for i, f in zip(self._pending_ids, self._pending_features) if i == track_id]
+
+    def pop_features(self):
+        """Take the features of the confirmed tracks that were added since the
+        last call, sorted by track. Features of tentative tracks are kept until
+        they are confirmed, those of removed tracks are dropped.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            The features and the track ids they belong to.
+
+        """
+        ids = np.asarray(self._pending_ids, dtype=np.int64)
+        confirmed = np.isin(ids, self.track_id[self.state == TrackState.Confirmed])
+        tentative = np.isin(ids, self.track_id[self.state == TrackState.Tentative])
+        order = np.flatnonzero(confirmed)
+        order = order[np.argsort(ids[order], kind='stable')]
+        features = [self._pending_features[i] for i in order]
+        self._pending_features = [self._pending_features[i] for i in np.flatnonzero(tentative)]
+        self._pending_ids = ids[tentative].tolist()
+        return np.asarray(features), ids[order]
+
+
+class TrackView(object):
+    """
+    A single track of a `TrackStore`, with the interface of `Track`.
+
+    Parameters
+    ----------
+    store : TrackStore
+        The store of the track.
+    index : int
+        The row of the track in the store.
+
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    track_id = property(lambda self: int(self._store._track_id[self._index]))
+    hits = property(lambda self: int(self._store._hits[self._index]))
+    age = property(lambda self: int(self._store._age[self._index]))
+    time_since_update = property(lambda self: int(self._store._time_since_update[self._index]))
+    mean = property(lambda self: self._store._mean[self._index])
+    covariance = property(lambda self: self._store._covariance[self._index])
+    class_name = property(lambda self: self._store._class_name[self._index])
+    features = property(lambda self: self._store.features(self._index))
+
+    @property
+    def state(self):
+        return int(self._store._state[self._index])
+
+    @state.setter
+    def state(self, state):
+        self._store._state[self._index] = state
+
+    def to_tlwh(self):
+        """Get current position in bounding box format `(top left x, top left y,
+        width, height)`."""
+        ret = self.mean[:4].copy()
+        ret[2] *= ret[3]
+        ret[:2] -= ret[2:] / 2
+        return ret
+
+    def to_tlbr(self):
+        """Get current position in bounding box format `(min x, miny, max x,
+        max y)`."""
+        ret = self.to_tlwh()
+        ret[2:] = ret[:2] + ret[2:]
+        return ret
+
+    def get_class(self):
+        return self.class_name
+
+    def get_color(self):
+        """Return color that has been detected most often for this track"""
+        return self._store.get_color(self._index)
+
+    def mark_missed(self):
+        """Mark this track as missed (no association at the current time step).
+        """
+        self._store.mark_missed([self._index])
+
+    def is_tentative(self):
+        """Returns True if this track is tentative (unconfirmed).
+        """
+        return self.state == TrackState.Tentative
+
+    def is_confirmed(self):
+        """Returns True if this track is confirmed."""
+        return self.state == TrackState.Confirmed
+
+    def is_deleted(self):
+        """Returns True if this track is dead and should be deleted."""
+        return self.state == TrackState.Deleted
@@ -1,10 +1,12 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
+import contextlib
 import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .track import TrackState, TrackStore
+from .detection import DetectionBatch
 
 
 class Tracker:
@@ -21,6 +23,31 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    roi : Optional[roi.RegionOfInterest]
+        If given, tracks are deleted as soon as they leave this region of
+        interest, instead of at the hardcoded screen borders.
+    metrics : Optional[core.metrics.Metrics]
+        If given, the latencies of the Kalman filter, the matching cascade and
+        the IOU matching are recorded in it.
+    lazy_features : bool
+        If True and the detections come without features, only the detections
+        whose association depends on their appearance are encoded: those in
+        the gate of more than one confirmed track, those that share the gate
+        of a confirmed track with other detections, and those outside the gate
+        of every confirmed track (which go on to the IOU matching or start a
+        new track). A detection alone in the gate of a confirmed track that
+        has no other detection in its gate is matched to it without a feature,
+        and adds no sample to the gallery of the track.
+    feature_throttle : Optional[feature_throttle.FeatureThrottle]
+        If given, a detection without a feature reuses the cached feature of a
+        track that hardly moved since it was last encoded, see
+        `FeatureThrottle`, if the cascade matches it to that track in any
+        case: it is alone in the gate of the track, the track has no other
+        detection in its gate, and the cached feature is within the matching
+        threshold of the gallery of the track. Detections that may start or
+        feed a tentative track are always encoded. With `lazy_features` these
+        detections are skipped anyway, so the throttle only saves work without
+        it.
 
     Attributes
     ----------
@@ -32,108 +59,164 @@ class Tracker:
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
-    tracks : List[Track]
-        The list of active tracks at the current time step.
+    tracks : TrackStore
+        The active tracks at the current time step.
+    feature_stats : Dict[str, int]
+        Number of detections that were `encoded` on demand and that were
+        `skipped` by `lazy_features`.
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=60, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=60, n_init=3, roi=None,
+                 metrics=None, lazy_features=False, feature_throttle=None):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.roi = roi
+        self.metrics = metrics
+        self.lazy_features = lazy_features
+        self.feature_throttle = feature_throttle
+        self.feature_stats = {'encoded': 0, 'skipped': 0}
 
         self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        self.tracks = TrackStore(n_init, max_age)
         self._next_id = 1
 
-    def predict(self):
+    def predict(self, detect=True):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
+
+        Parameters
+        ----------
+        detect : bool
+            Set to False on time steps where the detector is not run. The tracks
+            are propagated but the time step does not count as a missed update,
+            and `update` must not be called afterwards.
+
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        with self._time('kalman'):
+            if len(self.tracks):
+                mean, covariance = self.kf.predict_batch(
+                    self.tracks.mean, self.tracks.covariance)
+                self.tracks.apply_prediction(mean, covariance, detect,
+                                             check_position=self.roi is None)
+        if self.roi is not None and len(self.tracks):
+            inside = self.roi.contains(self.tracks.to_tlwh())
+            self.tracks.state[~inside] = TrackState.Deleted
+        if not detect:
+            self.tracks.remove_deleted()
 
 
-    def update(self, detections):
+    def update(self, detections, encoder=None):
         """Perform measurement update and track management.
 
         Parameters
         ----------
-        detections : List[deep_sort.detection.Detection]
-            A list of detections at the current time step.
+        detections : deep_sort.detection.DetectionBatch | List[deep_sort.detection.Detection]
+            The detections at the current time step. A list is collected into a
+            `DetectionBatch` first.
+        encoder : Optional[Callable[[ndarray], ndarray]]
+            Computes the features of the detections at the given indices. Only
+            used for a `DetectionBatch` without features, it is called at
+            most once, for the detections that need a feature.
 
         """
+        if not isinstance(detections, DetectionBatch):
+            detections = DetectionBatch.from_detections(detections)
+
+        # Mahalanobis distances of all tracks to all detections, shared by all
+        # levels of the matching cascade.
+        gating_matrix = None
+        if len(self.tracks) and len(detections):
+            gating_matrix = self.kf.gating_distance_batch(
+                self.tracks.mean, self.tracks.covariance, detections.to_xyah())
+
+        reused = np.zeros(len(detections), dtype=bool)
+        if not detections.has_feature.all() and encoder is not None:
+            reused = self._encode(detections, encoder, gating_matrix)
+
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
-        
+            self._match(detections, gating_matrix)
+
         # Update track set.
-        for track_idx, detection_idx in matches:
-            
-            if not self.tracks[track_idx].is_deleted(): #ADDED
-                self.tracks[track_idx].update(
-                self.kf, detections[detection_idx])
+        with self._time('kalman'):
+            matches = np.asarray(matches, dtype=int).reshape(-1, 2)
+            matches_alive = matches[self.tracks.state[matches[:, 0]] != TrackState.Deleted]
+            if len(matches_alive):
+                rows, cols = matches_alive[:, 0], matches_alive[:, 1]
+                mean, covariance = self.kf.update_batch(
+                    self.tracks.mean[rows], self.tracks.covariance[rows],
+                    detections.to_xyah()[cols])
+                self.tracks.apply_update(
+                    rows, mean, covariance, None,
+                    detections.color_ids[cols], detections.color_names)
+                # reused features are already in the gallery
+                fresh = detections.has_feature[cols] & ~reused[cols]
+                if fresh.any():
+                    self.tracks.add_features(rows[fresh], detections.features[cols[fresh]])
+                    if self.feature_throttle is not None:
+                        self.feature_throttle.record(
+                            self.tracks.track_id[rows[fresh]], detections.tlwh[cols[fresh]],
+                            detections.features[cols[fresh]])
 
-        for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
+        self.tracks.mark_missed(unmatched_tracks)
 
         for detection_idx in unmatched_detections:
             self._initiate_track(detections[detection_idx])
 
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        self.tracks.remove_deleted()
+        if self.feature_throttle is not None:
+            self.feature_throttle.advance(self.tracks.track_id)
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
-        features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = [] # Or maybe even just comment out this one?
+        active_targets = self.tracks.track_id[self.tracks.state == TrackState.Confirmed]
+        features, targets = self.tracks.pop_features()
+        self.metric.partial_fit(features, targets, active_targets)
 
 
-        self.metric.partial_fit(
-            np.asarray(features), np.asarray(targets), active_targets)
-
-
-    def _match(self, detections):
+    def _match(self, detections, gating_matrix):
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
+            detection_indices = np.asarray(detection_indices, dtype=int)
+            targets = tracks.track_id[track_indices]
+            # pairs without a feature are left to the gate, see lazy_features
+            known = dets.has_feature[detection_indices]
+            cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
+            if known.any():
+                cost_matrix[:, known] = self.metric.distance(
+                    dets.features[detection_indices[known]], targets)
             cost_matrix = linear_assignment.gate_cost_matrix(
                 self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
+                detection_indices, gating_matrix=gating_matrix)
 
             return cost_matrix
 
         # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        confirmed = self.tracks.state == TrackState.Confirmed
+        confirmed_tracks = np.flatnonzero(confirmed).tolist()
+        unconfirmed_tracks = np.flatnonzero(~confirmed).tolist()
 
         # Associate confirmed tracks using appearance features.
-        matches_a, unmatched_tracks_a, unmatched_detections = \
-            linear_assignment.matching_cascade(
-                gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+        with self._time('matching_cascade'):
+            matches_a, unmatched_tracks_a, unmatched_detections = \
+                linear_assignment.matching_cascade(
+                    gated_metric, self.metric.matching_threshold, self.max_age,
+                    self.tracks, detections, confirmed_tracks)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
+        time_since_update = self.tracks.time_since_update
         iou_track_candidates = unconfirmed_tracks + [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
+            k for k in unmatched_tracks_a if time_since_update[k] == 1]
         unmatched_tracks_a = [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
-        matches_b, unmatched_tracks_b, unmatched_detections = \
-            linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
-                detections, iou_track_candidates, unmatched_detections)
+            k for k in unmatched_tracks_a if time_since_update[k] != 1]
+        with self._time('iou_matching'):
+            matches_b, unmatched_tracks_b, unmatched_detections = \
+                linear_assignment.min_cost_matching(
+                    iou_matching.iou_cost, self.max_iou_distance, self.tracks,
+                    detections, iou_track_candidates, unmatched_detections)
 
         matches = list(set(matches_a + matches_b))
 
@@ -141,11 +224,74 @@ class Tracker:
 
         return matches, unmatched_tracks, unmatched_detections
 
+    def _encode(self, detections, encoder, gating_matrix):
+        """Compute the missing features of the detections that need one.
+        Returns a boolean array that is True for the detections that reuse a
+        cached track feature."""
+        needed = ~detections.has_feature
+        reused = np.zeros(len(detections), dtype=bool)
+        if gating_matrix is not None and (self.lazy_features or self.feature_throttle is not None):
+            # the track each detection is matched to in any case, or -1
+            matched_to = self._unambiguous_tracks(gating_matrix)
+            unambiguous = needed & (matched_to >= 0)
+            if self.feature_throttle is not None and not self.lazy_features:
+                indices, track_ids, features = self.feature_throttle.lookup(detections.tlwh, unambiguous)
+                rows = matched_to[indices]
+                # only reuse the feature of the track the detection is matched
+                # to, and only if the cascade accepts it as that track
+                valid = track_ids == self.tracks.track_id[rows]
+                if valid.any():
+                    distance = np.diagonal(self.metric.distance(features[valid], track_ids[valid]))
+                    valid[valid] = distance <= self.metric.matching_threshold
+                if valid.any():
+                    detections.set_features(indices[valid], features[valid])
+                    reused[indices[valid]] = True
+                    needed[indices[valid]] = False
+            if self.lazy_features:
+                self.feature_stats['skipped'] += int(np.count_nonzero(unambiguous))
+                needed &= ~unambiguous
+        indices = np.flatnonzero(needed)
+        if self.feature_throttle is not None:
+            self.feature_throttle.count(np.count_nonzero(reused), len(indices))
+        if len(indices):
+            detections.set_features(indices, encoder(indices))
+            self.feature_stats['encoded'] += len(indices)
+        return reused
+
+    def _unambiguous_tracks(self, gating_matrix):
+        """Returns for every detection the row of the confirmed track the
+        matching cascade matches it to in any case, or -1.
+
+        That is the case if the detection is alone in the gate of the track,
+        the track has no other detection in its gate and the appearance cost
+        of the pair is within the matching threshold. Pairs without a feature
+        get a cost of 0 in `gated_metric`, so lazily skipped detections are
+        always matched.
+        """
+        time_since_update = self.tracks.time_since_update
+        candidates = np.flatnonzero((self.tracks.state == TrackState.Confirmed) &
+                                    (time_since_update >= 1) & (time_since_update <= self.max_age))
+        gate = gating_matrix[candidates] <= kalman_filter.chi2inv95[4]
+        single = gate & (gate.sum(axis=1) == 1)[:, np.newaxis]
+        unambiguous = (gate.sum(axis=0) == 1) & single.any(axis=0)
+        matched_to = np.full(gating_matrix.shape[1], -1, dtype=int)
+        if unambiguous.any():
+            matched_to[unambiguous] = candidates[np.argmax(single[:, unambiguous], axis=0)]
+        return matched_to
+
+    def _time(self, stage):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.time(stage)
+
     def _initiate_track(self, detection):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         class_name = detection.get_class()
         color = detection.get_color()
-        self.tracks.append(Track(
-            mean, covariance, self._next_id, self.n_init, self.max_age,
-            detection.feature, class_name, color)) # ADDED color by Bas
+        feature = detection.feature
+        self.tracks.add(
+            mean, covariance, self._next_id, feature, class_name,
+            color) # ADDED color by Bas
+        if self.feature_throttle is not None and feature is not None:
+            self.feature_throttle.record([self._next_id], detection.tlwh, [feature])
         self._next_id += 1
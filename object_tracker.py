@@ -2,6 +2,7 @@ import os
 # comment out below line to enable tensorflow logging outputs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 import time
+import functools
 import tensorflow as tf
 physical_devices = tf.config.experimental.list_physical_devices('GPU')
 if len(physical_devices) > 0:
@@ -10,10 +11,16 @@ from absl import app, flags, logging
 from absl.flags import FLAGS
 import core.utils as utils
 from core.yolov4 import filter_boxes
+from core.pipeline import StagedPipeline
+from core.track_output import open_track_writer
+from core.detection_cache import DetectionCache, DetectionCacheWriter, cache_key, file_hash, path_fingerprint
+from core.tiling import parse_tiles, tile_layout, crop_tiles, merge_tile_detections
+from core.postprocess import DetectionFilter
+from core.metrics import Metrics, JsonMetricsWriter, serve_prometheus
 from tensorflow.python.saved_model import tag_constants
 from core.config import cfg
 from PIL import Image
-from deep_sort.color_detect import find_color
+from deep_sort.color_detect import color_fractions, pick_colors
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
@@ -21,10 +28,19 @@ from tensorflow.compat.v1 import ConfigProto
 from tensorflow.compat.v1 import InteractiveSession
 # deep sort imports
 from deep_sort import preprocessing, nn_matching
-from deep_sort.detection import Detection
+from deep_sort.detection import DetectionBatch
 from deep_sort.tracker import Tracker
+from deep_sort.scheduler import DetectionScheduler
+from deep_sort.feature_throttle import FeatureThrottle
+from deep_sort.roi import RegionOfInterest
 from tools import generate_detections as gdet
 flags.DEFINE_string('framework', 'tf', '(tf, tflite, trt')
+flags.DEFINE_string('reid_model', 'model_data/mars-small128.pb', 'path to the ReID encoder, a frozen graph or a .tflite file from convert_encoder.py')
+flags.DEFINE_string('reid_backend', 'graph', 'how the ReID encoder runs (graph: tf.compat.v1 session, function: TF2 concrete function, tflite)')
+flags.DEFINE_boolean('lazy_reid', False, 'only compute the ReID features of detections whose association depends on their appearance, once per frame during tracking')
+flags.DEFINE_boolean('reuse_reid', False, 'reuse the last ReID feature of a track for a detection matched to it that overlaps the box it was computed for, no effect with --lazy_reid')
+flags.DEFINE_float('reuse_min_iou', 0.8, 'minimum IoU of a detection and the box the ReID feature of a track was computed for, with --reuse_reid')
+flags.DEFINE_integer('reuse_max_age', 10, 'maximum number of tracker updates (frames the detector ran on) the ReID feature of a track is reused for, with --reuse_reid')
 flags.DEFINE_string('weights', './checkpoints/yolov4-416',
                     'path to weights file')
 flags.DEFINE_integer('size', 416, 'resize images to')
@@ -45,29 +61,39 @@ flags.DEFINE_float('cosine', 0.4, 'max cosine distance')
 flags.DEFINE_float('nms_overlap', 1.0, 'NMS max overlap')
 flags.DEFINE_integer('max_age', 60, 'deep sort max age parameter')
 flags.DEFINE_integer('n_init', 3, 'deep sort nr init parameter')
-
-def main(_argv):
-    # Definition of the parameters
-    max_cosine_distance = FLAGS.cosine
-    nn_budget = None
-    nms_max_overlap = FLAGS.nms_overlap
-    jersey_colors = FLAGS.jersey_colors
-    
-    # initialize deep sort
-    model_filename = 'model_data/mars-small128.pb'
-    encoder = gdet.create_box_encoder(model_filename, batch_size=1)
-    # calculate cosine distance metric
-    metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-    # initialize tracker
-    tracker = Tracker(metric, max_age=FLAGS.max_age, n_init=FLAGS.n_init)
-
-    # load configuration for object detector
-    config = ConfigProto()
-    config.gpu_options.allow_growth = True
-    session = InteractiveSession(config=config)
-    STRIDES, ANCHORS, NUM_CLASS, XYSCALE = utils.load_config(FLAGS)
+flags.DEFINE_integer('nn_budget', None, 'max number of appearance features kept per track, unbounded if not set or 0')
+flags.DEFINE_string('gallery_policy', 'fifo', 'what to do with a new feature when a track is at its budget (fifo, reservoir, ema, kcenter, kmeans)')
+flags.DEFINE_integer('gallery_max_samples', None, 'cap on the appearance features of all tracks of a stream together, every track keeps at least one')
+
+flags.DEFINE_boolean('pipeline', False, 'run decode, preprocess, detect, encode, associate and render/write in separate threads')
+flags.DEFINE_integer('queue_size', 8, 'max number of frame batches buffered between two pipeline stages')
+flags.DEFINE_integer('batch_size', 1, 'number of frames per detector call, only useful for video files')
+flags.DEFINE_list('streams', None, 'track several videos or webcams with one loaded model, overrides --video')
+flags.DEFINE_boolean('headless', False, 'skip all drawing and GUI calls, implies --dont_show and ignores --output')
+flags.DEFINE_string('tracks_output', None, 'path to write the track records of every frame to')
+flags.DEFINE_string('tracks_format', 'jsonl', 'format of --tracks_output (mot, jsonl)')
+flags.DEFINE_string('cache_dir', None, 'directory to store detections and features in, later runs on the same video only run the tracker')
+flags.DEFINE_boolean('adaptive_detection', False, 'only run the detector on some frames and propagate tracks with the Kalman filter in between')
+flags.DEFINE_integer('min_detect_interval', 1, 'minimum number of frames between two detector runs with --adaptive_detection')
+flags.DEFINE_integer('max_detect_interval', 5, 'maximum number of frames between two detector runs with --adaptive_detection')
+flags.DEFINE_float('max_track_uncertainty', 0.15, 'run the detector when the position std of a track, relative to its height, exceeds this')
+flags.DEFINE_string('tiles', None, 'detect on overlapping --size x --size windows of the frame at native scale, <cols>x<rows> of them (e.g. 6x3) or auto for the fewest that cover the frame')
+flags.DEFINE_integer('tile_overlap', 64, 'minimum number of pixels neighbouring tiles overlap with --tiles')
+flags.DEFINE_list('skip_tiles', [], 'row-major indices of tiles that are never detected on with --tiles, e.g. tiles that only show the stands')
+flags.DEFINE_string('metrics_output', None, 'path to append a JSON line with stage latencies, queue depths and track counts to every --metrics_interval seconds')
+flags.DEFINE_float('metrics_interval', 10., 'seconds between two lines of --metrics_output')
+flags.DEFINE_integer('metrics_port', 0, 'if > 0, serve the metrics in Prometheus text format on http://<host>:<port>/metrics')
+flags.DEFINE_string('roi', None, 'region of interest as JSON list of [x, y] polygon points or mask image, the detector only sees its bounding box and detections and tracks outside it are dropped')
+flags.DEFINE_float('min_box_height', 8., 'detections lower than this many pixels are dropped')
+flags.DEFINE_float('max_box_height', 250., 'detections higher than this many pixels are dropped')
+flags.DEFINE_float('min_box_top', 60., 'detections whose top edge is above this row are dropped (the stands), ignored with --roi')
+flags.DEFINE_float('min_box_right', 5., 'detections whose right edge is left of this column are dropped, ignored with --roi')
+
+
+def load_detector():
+    """Load the YOLO model selected by the flags and return a function that maps
+    a preprocessed image batch to raw `(boxes, pred_conf)` predictions."""
     input_size = FLAGS.size
-    video_path = FLAGS.video
 
     # load tflite model if flag is set
     if FLAGS.framework == 'tflite':
@@ -77,65 +103,177 @@ def main(_argv):
         output_details = interpreter.get_output_details()
         print(input_details)
         print(output_details)
+
+        def detector(image_data):
+            # the interpreter is allocated for a fixed batch size, resize it
+            # when a batch of a different size comes in
+            if input_details[0]['shape'][0] != len(image_data):
+                interpreter.resize_tensor_input(input_details[0]['index'], image_data.shape)
+                interpreter.allocate_tensors()
+                input_details[:] = interpreter.get_input_details()
+                output_details[:] = interpreter.get_output_details()
+            interpreter.set_tensor(input_details[0]['index'], image_data)
+            interpreter.invoke()
+            pred = [interpreter.get_tensor(output_details[i]['index']) for i in range(len(output_details))]
+            # run detections using yolov3 if flag is set
+            if FLAGS.model == 'yolov3' and FLAGS.tiny == True:
+                return filter_boxes(pred[1], pred[0], score_threshold=0.25,
+                                    input_shape=tf.constant([input_size, input_size]))
+            return filter_boxes(pred[0], pred[1], score_threshold=0.25,
+                                input_shape=tf.constant([input_size, input_size]))
     # otherwise load standard tensorflow saved model
     else:
         saved_model_loaded = tf.saved_model.load(FLAGS.weights, tags=[tag_constants.SERVING])
         infer = saved_model_loaded.signatures['serving_default']
 
-    # begin video capture
+        def detector(image_data):
+            batch_data = tf.constant(image_data)
+            pred_bbox = infer(batch_data)
+            for key, value in pred_bbox.items():
+                boxes = value[:, :, 0:4]
+                pred_conf = value[:, :, 4:]
+            return boxes, pred_conf
+
+    return detector
+
+
+def open_capture(video_path):
     try:
-        vid = cv2.VideoCapture(int(video_path))
+        return cv2.VideoCapture(int(video_path))
     except:
-        vid = cv2.VideoCapture(video_path)
-
-    out = None
+        return cv2.VideoCapture(video_path)
 
-    # get video ready to save locally if flag is set
-    if FLAGS.output:
-        # by default VideoCapture returns float instead of int
-        width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(vid.get(cv2.CAP_PROP_FPS))
-        codec = cv2.VideoWriter_fourcc(*FLAGS.output_format)
-        out = cv2.VideoWriter(FLAGS.output, codec, fps, (width, height))
 
+def read_frames(vid, metrics, stream=0):
+    """Decode stage: yield every frame of the capture as an RGB image."""
     frame_num = 0
-    # while video is running
     while True:
+        start = time.perf_counter()
         return_value, frame = vid.read()
-        if return_value:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(frame)
-        else:
+        if not return_value:
             print('Video has ended or failed, try a different video format!')
-            break
-        frame_num +=1
-        print('Frame #: ', frame_num)
-        frame_size = frame.shape[:2]
-        image_data = cv2.resize(frame, (input_size, input_size))
-        image_data = image_data / 255.
-        image_data = image_data[np.newaxis, ...].astype(np.float32)
-        start_time = time.time()
-
-        # run detections on tflite if flag is set
-        if FLAGS.framework == 'tflite':
-            interpreter.set_tensor(input_details[0]['index'], image_data)
-            interpreter.invoke()
-            pred = [interpreter.get_tensor(output_details[i]['index']) for i in range(len(output_details))]
-            # run detections using yolov3 if flag is set
-            if FLAGS.model == 'yolov3' and FLAGS.tiny == True:
-                boxes, pred_conf = filter_boxes(pred[1], pred[0], score_threshold=0.25,
-                                                input_shape=tf.constant([input_size, input_size]))
-            else:
-                boxes, pred_conf = filter_boxes(pred[0], pred[1], score_threshold=0.25,
-                                                input_shape=tf.constant([input_size, input_size]))
+            return
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        metrics.observe('decode', time.perf_counter() - start)
+        frame_num += 1
+        yield {'stream': stream, 'frame_num': frame_num, 'frame': frame}
+
+
+def stream_path(path, stream, num_streams):
+    """With several streams, stream i is written to <path>_i.<ext>."""
+    if num_streams == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return '{}_{}{}'.format(root, stream, ext)
+
+
+def replay_frames(cache, metrics, stream=0, vid=None):
+    """Decode stage when replaying from a detection cache. Frames are only
+    decoded if a capture is given, otherwise packets carry no image."""
+    frames = read_frames(vid, metrics, stream) if vid is not None else None
+    for i in range(len(cache)):
+        if frames is not None:
+            packet = next(frames, None)
+            if packet is None:
+                return
         else:
-            batch_data = tf.constant(image_data)
-            pred_bbox = infer(batch_data)
-            for key, value in pred_bbox.items():
-                boxes = value[:, :, 0:4]
-                pred_conf = value[:, :, 4:]
-
+            packet = {'stream': stream, 'frame_num': i + 1}
+        bboxes, scores, classes, features, fractions = cache.frame(i)
+        packet['bboxes'] = np.array(bboxes)
+        packet['scores'] = np.array(scores)
+        packet['classes'] = np.array(classes)
+        packet['features'] = np.array(features)
+        packet['color_fractions'] = np.array(fractions)
+        yield packet
+
+
+def interleave_streams(readers):
+    """Take one frame of every stream in turn until all streams have ended, so
+    frames of the same stream stay in order."""
+    readers = list(readers)
+    while readers:
+        for reader in list(readers):
+            packet = next(reader, None)
+            if packet is None:
+                readers.remove(reader)
+            else:
+                yield packet
+
+
+def batch_frames(packets, batch_size):
+    """Group consecutive frames into lists of `batch_size` frames. The last
+    batch holds whatever is left when the video ends."""
+    batch = []
+    for packet in packets:
+        batch.append(packet)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def detected(batch):
+    """The packets of a batch the detector runs on, with --adaptive_detection
+    some frames are only used to propagate the tracks."""
+    return [packet for packet in batch if packet.get('detect', True)]
+
+
+@functools.lru_cache(maxsize=None)
+def detector_regions(height, width, input_size, tiles=None, roi=None):
+    """Returns the regions `(xmin, ymin, xmax, ymax)` of a frame the detector
+    runs on: the bounding box of the region of interest (or the whole frame),
+    covered by `input_size` tiles laid out by `tiles = (grid, overlap, skip)`
+    if given. Tiles without a single pixel of the region of interest are
+    dropped."""
+    x0, y0, x1, y1 = roi.bounds(height, width) if roi is not None else (0, 0, width, height)
+    if tiles is None:
+        return np.array([[x0, y0, x1, y1]], dtype=np.int32)
+    grid, overlap, skip = tiles
+    regions = tile_layout((x0, y0, x1, y1), (height, width), input_size, overlap, grid, skip)
+    if roi is not None:
+        regions = regions[roi.intersects(regions)]
+    return regions
+
+
+def preprocess_frames(batch, input_size, metrics, tiles=None, roi=None):
+    """Preprocess stage: resize the frames to the detector input. With a
+    region of interest only its bounding box is passed to the detector. With
+    `tiles` that area is covered by tiles of the detector input size instead,
+    so small objects keep their resolution. `image_data` holds one
+    detector input per region (or a single one for the whole frame)."""
+    with metrics.time('preprocess'):
+        for packet in detected(batch):
+            if tiles is not None or roi is not None:
+                height, width = packet['frame'].shape[:2]
+                packet['regions'] = detector_regions(height, width, input_size, tiles, roi)
+                if tiles is not None:
+                    packet['image_data'] = crop_tiles(packet['frame'], packet['regions'], input_size)
+                    continue
+                x0, y0, x1, y1 = packet['regions'][0]
+                image_data = cv2.resize(packet['frame'][y0:y1, x0:x1], (input_size, input_size))
+                packet['image_data'] = (image_data / 255.).astype(np.float32)[np.newaxis, ...]
+                continue
+            image_data = cv2.resize(packet['frame'], (input_size, input_size))
+            image_data = image_data / 255.
+            packet['image_data'] = image_data.astype(np.float32)[np.newaxis, ...]
+    return batch
+
+
+def detect_objects(batch, detector, detection_filter, metrics):
+    """Detect stage: run YOLO and combined NMS on all frames (and tiles) of
+    the batch at once, then split the output per frame, merge the detections
+    of the tiles of a frame and drop the unwanted ones with `detection_filter`."""
+    packets = detected(batch)
+    if not packets:
+        return batch
+    image_data = [packet.pop('image_data') for packet in packets]
+    sizes = [len(data) for data in image_data]
+    image_data = np.concatenate(image_data)
+    with metrics.time('inference'):
+        boxes, pred_conf = detector(image_data)
+
+    with metrics.time('nms'):
         boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
             boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
             scores=tf.reshape(
@@ -145,193 +283,465 @@ def main(_argv):
             iou_threshold=FLAGS.iou,
             score_threshold=FLAGS.score
         )
-
-        # convert data to numpy arrays and slice out unused elements
-        num_objects = valid_detections.numpy()[0]
-        bboxes = boxes.numpy()[0]
-        bboxes = bboxes[0:int(num_objects)]
-        scores = scores.numpy()[0]
-        scores = scores[0:int(num_objects)]
-        classes = classes.numpy()[0]
-        classes = classes[0:int(num_objects)]
-
-        # format bounding boxes from normalized ymin, xmin, ymax, xmax ---> xmin, ymin, width, height
-        original_h, original_w, _ = frame.shape
-        bboxes = utils.format_boxes(bboxes, original_h, original_w)
-
-        # print(bboxes[0])
-        # print()
-        # print(bboxes[2])
-        # print()
-
-        # store all predictions in one parameter for simplicity when calling functions
-        pred_bbox = [bboxes, scores, classes, num_objects]
-
-        # read in all class names from config
-        class_names = utils.read_class_names(cfg.YOLO.CLASSES)
-
-        # by default allow all classes in .names file
-        #allowed_classes = list(class_names.values())
-        
-        # custom allowed classes (uncomment line below to customize tracker for only people)
-        #allowed_classes = ['person', 'sports ball']
-        allowed_classes = ['person']
-
-        # loop through objects and use class index to get class name, allow only classes in allowed_classes list
-        names = []
-        deleted_indx = []
-        for i in range(num_objects):
-            class_indx = int(classes[i])
-            class_name = class_names[class_indx]
-            # Zie comment achter volgende regel!
-            #print(bboxes[i][1] - bboxes[i][3])  
-            #print(bboxes[i][0] - bboxes[i][2]) 
-            #print()
-            if bboxes[i][2] < 0.0:
-                print("JASDAS")
-                print()
-                print()
-            #if (class_name not in allowed_classes) or (bboxes[i][3] < 60.0) or (bboxes[i][1] < 5.0) or (-12 < (bboxes[i][1] - bboxes[i][3]) < 12.0) or (((bboxes[i][1] - bboxes[i][3]) > 250.0) or (bboxes[i][1] - bboxes[i][3]) < -250.0): # or-statements added by Bas, last or-statement to remove weird very large bboxes, the one before to remove really small bboxes. Otherwise the small bboxes implode and turn into really big ones on random locations.
-#            if (class_name not in allowed_classes) or (-12 < (bboxes[i][1] - bboxes[i][3]) < 12.0) or (((bboxes[i][1] - bboxes[i][3]) > 250.0) or (bboxes[i][1] - bboxes[i][3]) < -250.0): # or-statements added by Bas, last or-statement to remove weird very large bboxes, the one before to remove really small bboxes. Otherwise the small bboxes implode and turn into really big ones on random locations.
-            if (class_name not in allowed_classes) or (bboxes[i][1] < 60.0) or ((bboxes[i][0] + bboxes[i][3]) < 5.0) or (bboxes[i][3] < 8.0) or (bboxes[i][3] > 250.0): # or-statements added by Bas, last or-statement to remove weird very large bboxes, the one before to remove really small bboxes. Otherwise the small bboxes implode and turn into really big ones on random locations.
-
-                deleted_indx.append(i)
-
+        valid_detections = valid_detections.numpy()
+        boxes, scores, classes = boxes.numpy(), scores.numpy(), classes.numpy()
+
+    with metrics.time('class_filter'):
+        start = 0
+        for packet, size in zip(packets, sizes):
+            # slice out unused elements
+            rows = range(start, start + size)
+            start += size
+            frame_boxes = [boxes[i][0:int(valid_detections[i])] for i in rows]
+            frame_scores = [scores[i][0:int(valid_detections[i])] for i in rows]
+            frame_classes = [classes[i][0:int(valid_detections[i])] for i in rows]
+            if 'regions' in packet:
+                # back to frame coordinates, objects in the overlap of two tiles are found twice
+                frame_boxes, frame_scores, frame_classes = merge_tile_detections(
+                    packet.pop('regions'), frame_boxes, frame_scores, frame_classes,
+                    packet['frame'].shape, FLAGS.iou)
             else:
-                names.append(class_name)
-        names = np.array(names)
-        count = len(names)
-        if FLAGS.count:
-            cv2.putText(frame, "Objects being tracked: {}".format(count), (5, 35), cv2.FONT_HERSHEY_COMPLEX_SMALL, 2, (0, 255, 0), 2)
-            print("Objects being tracked: {}".format(count))
-
-        # delete detections that are not in allowed_classes
-        bboxes = np.delete(bboxes, deleted_indx, axis=0)
-        scores = np.delete(scores, deleted_indx, axis=0)
-
-        
-        # encode yolo detections and feed to tracker
-        #features = encoder(frame, bboxes)
-        #detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in zip(bboxes, scores, names, features)]
-
-        #initialize color map
-        #cmap = plt.get_cmap('tab20b')
-        #colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
-        
-        # detect jersey color
-        patches = [gdet.extract_image_patch(frame, box, [box[3], box[2]]) for box in bboxes]
-        colors = [find_color(patch, FLAGS.jersey_colors, threshold = FLAGS.color_threshold)
-                  for patch in patches]
-
-        # encode yolo detections and feed to tracker
-        features = encoder(frame, bboxes)
-        
-        if jersey_colors:
-            detections = [Detection(bbox, score, class_name, feature, color) for bbox, score, class_name, feature, color
-                          in zip(bboxes, scores, names, features, colors)]
+                frame_boxes, frame_scores, frame_classes = frame_boxes[0], frame_scores[0], frame_classes[0]
+            # to pixel boxes (xmin, ymin, width, height) of the allowed classes and sizes
+            packet['bboxes'], packet['scores'], packet['classes'] = detection_filter(
+                frame_boxes, frame_scores, frame_classes, packet['frame'].shape)
+    return batch
+
+
+def encode_detections(batch, encoder, extract_patches, jersey_colors, metrics, lazy=False):
+    """Encode stage: detect jersey colors and compute ReID features. The ReID
+    patches of all frames in the batch are extracted into one buffer and go
+    through the encoder together. Detections without a valid patch (empty or
+    outside the frame) are dropped. With `lazy` the features are left to the
+    tracker, see `associate_detections`."""
+    packets = detected(batch)
+    if not packets:
+        return batch
+    with metrics.time('reid'):
+        if lazy:
+            valid = [gdet.patch_regions(packet['bboxes'], encoder.image_shape[:2], packet['frame'].shape)[1]
+                     for packet in packets]
+            all_features = [None] * len(packets)
         else:
-            detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature
-                          in zip(bboxes, scores, names, features)]
+            image_patches, valid = extract_patches([packet['frame'] for packet in packets],
+                                                   [packet['bboxes'] for packet in packets])
+            all_features = encoder(image_patches)
+            all_features = np.split(all_features, np.cumsum([v.sum() for v in valid])[:-1])
+
+    with metrics.time('color'):
+        for packet, features, keep in zip(packets, all_features, valid):
+            frame = packet['frame']
+            for key in ('bboxes', 'scores', 'classes'):
+                packet[key] = packet[key][keep]
+            packet['features'] = features
+
+            # measure jersey colors, the color threshold is only applied when the
+            # detections are created so it can be tuned from cached fractions
+            patches = [gdet.extract_image_patch(frame, box, [box[3], box[2]]) for box in packet['bboxes']]
+            packet['color_fractions'] = np.array(
+                [color_fractions(patch, jersey_colors) for patch in patches]).reshape(-1, len(jersey_colors))
+    return batch
+
+
+def record_detections(batch, cache_writers):
+    for packet in batch:
+        cache_writers[packet['stream']].append(
+            packet['bboxes'], packet['scores'], packet['classes'],
+            packet['features'], packet['color_fractions'])
+    return batch
+
+
+def create_detections(packet, class_names, jersey_colors):
+    bboxes, scores, classes = packet.pop('bboxes'), packet.pop('scores'), packet.pop('classes')
+    features, fractions = packet.pop('features'), packet.pop('color_fractions')
+
+    if jersey_colors:
+        color_ids = pick_colors(fractions, jersey_colors, threshold = FLAGS.color_threshold)
+        return DetectionBatch(bboxes, scores, classes, features, color_ids,
+                              class_names, list(jersey_colors) + ['Unidentified'])
+    else:
+        return DetectionBatch(bboxes, scores, classes, features, class_names=class_names)
+
+
+def associate_detections(batch, trackers, class_names, jersey_colors, nms_max_overlap, metrics, schedulers=None,
+                         encode_features=None):
+    """Associate stage: update the tracker of each frame's stream and take a
+    snapshot of its tracks.
+
+    The trackers are only ever touched from this stage and frames are fed to
+    them in order, so track ids do not depend on whether the pipeline runs
+    threaded or batched.
+
+    Frames encoded with `lazy` have no features yet. The tracker asks for
+    the features of the detections it needs once per frame, they are
+    computed by `encode_features(frame, boxes)`.
+    """
+    for packet in batch:
+        tracker = trackers[packet['stream']]
+
+        # frames skipped by the detection scheduler only propagate the tracks
+        if not packet.get('detect', True):
+            tracker.predict(detect=False)
+            packet['tracks'] = snapshot_tracks(tracker)
+            packet['count'] = sum(1 for track in packet['tracks'] if track[4] == 'confirmed')
+            update_track_gauges(metrics, packet['stream'], tracker, packet['tracks'])
+            continue
+
+        detections = create_detections(packet, class_names, jersey_colors)
 
-            
         # run non-maxima supression
-        boxs = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
-        classes = np.array([d.class_name for d in detections])
-        indices = preprocessing.non_max_suppression(boxs, classes, nms_max_overlap, scores)
-        detections = [detections[i] for i in indices]
-  
+        indices = preprocessing.non_max_suppression(detections, detections.class_ids, nms_max_overlap)
+        detections = detections[indices]
+
+        encoder = None
+        if encode_features is not None and detections.features is None:
+            def encoder(indices, frame=packet['frame'], boxes=detections.tlwh):
+                with metrics.time('reid'):
+                    return encode_features(frame, boxes[indices])
+
         # Call the tracker
         tracker.predict()
-        tracker.update(detections) # HIERO DE GRIJZE DETECTION
-
-        # update tracks
-        for track in tracker.tracks:
-            
-            # you can of course delete these first two if-statements to improve FPS
-            if not track.is_confirmed():
-                ###
-                bbox = track.to_tlbr()
-                color = [255, 255, 100]
-                class_name = "tentative"
-
-                cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-                cv2.rectangle(frame, (int(bbox[0]), int(bbox[1] - 30)), (int(bbox[0]) + (len(class_name) + len(str(track.track_id))) * 17, int(bbox[1])), color,-1)
-                cv2.putText(frame, class_name + "-" + str(track.track_id), (int(bbox[0]), int(bbox[1] - 10)), 0, 0.75,(255, 255, 255), 2)
-                ###
-                continue 
-
-            elif track.time_since_update > 1 and not track.is_deleted():
-                ###
-                bbox = track.to_tlbr()
-                color = [105, 105, 105]
-                class_name = "pred. track"
-
-                cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-                cv2.rectangle(frame, (int(bbox[0]), int(bbox[1] - 30)), (int(bbox[0]) + (len(class_name) + len(str(track.track_id))) * 17, int(bbox[1])), color,-1)
-                cv2.putText(frame, class_name + "-" + str(track.track_id), (int(bbox[0]), int(bbox[1] - 10)), 0, 0.75,(255, 255, 255), 2)
-                ###
-                continue 
-
-            # TESTJE
-            # elif (track.time_since_update == 1) and not track.is_deleted():
-            #     bbox = track.to_tlbr()
-            #     color = [35, 35, 35]
-            #     class_name = "TEST track"
-
-            #     cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-            #     cv2.rectangle(frame, (int(bbox[0]), int(bbox[1] - 30)), (int(bbox[0]) + (len(class_name) + len(str(track.track_id))) * 17, int(bbox[1])), color,-1)
-            #     cv2.putText(frame, class_name + "-" + str(track.track_id), (int(bbox[0]), int(bbox[1] - 10)), 0, 0.75,(255, 255, 255), 2)
-            #     ###
-            #     continue 
-
-
-            bbox = track.to_tlbr()
-            class_name = track.get_class()
-            jersey_color = track.get_color()
-            
-            if jersey_color == jersey_colors[0]:
-                color = [0, 0, 255]
-                team_name = 'Team 1'
-
-            elif jersey_color == jersey_colors[1]:
-
-                color = [255, 0, 0]
-                team_name = 'Team 2'
-
-            elif len(jersey_colors) > 2 and jersey_color == jersey_colors[2]:
-                color = [255, 165, 0]
-                team_name = 'referee'
+        tracker.update(detections, encoder)
+        if schedulers is not None:
+            schedulers[packet['stream']].observe(tracker.tracks)
+
+        packet['count'] = len(detections)
+        packet['tracks'] = snapshot_tracks(tracker)
+        update_track_gauges(metrics, packet['stream'], tracker, packet['tracks'])
+    return batch
+
+
+def update_track_gauges(metrics, stream, tracker, tracks):
+    for state in ('tentative', 'predicted', 'confirmed'):
+        metrics.set_gauge('tracks', sum(1 for track in tracks if track[4] == state),
+                          stream=stream, state=state)
+    for key, value in tracker.feature_stats.items():
+        metrics.set_gauge('reid_' + key, value, stream=stream)
+    if tracker.feature_throttle is not None:
+        metrics.set_gauge('reid_reuse_hits', tracker.feature_throttle.hits, stream=stream)
+        metrics.set_gauge('reid_reuse_misses', tracker.feature_throttle.misses, stream=stream)
+    stats = tracker.metric.gallery_stats()
+    policy = stats.pop('policy')
+    for key, value in stats.items():
+        metrics.set_gauge('gallery_' + key, value, stream=stream, policy=policy)
+
+
+def snapshot_tracks(tracker):
+    """Copy what is needed to draw or report the current tracks, so the tracker
+    can move on to the next frame while this one is rendered.
+
+    Returns a list of `(track_id, tlbr, class_name, jersey_color, state)` tuples
+    where state is one of 'tentative', 'predicted' or 'confirmed'.
+    """
+    snapshot = []
+    for track in tracker.tracks:
+        if not track.is_confirmed():
+            state = 'tentative'
+        elif track.time_since_update > 1 and not track.is_deleted():
+            state = 'predicted'
+        else:
+            state = 'confirmed'
+        snapshot.append((track.track_id, track.to_tlbr(), track.get_class(),
+                         track.get_color(), state))
+    return snapshot
+
+
+def draw_tracks(frame, tracks, jersey_colors):
+    for track_id, bbox, class_name, jersey_color, state in tracks:
+
+        # you can of course delete these first two if-statements to improve FPS
+        if state == 'tentative':
+            color = [255, 255, 100]
+            class_name = "tentative"
+
+        elif state == 'predicted':
+            color = [105, 105, 105]
+            class_name = "pred. track"
+
+        elif jersey_color == jersey_colors[0]:
+            color = [0, 0, 255]
+            team_name = 'Team 1'
+
+        elif jersey_color == jersey_colors[1]:
+            color = [255, 0, 0]
+            team_name = 'Team 2'
+
+        elif len(jersey_colors) > 2 and jersey_color == jersey_colors[2]:
+            color = [255, 165, 0]
+            team_name = 'referee'
+
+        else:
+            color = [25, 25, 25]
+            team_name = 'Other'
 
-            else:
-                color = [25, 25, 25]
-                team_name = 'Other'
-            
         # draw bbox on screen
-            #color = colors[int(track.track_id) % len(colors)]
-            #color = [i * 255 for i in color]
-            cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-            cv2.rectangle(frame, (int(bbox[0]), int(bbox[1]-30)), (int(bbox[0])+(len(class_name)+len(str(track.track_id)))*17, int(bbox[1])), color, -1)
-            cv2.putText(frame, class_name + "-" + str(track.track_id),(int(bbox[0]), int(bbox[1]-10)),0, 0.75, (255,255,255),2)
-            
-        # if enable info flag then print details about each track
-            if FLAGS.info:
-                print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(str(track.track_id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
+        cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
+        cv2.rectangle(frame, (int(bbox[0]), int(bbox[1]-30)), (int(bbox[0])+(len(class_name)+len(str(track_id)))*17, int(bbox[1])), color, -1)
+        cv2.putText(frame, class_name + "-" + str(track_id),(int(bbox[0]), int(bbox[1]-10)),0, 0.75, (255,255,255),2)
+
+
+def main(_argv):
+    # Definition of the parameters
+    max_cosine_distance = FLAGS.cosine
+    nn_budget = FLAGS.nn_budget or None
+    nms_max_overlap = FLAGS.nms_overlap
+    jersey_colors = FLAGS.jersey_colors
+    
+    # every stream gets its own tracker, the models are shared by all streams
+    video_paths = FLAGS.streams if FLAGS.streams else [FLAGS.video]
+    num_streams = len(video_paths)
 
-        # calculate frames per second of running detections
-        fps = 1.0 / (time.time() - start_time)
+    # stage latencies, queue depths and track counts
+    metrics = Metrics()
+    metrics_writer = JsonMetricsWriter(metrics, FLAGS.metrics_output, FLAGS.metrics_interval) if FLAGS.metrics_output else None
+    metrics_server = serve_prometheus(metrics, FLAGS.metrics_port) if FLAGS.metrics_port > 0 else None
+
+    # the playing area, tracks and detections outside of it are dropped
+    roi = RegionOfInterest.from_file(FLAGS.roi) if FLAGS.roi else None
+
+    # initialize deep sort
+    model_filename = FLAGS.reid_model
+    trackers = []
+    for _ in video_paths:
+        # calculate cosine distance metric
+        metric = nn_matching.NearestNeighborDistanceMetric(
+            "cosine", max_cosine_distance, nn_budget, FLAGS.gallery_policy, FLAGS.gallery_max_samples)
+        # initialize tracker
+        feature_throttle = FeatureThrottle(FLAGS.reuse_min_iou, FLAGS.reuse_max_age) if FLAGS.reuse_reid else None
+        trackers.append(Tracker(metric, max_age=FLAGS.max_age, n_init=FLAGS.n_init, roi=roi, metrics=metrics,
+                                lazy_features=FLAGS.lazy_reid, feature_throttle=feature_throttle))
+
+    input_size = FLAGS.size
+
+    # read in all class names from config
+    class_names = utils.read_class_names(cfg.YOLO.CLASSES)
+
+    # by default allow all classes in .names file
+    #allowed_classes = list(class_names.values())
+    
+    # custom allowed classes (uncomment line below to customize tracker for only people)
+    #allowed_classes = ['person', 'sports ball']
+    allowed_classes = ['person']
+
+    # the stands and the left border rules are replaced by the region of interest
+    detection_filter = DetectionFilter(
+        class_names, allowed_classes, FLAGS.min_box_height, FLAGS.max_box_height,
+        FLAGS.min_box_top if roi is None else None, FLAGS.min_box_right if roi is None else None, roi)
+
+    tiles = None
+    if FLAGS.tiles:
+        tiles = (parse_tiles(FLAGS.tiles), FLAGS.tile_overlap, tuple(int(i) for i in FLAGS.skip_tiles))
+
+    # frames only need to be drawn on if they are shown or saved
+    headless = FLAGS.headless or (FLAGS.dont_show and not FLAGS.output)
+
+    # the cache key covers everything that changes the detections and features,
+    # but none of the tracker parameters
+    cache_paths = []
+    if FLAGS.cache_dir:
+        # the key hashes the video content, a camera or stream has none
+        live = [video_path for video_path in video_paths if not os.path.isfile(video_path)]
+        if live:
+            raise ValueError('--cache_dir needs video files, %s is a camera, a stream or missing' % ', '.join(live))
+        params = dict(framework=FLAGS.framework, weights=path_fingerprint(FLAGS.weights),
+                      model=FLAGS.model, tiny=FLAGS.tiny, size=input_size, score=FLAGS.score,
+                      iou=FLAGS.iou, allowed_classes=allowed_classes, jersey_colors=jersey_colors,
+                      box_limits=(FLAGS.min_box_height, FLAGS.max_box_height, FLAGS.min_box_top, FLAGS.min_box_right),
+                      encoder=path_fingerprint(model_filename), reid_backend=FLAGS.reid_backend, tiles=tiles,
+                      roi=file_hash(FLAGS.roi) if FLAGS.roi else None)
+        cache_paths = [os.path.join(FLAGS.cache_dir, cache_key(video_path, **params))
+                       for video_path in video_paths]
+    replay = bool(cache_paths) and all(DetectionCache.exists(path) for path in cache_paths)
+
+    # begin video capture, when replaying without output the video is not decoded
+    vids = [open_capture(video_path) for video_path in video_paths] if not (replay and headless) else [None] * num_streams
+
+    outs = [None] * num_streams
+
+    # get video ready to save locally if flag is set
+    if FLAGS.output and not headless:
+        for stream, vid in enumerate(vids):
+            # by default VideoCapture returns float instead of int
+            width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = int(vid.get(cv2.CAP_PROP_FPS))
+            codec = cv2.VideoWriter_fourcc(*FLAGS.output_format)
+            outs[stream] = cv2.VideoWriter(stream_path(FLAGS.output, stream, num_streams), codec, fps, (width, height))
+
+    track_writers = [None] * num_streams
+    if FLAGS.tracks_output:
+        track_writers = [open_track_writer(stream_path(FLAGS.tracks_output, stream, num_streams), FLAGS.tracks_format)
+                         for stream in range(num_streams)]
+
+    schedulers = None
+    if FLAGS.adaptive_detection:
+        # the schedule depends on the tracker state of the previous frame
+        if FLAGS.pipeline:
+            raise ValueError('--adaptive_detection can not be combined with --pipeline')
+        # all frames of a batch are scheduled before the first one is tracked
+        if FLAGS.batch_size > 1:
+            raise ValueError('--adaptive_detection can not be combined with --batch_size > 1')
+        schedulers = [DetectionScheduler(tracker.kf, FLAGS.min_detect_interval, FLAGS.max_detect_interval,
+                                         FLAGS.max_track_uncertainty) for tracker in trackers]
+        # skipped frames have no detections, so a cache can be replayed but not recorded
+        if not replay:
+            cache_paths = []
+
+    # the features are computed during association, so the tracker can skip
+    # or reuse some of them
+    lazy_reid = FLAGS.lazy_reid or FLAGS.reuse_reid
+    # a cache holds the features of all detections, lazy frames only some
+    if lazy_reid and not replay:
+        cache_paths = []
+
+    # set below when the features are computed lazily during association
+    encode_features = None
+    associate = ('associate', lambda batch: associate_detections(batch, trackers, class_names, jersey_colors, nms_max_overlap, metrics, schedulers,
+                                                                 encode_features))
+    if replay:
+        print('Replaying detections from {}'.format(', '.join(cache_paths)))
+        stages = [associate]
+        frames = interleave_streams(replay_frames(DetectionCache(path), metrics, stream, vid)
+                                    for stream, (path, vid) in enumerate(zip(cache_paths, vids)))
+    else:
+        # load configuration for object detector
+        config = ConfigProto()
+        config.gpu_options.allow_growth = True
+        session = InteractiveSession(config=config)
+        STRIDES, ANCHORS, NUM_CLASS, XYSCALE = utils.load_config(FLAGS)
+
+        detector = load_detector()
+        encoder = gdet.ImageEncoder(model_filename, backend=FLAGS.reid_backend)
+        extract_patches = gdet.PatchExtractor(encoder.image_shape)
+        if lazy_reid:
+            def encode_features(frame, boxes):
+                image_patches, _ = extract_patches([frame], [boxes])
+                return encoder(image_patches)
+
+        cache_writers = [DetectionCacheWriter(path, encoder.feature_dim, len(jersey_colors))
+                         for path in cache_paths]
+
+        # every stage works on a batch of consecutive frames, with --batch_size 1
+        # (the default) that is a single frame of every stream
+        stages = [
+            ('preprocess', lambda batch: preprocess_frames(batch, input_size, metrics, tiles, roi)),
+            ('detect', lambda batch: detect_objects(batch, detector, detection_filter, metrics)),
+            ('encode', lambda batch: encode_detections(batch, encoder, extract_patches, jersey_colors, metrics, lazy_reid)),
+            associate,
+        ]
+        if cache_writers:
+            stages.insert(3, ('record', lambda batch: record_detections(batch, cache_writers)))
+        frames = interleave_streams(read_frames(vid, metrics, stream) for stream, vid in enumerate(vids))
+    batches = batch_frames(frames, FLAGS.batch_size * num_streams)
+
+    if FLAGS.pipeline:
+        # every stage runs on its own thread, throughput is bound by the slowest one
+        pipeline = StagedPipeline(batches, stages, FLAGS.queue_size)
+    else:
+        def run_stages():
+            # the frame rate includes decoding the batch, but not rendering it
+            start_time = time.time()
+            for batch in batches:
+                if schedulers is not None:
+                    for packet in batch:
+                        stream = packet['stream']
+                        packet['detect'] = schedulers[stream].should_detect(trackers[stream].tracks)
+                for _, stage in stages:
+                    batch = stage(batch)
+                fps = len(batch) / (time.time() - start_time)
+                for packet in batch:
+                    packet['fps'] = fps
+                yield batch
+                start_time = time.time()
+        pipeline = run_stages()
+    packets = (packet for batch in pipeline for packet in batch)
+
+    start_time = time.time()
+    num_frames = 0
+    stopped = False
+    for packet in packets:
+        frame = packet.get('frame')
+        stream = packet['stream']
+        num_frames += 1
+        if num_streams > 1:
+            print('Stream #: ', stream)
+        print('Frame #: ', packet['frame_num'])
+        metrics.set_gauge('frames', packet['frame_num'], stream=stream)
+        if FLAGS.pipeline:
+            for name, depth in pipeline.queue_depths().items():
+                metrics.set_gauge('queue_depth', depth, queue=name)
+        if metrics_writer is not None:
+            metrics_writer.maybe_write()
+
+        if track_writers[stream] is not None:
+            with metrics.time('write'):
+                track_writers[stream].write(packet['frame_num'], packet['tracks'])
+
+        if FLAGS.count:
+            if not headless:
+                cv2.putText(frame, "Objects being tracked: {}".format(packet['count']), (5, 35), cv2.FONT_HERSHEY_COMPLEX_SMALL, 2, (0, 255, 0), 2)
+            print("Objects being tracked: {}".format(packet['count']))
+
+        if not headless:
+            with metrics.time('render'):
+                draw_tracks(frame, packet['tracks'], jersey_colors)
+
+        # if enable info flag then print details about each track
+        if FLAGS.info:
+            for track_id, bbox, class_name, _, state in packet['tracks']:
+                if state == 'confirmed':
+                    print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(str(track_id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
+
+        # calculate frames per second of running detections, in pipeline mode
+        # this is the average rate at which frames leave the last stage
+        if FLAGS.pipeline:
+            fps = num_frames / (time.time() - start_time)
+        else:
+            fps = packet['fps']
         print("FPS: %.2f" % fps)
-        result = np.asarray(frame)
-        result = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        
-        if not FLAGS.dont_show:
-            cv2.imshow("Output Video", result)
-        
+        if headless:
+            continue
+
+        with metrics.time('render'):
+            result = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+            if not FLAGS.dont_show:
+                cv2.imshow("Output Video" if num_streams == 1 else "Output Video {}".format(stream), result)
+
         # if output flag is set, save video file
         if FLAGS.output:
-            out.write(result)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-    cv2.destroyAllWindows()
+            with metrics.time('write'):
+                outs[stream].write(result)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            stopped = True
+            break
+    if FLAGS.pipeline:
+        pipeline.close()
+    # only a cache of the complete video is kept
+    if not replay:
+        for cache_writer in cache_writers:
+            if stopped:
+                cache_writer.discard()
+            else:
+                cache_writer.close()
+    if schedulers is not None:
+        for stream, scheduler in enumerate(schedulers):
+            print('Stream {}: detector ran on {} of {} frames'.format(
+                stream, scheduler.num_detected, scheduler.num_detected + scheduler.num_skipped))
+    for stream, tracker in enumerate(trackers):
+        if tracker.feature_throttle is not None:
+            throttle = tracker.feature_throttle
+            print('Stream {}: reused the ReID feature of a track for {} of {} detections'.format(
+                stream, throttle.hits, throttle.hits + throttle.misses))
+    for track_writer in track_writers:
+        if track_writer is not None:
+            track_writer.close()
+    if metrics_writer is not None:
+        metrics_writer.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if not headless:
+        cv2.destroyAllWindows()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,237 @@
+import os
+import time
+import json
+import random
+import itertools
+import multiprocessing
+from absl import app, flags
+from absl.flags import FLAGS
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from core.config import cfg
+from core.detection_cache import DetectionCache
+# deep sort imports
+from deep_sort import preprocessing, nn_matching, iou_matching
+from deep_sort.color_detect import pick_colors
+from deep_sort.detection import DetectionBatch
+from deep_sort.roi import RegionOfInterest
+from deep_sort.tracker import Tracker
+
+flags.DEFINE_string('cache', None, 'detection cache directory written by object_tracker.py --cache_dir')
+flags.DEFINE_string('gt', None, 'optional ground truth in MOTChallenge format to compute MOTA, MOTP and id switches')
+flags.DEFINE_string('report', None, 'path to write one JSON line per configuration to')
+flags.DEFINE_integer('workers', os.cpu_count(), 'number of configurations to run in parallel')
+flags.DEFINE_integer('num_samples', 0, 'if > 0, run this many random configurations of the grid instead of all of them')
+flags.DEFINE_integer('seed', 0, 'random seed for --num_samples')
+
+flags.DEFINE_list('jersey_colors', ['white','blue','yellow'], 'jersey colors the cache was recorded with')
+flags.DEFINE_float('nms_overlap', 1.0, 'NMS max overlap')
+flags.DEFINE_string('roi', None, 'region of interest the cache was recorded with, tracks leaving it are deleted')
+flags.DEFINE_list('cosine', ['0.4'], 'grid of max cosine distances')
+flags.DEFINE_list('nn_budget', ['none'], 'grid of appearance gallery budgets (none for unbounded)')
+flags.DEFINE_list('gallery_policy', ['fifo'], 'grid of appearance gallery policies (fifo, reservoir, ema, kcenter, kmeans)')
+flags.DEFINE_integer('gallery_max_samples', None, 'cap on the appearance features of all tracks together, every track keeps at least one')
+flags.DEFINE_list('max_age', ['60'], 'grid of deep sort max age parameters')
+flags.DEFINE_list('n_init', ['3'], 'grid of deep sort nr init parameters')
+flags.DEFINE_list('max_iou_distance', ['0.7'], 'grid of deep sort max iou distances')
+flags.DEFINE_list('color_threshold', ['0.05'], 'grid of color detection min percentages')
+
+# detection arrays of the cache, opened in every worker
+_shared = {}
+
+
+def attach_cache(cache_path, class_names, jersey_colors, nms_max_overlap, roi, gallery_max_samples, gt):
+    """Open the detection cache in a worker. Its arrays are memory-mapped
+    read-only, so all workers read the same pages of the page cache."""
+    cache = DetectionCache(cache_path)
+    for name in ('offsets', 'boxes', 'scores', 'classes', 'features', 'color_fractions'):
+        _shared[name] = getattr(cache, name)
+    _shared['class_names'] = class_names
+    _shared['jersey_colors'] = jersey_colors
+    _shared['nms_max_overlap'] = nms_max_overlap
+    _shared['roi'] = roi
+    _shared['gallery_max_samples'] = gallery_max_samples
+    _shared['gt'] = gt
+
+
+def load_gt(path):
+    """Returns a dict that maps frame numbers to `(ids, tlwh)` ground truth."""
+    rows = np.loadtxt(path, delimiter=',', ndmin=2)
+    gt = {}
+    for frame_num in np.unique(rows[:, 0]).astype(int):
+        frame_rows = rows[rows[:, 0] == frame_num]
+        gt[frame_num] = (frame_rows[:, 1].astype(int), frame_rows[:, 2:6])
+    return gt
+
+
+def clear_mot(gt, hypotheses, iou_threshold=0.5):
+    """Compute CLEAR MOT metrics.
+
+    Parameters
+    ----------
+    gt : Dict[int -> (ndarray, ndarray)]
+        Ground truth ids and boxes `(x, y, w, h)` per frame.
+    hypotheses : Dict[int -> (ndarray, ndarray)]
+        Track ids and boxes per frame.
+    iou_threshold : float
+        Minimum overlap of a ground truth box and a track to count as a match.
+
+    Returns
+    -------
+    Dict[str -> float]
+        MOTA, MOTP (mean IoU of matches), false positives, misses and id
+        switches.
+
+    """
+    num_gt, fp, fn, idsw, matches, iou_sum = 0, 0, 0, 0, 0, 0.
+    last_match = {}
+    for frame_num in sorted(set(gt) | set(hypotheses)):
+        gt_ids, gt_boxes = gt.get(frame_num, (np.zeros(0, int), np.zeros((0, 4))))
+        hyp_ids, hyp_boxes = hypotheses.get(frame_num, (np.zeros(0, int), np.zeros((0, 4))))
+        num_gt += len(gt_ids)
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            fp += len(hyp_ids)
+            fn += len(gt_ids)
+            continue
+        iou = iou_matching.iou_matrix(gt_boxes, hyp_boxes)
+        cost = 1. - iou
+        # keep the correspondences of the previous frame where still valid
+        for i, gt_id in enumerate(gt_ids):
+            if gt_id in last_match:
+                j = np.flatnonzero(hyp_ids == last_match[gt_id])
+                if len(j) and iou[i, j[0]] >= iou_threshold:
+                    cost[i, j[0]] = -1.
+        cost[iou < iou_threshold] = 1e5
+        rows, cols = linear_sum_assignment(cost)
+        valid = cost[rows, cols] < 1e5
+        rows, cols = rows[valid], cols[valid]
+        for i, j in zip(rows, cols):
+            if gt_ids[i] in last_match and last_match[gt_ids[i]] != hyp_ids[j]:
+                idsw += 1
+            last_match[gt_ids[i]] = hyp_ids[j]
+            iou_sum += iou[i, j]
+        matches += len(rows)
+        fp += len(hyp_ids) - len(rows)
+        fn += len(gt_ids) - len(rows)
+    return {
+        'mota': 1. - float(fn + fp + idsw) / max(1, num_gt),
+        'motp': iou_sum / max(1, matches),
+        'false_positives': fp,
+        'misses': fn,
+        'id_switches': idsw}
+
+
+def run_config(config):
+    """Run the tracker over all cached frames with one configuration."""
+    offsets, class_names = _shared['offsets'], _shared['class_names']
+    boxes, scores, classes = _shared['boxes'], _shared['scores'], _shared['classes']
+    features, fractions = _shared['features'], _shared['color_fractions']
+    jersey_colors, nms_max_overlap = _shared['jersey_colors'], _shared['nms_max_overlap']
+    color_names = list(jersey_colors) + ['Unidentified']
+
+    metric = nn_matching.NearestNeighborDistanceMetric(
+        "cosine", config['cosine'], config['nn_budget'], config['gallery_policy'],
+        _shared['gallery_max_samples'])
+    tracker = Tracker(metric, max_iou_distance=config['max_iou_distance'],
+                      max_age=config['max_age'], n_init=config['n_init'], roi=_shared['roi'])
+
+    hypotheses = {}
+    track_lengths = {}
+    start_time = time.time()
+    for i in range(len(offsets) - 1):
+        s, e = offsets[i], offsets[i + 1]
+        color_ids = None
+        if jersey_colors:
+            color_ids = pick_colors(fractions[s:e], jersey_colors, threshold=config['color_threshold'])
+        detections = DetectionBatch(boxes[s:e], scores[s:e], classes[s:e], features[s:e], color_ids,
+                                    class_names, color_names)
+
+        # run non-maxima supression
+        indices = preprocessing.non_max_suppression(detections, None, nms_max_overlap)
+        detections = detections[indices]
+
+        tracker.predict()
+        tracker.update(detections)
+
+        # report confirmed tracks the same way as the MOT track output
+        ids, tlwhs = [], []
+        for track in tracker.tracks:
+            if not track.is_confirmed() or track.time_since_update > 1:
+                continue
+            ids.append(track.track_id)
+            tlwhs.append(track.to_tlwh())
+            track_lengths[track.track_id] = track_lengths.get(track.track_id, 0) + 1
+        hypotheses[i + 1] = (np.asarray(ids, dtype=int), np.asarray(tlwhs).reshape(-1, 4))
+    elapsed = time.time() - start_time
+
+    result = dict(config)
+    result['fps'] = (len(offsets) - 1) / elapsed
+    result['num_tracks'] = len(track_lengths)
+    result['mean_track_length'] = float(np.mean(list(track_lengths.values()))) if track_lengths else 0.
+    result['gallery_memory_bytes'] = metric.gallery_stats()['memory_bytes']
+    if _shared['gt'] is not None:
+        result.update(clear_mot(_shared['gt'], hypotheses))
+    return result
+
+
+def make_configs():
+    def parse_budget(value):
+        return None if value.lower() == 'none' else int(value)
+
+    grid = [
+        ('cosine', [float(v) for v in FLAGS.cosine]),
+        ('nn_budget', [parse_budget(v) for v in FLAGS.nn_budget]),
+        ('gallery_policy', FLAGS.gallery_policy),
+        ('max_age', [int(v) for v in FLAGS.max_age]),
+        ('n_init', [int(v) for v in FLAGS.n_init]),
+        ('max_iou_distance', [float(v) for v in FLAGS.max_iou_distance]),
+        ('color_threshold', [float(v) for v in FLAGS.color_threshold]),
+    ]
+    keys = [key for key, _ in grid]
+    configs = [dict(zip(keys, values))
+               for values in itertools.product(*[values for _, values in grid])]
+    # all policies but fifo and ema summarize a fixed number of samples
+    configs = [config for config in configs
+               if config['nn_budget'] is not None or config['gallery_policy'] in ('fifo', 'ema')]
+    if 0 < FLAGS.num_samples < len(configs):
+        configs = random.Random(FLAGS.seed).sample(configs, FLAGS.num_samples)
+    return configs
+
+
+def main(_argv):
+    if not FLAGS.cache or not DetectionCache.exists(FLAGS.cache):
+        raise ValueError('--cache must point to a complete detection cache')
+    cache = DetectionCache(FLAGS.cache)
+    if cache.num_colors != len(FLAGS.jersey_colors):
+        raise ValueError('the cache holds {} jersey colors, --jersey_colors has {}'.format(
+            cache.num_colors, len(FLAGS.jersey_colors)))
+
+    with open(cfg.YOLO.CLASSES) as data:
+        class_names = {ID: name.strip('\n') for ID, name in enumerate(data)}
+    gt = load_gt(FLAGS.gt) if FLAGS.gt else None
+    roi = RegionOfInterest.from_file(FLAGS.roi) if FLAGS.roi else None
+    configs = make_configs()
+    print('Running {} configurations on {} frames with {} workers'.format(
+        len(configs), len(cache), FLAGS.workers))
+
+    report = open(FLAGS.report, 'w') if FLAGS.report else None
+    try:
+        with multiprocessing.Pool(FLAGS.workers, initializer=attach_cache,
+                                  initargs=(FLAGS.cache, class_names, FLAGS.jersey_colors, FLAGS.nms_overlap, roi,
+                                            FLAGS.gallery_max_samples, gt)) as pool:
+            for result in pool.imap_unordered(run_config, configs):
+                print(', '.join('{}: {}'.format(k, round(v, 4) if isinstance(v, float) else v)
+                                for k, v in result.items()))
+                if report is not None:
+                    report.write(json.dumps(result) + '\n')
+                    report.flush()
+    finally:
+        if report is not None:
+            report.close()
+
+
+if __name__ == '__main__':
+    try:
+        app.run(main)
+    except SystemExit:
+        pass
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from deep_sort.detection import Detection, DetectionBatch
+
+
+def random_detections(seed, n=10, dim=8):
+    rng = np.random.RandomState(seed)
+    return [Detection(np.r_[rng.uniform(0, 1000, 2), rng.uniform(5, 200, 2)], rng.rand(),
+                      rng.choice(['person', 'sports ball']), rng.normal(0, 1, dim),
+                      rng.choice(['red', 'blue', None]))
+            for _ in range(n)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_boxes_match_detections(seed):
+    detections = random_detections(seed)
+    batch = DetectionBatch.from_detections(detections)
+    np.testing.assert_allclose(batch.to_tlbr(), [d.to_tlbr() for d in detections])
+    np.testing.assert_allclose(batch.to_xyah(), [d.to_xyah() for d in detections])
+    # the conversions do not touch the boxes
+    np.testing.assert_array_equal(batch.tlwh, [d.tlwh for d in detections])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_items_match_detections(seed):
+    detections = random_detections(seed)
+    batch = DetectionBatch.from_detections(detections)
+    assert len(batch) == len(detections)
+    for d, item in zip(detections, batch):
+        np.testing.assert_array_equal(item.tlwh, d.tlwh)
+        np.testing.assert_array_equal(item.feature, d.feature)
+        assert (item.confidence, item.get_class(), item.get_color()) == \
+            (d.confidence, d.get_class(), d.get_color())
+
+    subset = batch[np.array([1, 4, 7])]
+    np.testing.assert_allclose(subset.to_xyah(), [detections[i].to_xyah() for i in (1, 4, 7)])
+    assert [d.get_color() for d in subset] == [detections[i].get_color() for i in (1, 4, 7)]
+
+
+def test_features_set_later():
+    tlwh = [[0., 0., 10., 20.], [5., 5., 10., 20.], [50., 5., 10., 20.]]
+    batch = DetectionBatch(tlwh, np.ones(3), np.zeros(3, dtype=int), None, class_names=['person'])
+    assert batch.features is None and not batch.has_feature.any()
+    assert batch[0].feature is None
+    batch.set_features([0, 2], np.eye(2, 4))
+    np.testing.assert_array_equal(batch.has_feature, [True, False, True])
+    np.testing.assert_array_equal(batch[2].feature, [0., 1., 0., 0.])
+    assert batch[1].feature is None
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from deep_sort import iou_matching, linear_assignment
+from deep_sort.detection import Detection, DetectionBatch
+
+
+def random_boxes(rng, n):
+    """Boxes `(x, y, w, h)` in a small area, so that many of them overlap,
+    some identical and some not at all."""
+    tlwh = np.c_[rng.uniform(0, 200, (n, 2)), rng.uniform(10, 80, (n, 2))]
+    tlwh[rng.rand(n) < 0.1, :] = [50., 50., 40., 40.]
+    return tlwh
+
+
+class _Track(object):
+
+    def __init__(self, tlwh, time_since_update):
+        self.tlwh, self.time_since_update = tlwh, time_since_update
+
+    def to_tlwh(self):
+        return self.tlwh.copy()
+
+
+class _TrackStore(object):
+    """The columns of `TrackStore` that `iou_cost` reads."""
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.time_since_update = np.array([track.time_since_update for track in tracks])
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def to_tlwh(self):
+        return np.array([track.tlwh for track in self.tracks]).reshape(-1, 4)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_iou_matrix_matches_iou(seed):
+    rng = np.random.RandomState(seed)
+    boxes, candidates = random_boxes(rng, rng.randint(1, 30)), random_boxes(rng, rng.randint(1, 30))
+    expected = np.array([iou_matching.iou(box, candidates) for box in boxes])
+    np.testing.assert_allclose(iou_matching.iou_matrix(boxes, candidates), expected)
+    assert iou_matching.iou_matrix(boxes, np.zeros((0, 4))).shape == (len(boxes), 0)
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('batch', [False, True])
+def test_iou_cost_matches_per_track_loop(seed, batch):
+    rng = np.random.RandomState(seed)
+    tlwh = random_boxes(rng, 15)
+    tracks = [_Track(box, age) for box, age in zip(tlwh, rng.randint(1, 4, len(tlwh)))]
+    boxes = random_boxes(rng, 12)
+    track_indices, detection_indices = [0, 2, 3, 5, 8, 13, 14], [1, 2, 4, 6, 7, 11]
+
+    # the loop iou_cost used to run
+    expected = np.zeros((len(track_indices), len(detection_indices)))
+    candidates = boxes[detection_indices]
+    for row, track_idx in enumerate(track_indices):
+        if tracks[track_idx].time_since_update > 1:
+            expected[row, :] = linear_assignment.INFTY_COST
+            continue
+        expected[row, :] = 1. - iou_matching.iou(tracks[track_idx].to_tlwh(), candidates)
+
+    if batch:
+        detections = DetectionBatch(boxes, np.ones(len(boxes)), np.zeros(len(boxes), dtype=int), None)
+        tracks = _TrackStore(tracks)
+    else:
+        detections = [Detection(box, 1., 'person', None) for box in boxes]
+    np.testing.assert_allclose(
+        iou_matching.iou_cost(tracks, detections, track_indices, detection_indices), expected)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from deep_sort import kalman_filter, linear_assignment
+
+
+def random_states(seed, num_tracks=12, steps=5):
+    """Track states as they occur in tracking: initiated from a measurement
+    and run through a few predict and update steps."""
+    rng = np.random.RandomState(seed)
+    kf = kalman_filter.KalmanFilter()
+    states = []
+    for _ in range(num_tracks):
+        mean, covariance = kf.initiate(np.r_[rng.uniform(0, 1000, 2), rng.uniform(0.3, 0.6), rng.uniform(30, 200)])
+        for _ in range(rng.randint(0, steps)):
+            mean, covariance = kf.predict(mean, covariance)
+            if rng.rand() < 0.7:
+                mean, covariance = kf.update(mean, covariance, kf.project(mean, covariance)[0][:4] +
+                                             rng.normal(0, 2, 4) * [1, 1, 0.01, 1])
+        states.append((mean, covariance))
+    mean, covariance = (np.array(values) for values in zip(*states))
+    measurements = np.c_[rng.uniform(0, 1000, (20, 2)), rng.uniform(0.3, 0.6, 20), rng.uniform(30, 200, 20)]
+    # some measurements right on a track
+    measurements[:len(mean) // 2] = mean[:len(mean) // 2, :4] + rng.normal(0, 1, (len(mean) // 2, 4)) * [1, 1, 0.01, 1]
+    return kf, mean, covariance, measurements
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_predict_and_project_batch(seed):
+    kf, mean, covariance, _ = random_states(seed)
+    for batch, single in ((kf.predict_batch, kf.predict), (kf.project_batch, kf.project)):
+        batch_mean, batch_covariance = batch(mean.copy(), covariance.copy())
+        for i in range(len(mean)):
+            expected_mean, expected_covariance = single(mean[i], covariance[i])
+            np.testing.assert_allclose(batch_mean[i], expected_mean)
+            np.testing.assert_allclose(batch_covariance[i], expected_covariance)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_update_batch(seed):
+    kf, mean, covariance, measurements = random_states(seed)
+    batch_mean, batch_covariance = kf.update_batch(mean, covariance, measurements[:len(mean)])
+    for i in range(len(mean)):
+        expected_mean, expected_covariance = kf.update(mean[i], covariance[i], measurements[i])
+        np.testing.assert_allclose(batch_mean[i], expected_mean, rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(batch_covariance[i], expected_covariance, rtol=1e-6, atol=1e-8)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('only_position', [False, True])
+def test_gating_distance_batch(seed, only_position):
+    kf, mean, covariance, measurements = random_states(seed)
+    distances = kf.gating_distance_batch(mean, covariance, measurements, only_position)
+    assert distances.shape == (len(mean), len(measurements))
+    for i in range(len(mean)):
+        np.testing.assert_allclose(
+            distances[i], kf.gating_distance(mean[i], covariance[i], measurements, only_position), rtol=1e-6)
+
+
+class _Track(object):
+
+    def __init__(self, mean, covariance):
+        self.mean, self.covariance = mean, covariance
+
+
+class _Detection(object):
+
+    def __init__(self, xyah):
+        self.xyah = xyah
+
+    def to_xyah(self):
+        return self.xyah
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_gate_cost_matrix(seed):
+    kf, mean, covariance, measurements = random_states(seed)
+    tracks = [_Track(m, c) for m, c in zip(mean, covariance)]
+    detections = [_Detection(m) for m in measurements]
+    track_indices, detection_indices = [1, 3, 4, 7, 10], list(range(0, 20, 2))
+    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
+
+    # the per-track loop gate_cost_matrix used to run
+    expected = cost_matrix.copy()
+    for row, track_idx in enumerate(track_indices):
+        gating_distance = kf.gating_distance(
+            mean[track_idx], covariance[track_idx], measurements[detection_indices])
+        expected[row, gating_distance > kalman_filter.chi2inv95[4]] = linear_assignment.INFTY_COST
+    assert 0 < np.count_nonzero(expected) < expected.size
+
+    np.testing.assert_array_equal(linear_assignment.gate_cost_matrix(
+        kf, cost_matrix.copy(), tracks, detections, track_indices, detection_indices), expected)
+    gating_matrix = kf.gating_distance_batch(mean, covariance, measurements)
+    np.testing.assert_array_equal(linear_assignment.gate_cost_matrix(
+        kf, cost_matrix.copy(), tracks, detections, track_indices, detection_indices,
+        gating_matrix=gating_matrix), expected)
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+from deep_sort import linear_assignment
+from deep_sort.linear_assignment import INFTY_COST, min_cost_matching
+
+
+MAX_DISTANCE = 0.5
+
+
+def dense_matching(cost_matrix, max_distance=MAX_DISTANCE):
+    """The matches of `min_cost_matching` before it solved the gated pairs
+    only: one assignment over the whole matrix, then drop the infeasible
+    pairs."""
+    cost_matrix = cost_matrix.copy()
+    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+    rows, cols = linear_sum_assignment(cost_matrix)
+    feasible = cost_matrix[rows, cols] <= max_distance
+    return sorted(zip(rows[feasible].tolist(), cols[feasible].tolist()))
+
+
+def random_costs(rng, shape, density):
+    """Costs without ties, gated pairs cost `INFTY_COST` like in
+    `gate_cost_matrix`, others may still exceed the threshold."""
+    cost_matrix = rng.uniform(0, 2 * MAX_DISTANCE, shape)
+    cost_matrix[rng.rand(*shape) > density] = INFTY_COST
+    return cost_matrix
+
+
+def block_diagonal_costs(rng, num_blocks):
+    sizes = rng.randint(1, 5, (num_blocks, 2))
+    cost_matrix = np.full(sizes.sum(axis=0), INFTY_COST)
+    row, col = 0, 0
+    for num_rows, num_cols in sizes:
+        cost_matrix[row:row + num_rows, col:col + num_cols] = rng.uniform(0, MAX_DISTANCE, (num_rows, num_cols))
+        row, col = row + num_rows, col + num_cols
+    # shuffle, so the components are not contiguous
+    return cost_matrix[rng.permutation(len(cost_matrix))][:, rng.permutation(cost_matrix.shape[1])]
+
+
+def cost_matrices():
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        shape = tuple(rng.randint(1, 30, 2))
+        yield random_costs(rng, shape, rng.uniform(0.02, 0.3))
+        yield block_diagonal_costs(rng, rng.randint(1, 10))
+        # fully gated and fully open
+        yield random_costs(rng, shape, 0.)
+        yield rng.uniform(0, MAX_DISTANCE, shape)
+
+
+@pytest.mark.parametrize('cost_matrix', list(cost_matrices()))
+def test_sparse_assignment_matches_dense(cost_matrix):
+    expected = dense_matching(cost_matrix)
+    matches, unmatched_tracks, unmatched_detections = min_cost_matching(
+        lambda *args: cost_matrix.copy(), MAX_DISTANCE, np.arange(len(cost_matrix)),
+        np.arange(cost_matrix.shape[1]))
+    assert sorted(matches) == expected
+    assert np.isclose(sum(cost_matrix[pair] for pair in matches), sum(cost_matrix[pair] for pair in expected))
+    assert sorted(unmatched_tracks) == sorted(set(range(len(cost_matrix))) - set(r for r, _ in matches))
+    assert sorted(unmatched_detections) == sorted(set(range(cost_matrix.shape[1])) - set(c for _, c in matches))
+
+
+def test_sparse_assignment_of_gated_pairs_only():
+    cost_matrix = np.full((3, 4), INFTY_COST)
+    rows, cols = linear_assignment._sparse_linear_assignment(cost_matrix, cost_matrix <= MAX_DISTANCE)
+    assert len(rows) == len(cols) == 0
+
+
+class _Track(object):
+
+    def __init__(self, time_since_update):
+        self.time_since_update = time_since_update
+
+
+class _TrackStore(object):
+    """The columns of `TrackStore` the cascade reads."""
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.time_since_update = np.array([track.time_since_update for track in tracks])
+
+    def __getitem__(self, index):
+        return self.tracks[index]
+
+
+def cascade_per_level(cost_matrix, cascade_depth, tracks, track_indices, detection_indices):
+    """`matching_cascade` as it was: every level computes the cost of its
+    tracks and solves the whole matrix."""
+    unmatched_detections = list(detection_indices)
+    matches = []
+    for level in range(cascade_depth):
+        if len(unmatched_detections) == 0:
+            break
+        track_indices_l = [k for k in track_indices if tracks[k].time_since_update == 1 + level]
+        if len(track_indices_l) == 0:
+            continue
+        pairs = dense_matching(cost_matrix[np.ix_(track_indices_l, unmatched_detections)])
+        matches += [(track_indices_l[row], unmatched_detections[col]) for row, col in pairs]
+        matched = set(unmatched_detections[col] for _, col in pairs)
+        unmatched_detections = [k for k in unmatched_detections if k not in matched]
+    unmatched_tracks = set(track_indices) - set(k for k, _ in matches)
+    return matches, unmatched_tracks, unmatched_detections
+
+
+@pytest.mark.parametrize('seed', range(30))
+@pytest.mark.parametrize('store', [False, True])
+def test_cascade_matches_per_level_loop(seed, store):
+    rng = np.random.RandomState(seed)
+    num_tracks, num_detections, cascade_depth = rng.randint(1, 40), rng.randint(1, 30), 10
+    cost_matrix = random_costs(rng, (num_tracks, num_detections), 0.3)
+    # ages beyond the cascade depth (and 0) are never matched
+    ages = rng.randint(0, cascade_depth + 3, num_tracks)
+    tracks = [_Track(age) for age in ages]
+    track_indices = sorted(rng.choice(num_tracks, rng.randint(1, num_tracks + 1), replace=False).tolist())
+    detection_indices = sorted(rng.choice(num_detections, rng.randint(1, num_detections + 1), replace=False).tolist())
+    calls = []
+
+    def distance_metric(tracks, detections, track_indices, detection_indices):
+        calls.append(1)
+        return cost_matrix[np.ix_(track_indices, detection_indices)]
+
+    matches, unmatched_tracks, unmatched_detections = linear_assignment.matching_cascade(
+        distance_metric, MAX_DISTANCE, cascade_depth, _TrackStore(tracks) if store else tracks, np.arange(num_detections),
+        track_indices, detection_indices)
+    expected = cascade_per_level(cost_matrix, cascade_depth, tracks, track_indices, detection_indices)
+    assert sorted(matches) == sorted(expected[0])
+    assert set(unmatched_tracks) == expected[1]
+    assert sorted(unmatched_detections) == sorted(expected[2])
+    assert len(calls) == 1
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from deep_sort import nn_matching
+
+
+@pytest.mark.parametrize('num_targets, expected', [(4, 5), (10, 2), (30, 1)])
+def test_max_samples_is_shared_by_all_targets(num_targets, expected):
+    rng = np.random.RandomState(0)
+    metric = nn_matching.NearestNeighborDistanceMetric('cosine', 0.4, max_samples=20)
+    targets = np.arange(num_targets)
+    for _ in range(10):
+        metric.partial_fit(rng.normal(0, 1, (num_targets, 8)), targets, targets)
+    num_targets_kept, num_samples = metric.gallery_size()
+    assert num_targets_kept == num_targets
+    # every target keeps at least one sample, even beyond the cap
+    assert num_samples == num_targets * expected
+    assert np.isfinite(metric.distance(rng.normal(0, 1, (3, 8)), targets)).all()
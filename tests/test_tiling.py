@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from core.tiling import crop_tiles, merge_tile_detections, parse_tiles, tile_layout
+
+
+def test_tiles_cover_the_frame_at_native_scale():
+    tiles = tile_layout((0, 0, 1920, 1080), (1080, 1920), 416, 64)
+    np.testing.assert_array_equal(tiles[:, 2:] - tiles[:, :2], 416)
+    assert tiles[:, 0].min() == 0 and tiles[:, 2].max() == 1920
+    assert tiles[:, 1].min() == 0 and tiles[:, 3].max() == 1080
+    xs, ys = np.unique(tiles[:, 0]), np.unique(tiles[:, 1])
+    assert (len(xs), len(ys)) == (6, 3)
+    assert (416 - np.diff(xs)).min() >= 64 and (416 - np.diff(ys)).min() >= 64
+
+    # a denser grid overlaps more, a sparser one leaves gaps
+    assert len(tile_layout((0, 0, 1920, 1080), (1080, 1920), 416, 64, (7, 3), skip=(0, 20))) == 19
+    with pytest.raises(ValueError):
+        tile_layout((0, 0, 1920, 1080), (1080, 1920), 416, 64, (5, 3))
+    assert parse_tiles('auto') is None and parse_tiles('7x3') == (7, 3)
+
+
+def test_small_frames_are_padded():
+    tiles = tile_layout((0, 0, 300, 200), (200, 300), 416, 64)
+    np.testing.assert_array_equal(tiles, [[0, 0, 416, 416]])
+    image_data = crop_tiles(np.full((200, 300, 3), 255, np.uint8), tiles, 416)
+    assert image_data.shape == (1, 416, 416, 3)
+    assert image_data[0, :200, :300].min() == 1. and image_data[0, 200:].max() == 0.
+
+
+def test_merge_joins_cut_boxes_and_drops_duplicates():
+    tiles = np.array([[0, 0, 416, 416], [352, 0, 768, 416]])
+    frame_shape = (416, 768)
+
+    def to_tile(box, tile):
+        x0, y0 = tile[:2]
+        xmin, ymin, xmax, ymax = np.clip(box, [x0, y0, x0, y0], [tile[2], tile[3], tile[2], tile[3]])
+        return [(ymin - y0) / 416., (xmin - x0) / 416., (ymax - y0) / 416., (xmax - x0) / 416.]
+
+    # one player on the seam inside the overlap, one cut by the border of the
+    # first tile, one far away in the second tile only
+    players = [(370, 100, 400, 170), (400, 200, 430, 270), (600, 50, 630, 120)]
+    boxes = [np.array([to_tile(p, tiles[0]) for p in players[:2]]),
+             np.array([to_tile(p, tiles[1]) for p in players])]
+    scores = [np.array([0.9, 0.8]), np.array([0.7, 0.6, 0.5])]
+    classes = [np.zeros(2), np.zeros(3)]
+    yxyx, merged_scores, _ = merge_tile_detections(tiles, boxes, scores, classes, frame_shape, 0.45)
+    xyxy = yxyx[:, [1, 0, 3, 2]] * [768, 416, 768, 416]
+    np.testing.assert_allclose(xyxy, players, atol=1e-3)
+    np.testing.assert_allclose(merged_scores, [0.9, 0.8, 0.5])
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from deep_sort import kalman_filter
+from deep_sort.detection import Detection
+from deep_sort.track import Track, TrackState, TrackStore
+
+
+N_INIT, MAX_AGE = 3, 5
+
+
+def xyah_to_tlwh(xyah):
+    tlwh = np.asarray(xyah, dtype=np.float64).copy()
+    tlwh[2] *= tlwh[3]
+    tlwh[:2] -= tlwh[2:] / 2
+    return tlwh
+
+
+def assert_same_tracks(tracks, store):
+    assert len(tracks) == len(store)
+    np.testing.assert_array_equal(store.track_id, [t.track_id for t in tracks])
+    np.testing.assert_array_equal(store.state, [t.state for t in tracks])
+    np.testing.assert_array_equal(store.hits, [t.hits for t in tracks])
+    np.testing.assert_array_equal(store.age, [t.age for t in tracks])
+    np.testing.assert_array_equal(store.time_since_update, [t.time_since_update for t in tracks])
+    np.testing.assert_allclose(store.mean, np.array([t.mean for t in tracks]).reshape(-1, 8))
+    np.testing.assert_allclose(store.covariance, np.array([t.covariance for t in tracks]).reshape(-1, 8, 8))
+    for track, view in zip(tracks, store):
+        colors = [track.colors.count(color) for color in set(track.colors)]
+        # ties of the vote before a color is fixed are broken differently
+        if track.color_confirmed or colors.count(max(colors, default=0)) == 1:
+            assert view.get_color() == track.get_color()
+
+
+def run_both(seed, num_steps=150, color_noise=0.3):
+    """Drive a list of `Track` and a `TrackStore` with the same random
+    predictions, matches and misses and compare them after every step.
+    Detections carry the jersey color of their player, another color or none.
+    Returns the tracks that fixed their color and how many of their
+    detections were rejected because of the color."""
+    rng = np.random.RandomState(seed)
+    kf = kalman_filter.KalmanFilter()
+    tracks, store = [], TrackStore(N_INIT, MAX_AGE, capacity=2)
+    teams, next_id = {}, 1
+    rejected = 0
+
+    def colored_detection(track_id, xyah):
+        draw = rng.rand()
+        color = teams[track_id] if draw > color_noise else ('blue' if teams[track_id] == 'red' else 'red')
+        if draw < color_noise / 2:
+            color = None
+        return Detection(xyah_to_tlwh(xyah), 1., 'person', None, color)
+
+    for _ in range(num_steps):
+        if rng.rand() < 0.2 or not tracks:
+            xyah = np.r_[rng.uniform(300, 900), rng.uniform(200, 600), 0.4, rng.uniform(50, 100)]
+            teams[next_id] = rng.choice(['red', 'blue'])
+            detection = colored_detection(next_id, xyah)
+            mean, covariance = kf.initiate(xyah)
+            tracks.append(Track(mean, covariance, next_id, N_INIT, MAX_AGE, None, 'person', detection.color))
+            store.add(mean, covariance, next_id, None, 'person', detection.color)
+            next_id += 1
+
+        detect = rng.rand() < 0.9
+        for track in tracks:
+            track.predict(kf, detect)
+        mean, covariance = kf.predict_batch(store.mean.copy(), store.covariance.copy())
+        store.apply_prediction(mean, covariance, detect)
+        assert_same_tracks(tracks, store)
+
+        if detect:
+            matched = np.flatnonzero((rng.rand(len(tracks)) < 0.85) & (store.state != TrackState.Deleted))
+            detections = [colored_detection(tracks[row].track_id, tracks[row].mean[:4] + rng.normal(0, 1, 4) * [2, 2, 0.01, 2])
+                          for row in matched]
+            hits = [tracks[row].hits for row in matched]
+            for row, detection in zip(matched, detections):
+                tracks[row].update(kf, detection)
+            rejected += sum(tracks[row].hits < hit for row, hit in zip(matched, hits))
+            xyah = np.array([d.to_xyah() for d in detections]).reshape(-1, 4)
+            mean, covariance = kf.update_batch(store.mean[matched], store.covariance[matched], xyah)
+            store.apply_update(matched, mean, covariance, None,
+                               [store.color_id(d.color) for d in detections], store.color_names)
+            missed = np.setdiff1d(np.arange(len(tracks)), matched)
+            for row in missed:
+                tracks[row].mark_missed()
+            store.mark_missed(missed)
+            assert_same_tracks(tracks, store)
+
+        tracks = [t for t in tracks if not t.is_deleted()]
+        store.remove_deleted()
+        assert_same_tracks(tracks, store)
+    return [t for t in tracks if t.color_confirmed], rejected
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_store_follows_tracks(seed):
+    confirmed, rejected = run_both(seed)
+    assert confirmed and rejected > 0
+
+
+def test_store_rejects_detections_without_color_like_tracks():
+    kf = kalman_filter.KalmanFilter()
+    mean, covariance = kf.initiate([500., 300., 0.4, 80.])
+    # a tentative track in the first row is deleted right after the color of
+    # the second track is fixed, so the second one moves to the first row
+    tracks = [Track(mean, covariance, i, N_INIT, MAX_AGE, None, 'person', 'red') for i in (1, 2)]
+    store = TrackStore(N_INIT, MAX_AGE)
+    for i in (1, 2):
+        store.add(mean, covariance, i, None, 'person', 'red')
+    # the 17th vote fixes the color, then detections without color come in
+    votes = ['red'] * 13 + ['blue'] * 3 + [None] * 4 + ['red', None]
+    for step, color in enumerate(votes):
+        for track in tracks:
+            track.predict(kf)
+        mean, covariance = kf.predict_batch(store.mean.copy(), store.covariance.copy())
+        store.apply_prediction(mean, covariance)
+        track, row = tracks[-1], len(tracks) - 1
+        detection = Detection(track.to_tlwh(), 1., 'person', None, color)
+        track.update(kf, detection)
+        mean, covariance = kf.update_batch(store.mean[[row]], store.covariance[[row]], detection.to_xyah()[np.newaxis])
+        store.apply_update([row], mean, covariance, None, [store.color_id(color)], store.color_names)
+        if step == 15:
+            tracks[0].mark_missed()
+            store.mark_missed([0])
+            tracks = tracks[1:]
+            store.remove_deleted()
+        assert_same_tracks(tracks, store)
+    assert track.confirmed_color == 'red'
+    # the blue vote that fixes the color and the two detections without color
+    # after it are rejected, each takes a hit away
+    assert track.hits == 1 + (len(votes) - 3) - 3
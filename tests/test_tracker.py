@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+from deep_sort import kalman_filter, nn_matching
+from deep_sort.detection import DetectionBatch
+from deep_sort.feature_throttle import FeatureThrottle
+from deep_sort.track import TrackState
+from deep_sort.tracker import Tracker
+
+
+def slow_crowd(seed, num_frames=80, num_players=20, dim=16):
+    """Players that barely move in a crowd, with missed detections and an
+    occasional false positive. Returns `(tlwh, features)` per frame."""
+    rng = np.random.RandomState(seed)
+    position = np.c_[rng.uniform(100, 400, num_players), rng.uniform(150, 400, num_players)]
+    appearance = rng.normal(0, 1, (num_players, dim))
+    frames = []
+    for _ in range(num_frames):
+        position += rng.normal(0, 0.8, position.shape)
+        visible = rng.rand(num_players) > 0.3
+        tlwh = np.c_[position[visible] - [17, 40], np.tile([35., 80.], (visible.sum(), 1))]
+        tlwh += rng.normal(0, 1, tlwh.shape)
+        features = appearance[visible] + rng.normal(0, 0.3, (visible.sum(), dim))
+        if rng.rand() < 0.5:
+            tlwh = np.r_[tlwh, [[rng.uniform(100, 400), rng.uniform(150, 400), 35., 80.]]]
+            features = np.r_[features, rng.normal(0, 1, (1, dim))]
+        frames.append((tlwh, features))
+    return frames
+
+
+def walking_players(seed, num_frames=120, num_players=14, dim=32):
+    """Players that keep their direction and their appearance, close enough
+    to each other that detections fall into the gates of several tracks."""
+    rng = np.random.RandomState(seed)
+    position = np.c_[rng.uniform(100, 500, num_players), rng.uniform(150, 450, num_players)]
+    velocity = rng.normal(0, 1.5, position.shape)
+    appearance = rng.normal(0, 1, (num_players, dim))
+    frames = []
+    for _ in range(num_frames):
+        position += velocity
+        visible = rng.rand(num_players) > 0.1
+        tlwh = np.c_[position[visible] - [17, 40], np.tile([35., 80.], (visible.sum(), 1))]
+        tlwh += rng.normal(0, 1, tlwh.shape)
+        frames.append((tlwh, appearance[visible] + rng.normal(0, 0.2, (visible.sum(), dim))))
+    return frames
+
+
+def run_tracker(frames, on_update=None, **kwargs):
+    """Track `frames` with features computed on demand. Returns the ids and
+    boxes of all tracks after every frame."""
+    metric = nn_matching.NearestNeighborDistanceMetric('cosine', 0.4, 100)
+    tracker = Tracker(metric, n_init=3, **kwargs)
+    history = []
+    for tlwh, features in frames:
+        detections = DetectionBatch(tlwh, np.ones(len(tlwh)), np.zeros(len(tlwh), dtype=int), None,
+                                    class_names={0: 'person'})
+        tracker.predict()
+        if on_update is not None:
+            on_update(tracker, detections)
+        tracker.update(detections, lambda indices: features[indices])
+        history.append((tracker.tracks.track_id.tolist(), tracker.tracks.to_tlwh()))
+    return tracker, history
+
+
+def assert_same_history(history, expected):
+    assert len(history) == len(expected)
+    for (ids, tlwh), (expected_ids, expected_tlwh) in zip(history, expected):
+        assert ids == expected_ids
+        np.testing.assert_allclose(tlwh, expected_tlwh)
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_lazy_features_match_eager(seed):
+    frames = walking_players(seed)
+    shared = []
+
+    def count_shared_gates(tracker, detections):
+        if len(tracker.tracks) == 0 or len(detections) == 0:
+            return
+        gate = tracker.kf.gating_distance_batch(
+            tracker.tracks.mean, tracker.tracks.covariance, detections.to_xyah()) <= kalman_filter.chi2inv95[4]
+        gate &= (tracker.tracks.state == TrackState.Confirmed)[:, np.newaxis]
+        shared.append(np.count_nonzero(gate.sum(axis=0) > 1))
+
+    _, eager = run_tracker(frames, count_shared_gates)
+    tracker, lazy = run_tracker(frames, lazy_features=True)
+    # detections in the gates of several tracks are encoded, the others are
+    # matched to their only track without a feature
+    assert sum(shared) > 0
+    assert tracker.feature_stats['skipped'] > 0
+    assert_same_history(lazy, eager)
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_reused_features_match_eager(seed):
+    frames = walking_players(seed)
+    _, eager = run_tracker(frames)
+    tracker, reused = run_tracker(frames, feature_throttle=FeatureThrottle())
+    assert tracker.feature_throttle.hits > 0
+    assert_same_history(reused, eager)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_reused_features_belong_to_matched_track(seed):
+    metric = nn_matching.NearestNeighborDistanceMetric('cosine', 0.4, 100)
+    tracker = Tracker(metric, n_init=3, feature_throttle=FeatureThrottle())
+    lookup, encode, match = tracker.feature_throttle.lookup, tracker._encode, tracker._match
+    offered, reused, matched = {}, [], {}
+
+    def record_lookup(tlwh, candidates):
+        indices, track_ids, features = lookup(tlwh, candidates)
+        offered.update(zip(indices.tolist(), track_ids.tolist()))
+        return indices, track_ids, features
+
+    def record_encode(*args):
+        mask = encode(*args)
+        reused.extend(np.flatnonzero(mask).tolist())
+        return mask
+
+    def record_match(detections, gating_matrix):
+        matches, unmatched_tracks, unmatched_detections = match(detections, gating_matrix)
+        matched.update((int(d), int(tracker.tracks.track_id[t])) for t, d in matches)
+        return matches, unmatched_tracks, unmatched_detections
+
+    tracker.feature_throttle.lookup = record_lookup
+    tracker._encode, tracker._match = record_encode, record_match
+    num_reused = 0
+    for tlwh, features in slow_crowd(seed):
+        offered.clear()
+        matched.clear()
+        del reused[:]
+        detections = DetectionBatch(tlwh, np.ones(len(tlwh)), np.zeros(len(tlwh), dtype=int), None,
+                                    class_names={0: 'person'})
+        tracker.predict()
+        tracker.update(detections, lambda indices: features[indices])
+        # a reused feature always goes to the detection of its own track
+        for d in reused:
+            assert matched.get(d) == offered[d]
+        num_reused += len(reused)
+    assert num_reused == tracker.feature_throttle.hits > 0
+
+
+def test_feature_throttle_ignores_crowded_boxes():
+    throttle = FeatureThrottle(min_iou=0.8, max_age=10, max_overlap=0.3)
+    throttle.record([1, 2], [[100., 100., 40., 80.], [300., 100., 40., 80.]], np.eye(2, 4))
+    tlwh = np.array([[101., 100., 40., 80.],    # overlaps track 1 only
+                     [301., 101., 40., 80.],    # overlaps track 2 ...
+                     [320., 100., 40., 80.]])   # ... and so does this one
+    indices, track_ids, features = throttle.lookup(tlwh, np.array([True, True, False]))
+    np.testing.assert_array_equal(indices, [0])
+    np.testing.assert_array_equal(track_ids, [1])
+    np.testing.assert_array_equal(features, np.eye(2, 4)[:1])
+
+    # expired features are dropped
+    for _ in range(10):
+        throttle.advance([1, 2])
+    assert len(throttle) == 2
+    throttle.advance([1, 2])
+    assert len(throttle) == 0
+
+
+@pytest.mark.parametrize('lazy_features', [False, True])
+@pytest.mark.parametrize('seed', range(12))
+def test_reused_features_confirm_tracks(seed, lazy_features):
+    metric = nn_matching.NearestNeighborDistanceMetric('cosine', 0.4, 100)
+    tracker = Tracker(metric, n_init=3, lazy_features=lazy_features, feature_throttle=FeatureThrottle())
+    confirmed = set()
+    for tlwh, features in slow_crowd(seed):
+        detections = DetectionBatch(tlwh, np.ones(len(tlwh)), np.zeros(len(tlwh), dtype=int), None,
+                                    class_names={0: 'person'})
+        tracker.predict()
+        tracker.update(detections, lambda indices: features[indices])
+        tracks = tracker.tracks
+        confirmed.update(tracks.track_id[tracks.state == TrackState.Confirmed].tolist())
+        # every confirmed track can be compared by appearance
+        metric.distance(features[:1], tracks.track_id[tracks.state == TrackState.Confirmed])
+    assert confirmed
+    # with lazy features the detections the throttle could serve are not
+    # encoded at all
+    assert (tracker.feature_throttle.hits > 0) != lazy_features
@@ -12,18 +12,18 @@ physical_devices = tf.config.experimental.list_physical_devices('GPU')
 if len(physical_devices) > 0:
     tf.config.experimental.set_memory_growth(physical_devices[0], True)
 
-def _run_in_batches(f, data_dict, out, batch_size):
-    data_len = len(out)
-    num_batches = int(data_len / batch_size)
+# batch sizes the encoder input is padded to, so the graph only ever sees a
+# few different input shapes
+BATCH_BUCKETS = (8, 16, 32, 64)
 
-    s, e = 0, 0
-    for i in range(num_batches):
-        s, e = i * batch_size, (i + 1) * batch_size
-        batch_data_dict = {k: v[s:e] for k, v in data_dict.items()}
-        out[s:e] = f(batch_data_dict)
-    if e < len(out):
-        batch_data_dict = {k: v[e:] for k, v in data_dict.items()}
-        out[e:] = f(batch_data_dict)
+
+def batch_bucket(size, buckets=BATCH_BUCKETS):
+    """Returns the smallest bucket that holds `size` patches, or the largest
+    bucket if none does."""
+    for bucket in buckets:
+        if size <= bucket:
+            return bucket
+    return buckets[-1]
 
 
 def extract_image_patch(image, bbox, patch_shape):
@@ -73,15 +73,34 @@ def extract_image_patch(image, bbox, patch_shape):
     return image
 
 
-class ImageEncoder(object):
+def load_graph_def(checkpoint_filename):
+    with tf.gfile.GFile(checkpoint_filename, "rb") as file_handle:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(file_handle.read())
+    return graph_def
+
+
+class FrozenGraphBackend(object):
+    """
+    Runs the frozen inference graph in a `tf.compat.v1` session.
+
+    Every encoder backend is called with a batch of patches of shape
+    `(N,) + image_shape` and type `input_dtype` and returns the N x
+    `feature_dim` features.
+
+    Parameters
+    ----------
+    checkpoint_filename : str
+        Path to the frozen inference graph.
+    input_name, output_name : str
+        Names of the input and output tensors of the graph.
+
+    """
 
     def __init__(self, checkpoint_filename, input_name="images",
                  output_name="features"):
         self.session = tf.Session()
-        with tf.gfile.GFile(checkpoint_filename, "rb") as file_handle:
-            graph_def = tf.GraphDef()
-            graph_def.ParseFromString(file_handle.read())
-        tf.import_graph_def(graph_def, name="net")
+        tf.import_graph_def(load_graph_def(checkpoint_filename), name="net")
         self.input_var = tf.get_default_graph().get_tensor_by_name(
             "%s:0" % input_name)
         self.output_var = tf.get_default_graph().get_tensor_by_name(
@@ -91,44 +110,341 @@ class ImageEncoder(object):
         assert len(self.input_var.get_shape()) == 4
         self.feature_dim = self.output_var.get_shape().as_list()[-1]
         self.image_shape = self.input_var.get_shape().as_list()[1:]
+        self.input_dtype = self.input_var.dtype.as_numpy_dtype
+
+    def __call__(self, batch):
+        return self.session.run(self.output_var, feed_dict={self.input_var: batch})
+
 
-    def __call__(self, data_x, batch_size=32):
+class FunctionBackend(object):
+    """
+    Runs the frozen inference graph as a TF2 concrete function, without a
+    session next to the eager detector. See `FrozenGraphBackend`.
+    """
+
+    def __init__(self, checkpoint_filename, input_name="images",
+                 output_name="features"):
+        graph_def = load_graph_def(checkpoint_filename)
+
+        def import_graph_def():
+            # the function graph is empty, so the node names need no prefix
+            tf.import_graph_def(graph_def, name="")
+
+        wrapped = tf.wrap_function(import_graph_def, [])
+        input_var = wrapped.graph.get_tensor_by_name("%s:0" % input_name)
+        output_var = wrapped.graph.get_tensor_by_name("%s:0" % output_name)
+        self.function = wrapped.prune(input_var, output_var)
+
+        self.feature_dim = output_var.get_shape().as_list()[-1]
+        self.image_shape = input_var.get_shape().as_list()[1:]
+        self.input_dtype = input_var.dtype.as_numpy_dtype
+
+    def __call__(self, batch):
+        return self.function(tf.constant(batch)).numpy()
+
+
+class TFLiteBackend(object):
+    """
+    Runs a TensorFlow Lite conversion of the encoder, as written by
+    convert_encoder.py. See `FrozenGraphBackend`.
+
+    The interpreter needs a fixed batch size, so there is one interpreter per
+    batch size. With the bucketed batches of `ImageEncoder` that is one per
+    bucket.
+
+    Parameters
+    ----------
+    model_filename : str
+        Path to the .tflite model.
+    num_threads : Optional[int]
+        Number of CPU threads of every interpreter.
+
+    """
+
+    def __init__(self, model_filename, num_threads=None):
+        self.model_filename = model_filename
+        self.num_threads = num_threads
+        self._interpreters = {}
+        interpreter = self._interpreter(1)
+        input_details = interpreter.get_input_details()[0]
+        self.image_shape = [int(d) for d in input_details['shape'][1:]]
+        self.input_dtype = input_details['dtype']
+        # the converted graph may not know the feature size before it ran
+        self.feature_dim = self(np.zeros([1] + self.image_shape, self.input_dtype)).shape[-1]
+
+    def _interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(
+                model_path=self.model_filename, num_threads=self.num_threads)
+            input_details = interpreter.get_input_details()[0]
+            if input_details['shape'][0] != batch_size:
+                interpreter.resize_tensor_input(
+                    input_details['index'], [batch_size] + list(input_details['shape'][1:]))
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def __call__(self, batch):
+        interpreter = self._interpreter(len(batch))
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+
+
+# the encoder backends by name, see `load_backend`
+BACKENDS = ('graph', 'function', 'tflite')
+
+
+def load_backend(name, model_filename, input_name="images", output_name="features"):
+    """Create the encoder backend `name` (one of `BACKENDS`) for a model, a
+    frozen graph for 'graph' and 'function' or a .tflite file for 'tflite'."""
+    if name == 'graph':
+        return FrozenGraphBackend(model_filename, input_name, output_name)
+    if name == 'function':
+        return FunctionBackend(model_filename, input_name, output_name)
+    if name == 'tflite':
+        return TFLiteBackend(model_filename)
+    raise ValueError('unknown encoder backend {}, use one of {}'.format(name, ', '.join(BACKENDS)))
+
+
+class ImageEncoder(object):
+    """
+    Computes the appearance features of image patches.
+
+    The patches of a call are split into batches of at most the largest
+    bucket, every batch is padded to the smallest bucket that holds it. One
+    feed buffer per bucket is allocated once and reused, so a frame with up
+    to 64 players costs one execution of the network.
+
+    Parameters
+    ----------
+    checkpoint_filename : str
+        Path to the model, see `load_backend`.
+    input_name, output_name : str
+        Names of the input and output tensors of a frozen graph.
+    buckets : Sequence[int]
+        The batch sizes to pad to, in increasing order.
+    backend : str
+        The encoder backend, one of `BACKENDS`.
+
+    """
+
+    def __init__(self, checkpoint_filename, input_name="images",
+                 output_name="features", buckets=BATCH_BUCKETS, backend="graph"):
+        self.backend = load_backend(backend, checkpoint_filename, input_name, output_name)
+        self.feature_dim = self.backend.feature_dim
+        self.image_shape = self.backend.image_shape
+        self.buckets = tuple(sorted(buckets))
+        self._feed_buffers = {}
+
+    def __call__(self, data_x, batch_size=None):
+        """Compute the features of the patches in `data_x`. `batch_size` caps
+        the number of patches per network execution, it defaults to the
+        largest bucket."""
+        batch_size = min(batch_size or self.buckets[-1], self.buckets[-1])
         out = np.zeros((len(data_x), self.feature_dim), np.float32)
-        _run_in_batches(
-            lambda x: self.session.run(self.output_var, feed_dict=x),
-            {self.input_var: data_x}, out, batch_size)
+        for s in range(0, len(data_x), batch_size):
+            e = min(s + batch_size, len(data_x))
+            bucket = batch_bucket(e - s, self.buckets)
+            feed = self._feed_buffers.get(bucket)
+            if feed is None:
+                feed = self._feed_buffers[bucket] = np.zeros(
+                    [bucket] + list(self.image_shape), self.backend.input_dtype)
+            # the rows after e - s are padding, their features are dropped
+            feed[:e - s] = data_x[s:e]
+            out[s:e] = self.backend(feed)[:e - s]
         return out
 
 
+def patch_regions(boxes, patch_shape, image_shape):
+    """Compute the image regions of many patches at once, the vectorized
+    counterpart of the box handling in `extract_image_patch`.
+
+    Parameters
+    ----------
+    boxes : array_like
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    patch_shape : Optional[array_like]
+        The patch shape (height, width) the boxes are adapted to, see
+        `extract_image_patch`.
+    image_shape : array_like
+        The shape of the full image, height and width first.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The Nx4 integer regions in format (min x, min y, max x, max y),
+        clipped at the image boundaries, and a boolean array that is False for
+        the regions that are empty.
+
+    """
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    if patch_shape is not None:
+        # correct aspect ratio to patch shape
+        target_aspect = float(patch_shape[1]) / patch_shape[0]
+        new_width = target_aspect * boxes[:, 3]
+        boxes[:, 0] -= (new_width - boxes[:, 2]) / 2
+        boxes[:, 2] = new_width
+
+    # convert to top left, bottom right
+    boxes[:, 2:] += boxes[:, :2]
+    regions = boxes.astype(np.int64)
+
+    # clip at image boundaries
+    regions[:, :2] = np.maximum(0, regions[:, :2])
+    regions[:, 2:] = np.minimum(np.asarray(image_shape[:2][::-1]) - 1, regions[:, 2:])
+    valid = np.all(regions[:, :2] < regions[:, 2:], axis=1)
+    return regions, valid
+
+
+def resize_regions(image, regions, out):
+    """Crop the regions out of an image and resize them straight into `out`.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    regions : ndarray
+        An Nx4 integer matrix of non-empty regions in format (min x, min y,
+        max x, max y), the max corner is exclusive.
+    out : ndarray
+        A C-contiguous array of shape (N, height, width, channels) to write
+        the patches to.
+
+    """
+    size = (out.shape[2], out.shape[1])
+    for i, (sx, sy, ex, ey) in enumerate(regions):
+        # cv2 writes to dst in place when it has the right shape and type
+        cv2.resize(image[sy:ey, sx:ex], size, dst=out[i])
+    return out
+
+
+class PatchExtractor(object):
+    """
+    Extracts the encoder input patches of all boxes of one or more images into
+    a preallocated buffer that is reused between calls.
+
+    Parameters
+    ----------
+    image_shape : array_like
+        The encoder input shape (height, width, channels).
+    capacity : int
+        The number of patches to allocate space for initially, the buffer
+        grows when more are needed.
+
+    """
+
+    def __init__(self, image_shape, capacity=64):
+        self.image_shape = tuple(image_shape)
+        self._buffer = np.empty((capacity,) + self.image_shape, dtype=np.uint8)
+
+    def __call__(self, images, boxes):
+        """Extract the patches of the boxes of several images.
+
+        Parameters
+        ----------
+        images : List[ndarray]
+            The full images.
+        boxes : List[ndarray]
+            For every image an Nx4 matrix of bounding boxes in format (x, y,
+            width, height).
+
+        Returns
+        -------
+        (ndarray, List[ndarray])
+            The patches of all boxes that could be extracted, image by image,
+            and for every image a boolean array that is False for the boxes
+            that are empty or fully outside of the image. The patches are a
+            view of the buffer, valid until the next call.
+
+        """
+        regions = [patch_regions(b, self.image_shape[:2], image.shape) for image, b in zip(images, boxes)]
+        num_patches = sum(int(valid.sum()) for _, valid in regions)
+        if num_patches > len(self._buffer):
+            self._buffer = np.empty((max(num_patches, 2 * len(self._buffer)),) + self.image_shape,
+                                    dtype=np.uint8)
+        start = 0
+        for image, (image_regions, valid) in zip(images, regions):
+            end = start + int(valid.sum())
+            resize_regions(image, image_regions[valid], self._buffer[start:end])
+            start = end
+        return self._buffer[:num_patches], [valid for _, valid in regions]
+
+
+def extract_image_patches(image, boxes, image_shape):
+    """Extract the encoder input patches for all boxes of one image.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    boxes : ndarray
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    image_shape : array_like
+        The encoder input shape (height, width, channels).
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The patches of shape `image_shape` of the boxes that could be
+        extracted, and a boolean array that is False for the boxes that are
+        empty or fully outside of the image.
+
+    """
+    patches, (valid,) = PatchExtractor(image_shape, max(1, len(boxes)))([image], [boxes])
+    return patches, valid
+
+
 def create_box_encoder(model_filename, input_name="images",
-                       output_name="features", batch_size=32):
-    image_encoder = ImageEncoder(model_filename, input_name, output_name)
-    image_shape = image_encoder.image_shape
+                       output_name="features", batch_size=32, backend="graph"):
+    image_encoder = ImageEncoder(model_filename, input_name, output_name, backend=backend)
+    image_shape = tuple(image_encoder.image_shape)
+    extract_patches = PatchExtractor(image_shape)
 
     def encoder(image, boxes):
-        image_patches = []
-        for box in boxes:
-            patch = extract_image_patch(image, box, image_shape[:2])
-            if patch is None:
+        image_patches, (valid,) = extract_patches([image], [boxes])
+        if not valid.all():
+            for box in np.asarray(boxes).reshape(-1, 4)[~valid]:
                 print("WARNING: Failed to extract image patch: %s." % str(box))
-                patch = np.random.uniform(
-                    0., 255., image_shape).astype(np.uint8)
-            image_patches.append(patch)
-        image_patches = np.asarray(image_patches)
+            patches = np.empty((len(valid),) + image_shape, np.uint8)
+            patches[valid] = image_patches
+            patches[~valid] = np.random.uniform(
+                0., 255., (np.count_nonzero(~valid),) + image_shape).astype(np.uint8)
+            image_patches = patches
         return image_encoder(image_patches, batch_size)
 
     return encoder
 
 
+def create_masked_box_encoder(model_filename, input_name="images",
+                              output_name="features", batch_size=32, backend="graph"):
+    """Like `create_box_encoder`, but boxes that can not be extracted are not
+    encoded from noise. The encoder returns the features of the other boxes
+    and a boolean array that is False for the skipped boxes, see
+    `extract_image_patches`."""
+    image_encoder = ImageEncoder(model_filename, input_name, output_name, backend=backend)
+    extract_patches = PatchExtractor(image_encoder.image_shape)
+
+    def encoder(image, boxes):
+        image_patches, (valid,) = extract_patches([image], [boxes])
+        return image_encoder(image_patches, batch_size), valid
+
+    return encoder
+
+
 def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
     """Generate detections with features.
 
     Parameters
     ----------
-    encoder : Callable[image, ndarray] -> ndarray
+    encoder : Callable[image, ndarray] -> ndarray | (ndarray, ndarray)
         The encoder function takes as input a BGR color image and a matrix of
         bounding boxes in format `(x, y, w, h)` and returns a matrix of
-        corresponding feature vectors.
+        corresponding feature vectors, see `create_box_encoder`. An encoder
+        from `create_masked_box_encoder` also returns a boolean array that is
+        False for the boxes that are empty or fully outside of the image,
+        these detections are dropped.
     mot_dir : str
         Path to the MOTChallenge directory (can be either train or test).
     output_dir
@@ -178,8 +494,10 @@ def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
             bgr_image = cv2.imread(
                 image_filenames[frame_idx], cv2.IMREAD_COLOR)
             features = encoder(bgr_image, rows[:, 2:6].copy())
+            features, valid = features if isinstance(features, tuple) else \
+                (features, np.ones(len(rows), dtype=bool))
             detections_out += [np.r_[(row, feature)] for row, feature
-                               in zip(rows, features)]
+                               in zip(rows[valid], features)]
 
         output_filename = os.path.join(output_dir, "%s.npy" % sequence)
         np.save(
@@ -194,6 +512,10 @@ def parse_args():
         "--model",
         default="resources/networks/mars-small128.pb",
         help="Path to freezed inference graph protobuf.")
+    parser.add_argument(
+        "--backend", default="graph", choices=BACKENDS,
+        help="Encoder backend, tflite expects a --model converted with "
+        "convert_encoder.py.")
     parser.add_argument(
         "--mot_dir", help="Path to MOTChallenge directory (train or test)",
         required=True)
@@ -209,7 +531,7 @@ def parse_args():
 
 def main():
     args = parse_args()
-    encoder = create_box_encoder(args.model, batch_size=32)
+    encoder = create_masked_box_encoder(args.model, batch_size=32, backend=args.backend)
     generate_detections(encoder, args.mot_dir, args.output_dir,
                         args.detection_dir)
 